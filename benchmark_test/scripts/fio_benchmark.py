@@ -0,0 +1,567 @@
+#!/usr/bin/env python3
+"""
+fio benchmark driver.
+
+Runs a fixed set of fio workloads against a target, parses the fio JSON
+output into IOPS, bandwidth and latency percentiles, stores every sample in
+a local SQLite database and compares runs for regressions.
+
+Targets:
+  k8s    a Job with a PVC of the given storage class, e.g. longhorn or the
+         local-path baseline. Needs kubectl and a kubeconfig.
+  local  a file on the local filesystem, to try the harness without a
+         cluster.
+
+Examples:
+  fio_benchmark.py run --label local-path --storage-class local-path
+  fio_benchmark.py run --label v1.9.0-3-replicas --storage-class longhorn
+  fio_benchmark.py run --label offline --target local --path /tmp/fio-test \\
+      --size 256M --runtime 5 --no-direct
+  fio_benchmark.py compare v1.8.1-3-replicas v1.9.0-3-replicas
+"""
+import argparse
+import json
+import math
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+DB_FILE = "fio-benchmark.db"
+# bump on schema changes, see migrate_db
+DB_SCHEMA_VERSION = 1
+
+IMAGE = "yangchiu/kbench:latest"
+NAMESPACE = "default"
+JOB_LABEL = "fio-benchmark"
+JOB_TIMEOUT = 4 * 60 * 60  # in seconds
+JOB_POLL_INTERVAL = 10  # in seconds
+WORKLOAD_MARKER = "### fio-benchmark workload "
+
+DEFAULT_SIZE = "10G"
+DEFAULT_RUNTIME = 60  # in seconds
+DEFAULT_RAMP_TIME = 5  # in seconds
+DEFAULT_RUNS = 3
+DEFAULT_THRESHOLD = 0.05
+
+# workload name -> fio job options
+WORKLOADS = {
+    "rand-read-iops": {"rw": "randread", "bs": "4k", "iodepth": 64,
+                       "numjobs": 4},
+    "rand-write-iops": {"rw": "randwrite", "bs": "4k", "iodepth": 64,
+                        "numjobs": 4},
+    "seq-read-bw": {"rw": "read", "bs": "128k", "iodepth": 16,
+                    "numjobs": 4},
+    "seq-write-bw": {"rw": "write", "bs": "128k", "iodepth": 16,
+                     "numjobs": 4},
+    "rand-read-lat": {"rw": "randread", "bs": "4k", "iodepth": 1,
+                      "numjobs": 1},
+    "rand-write-lat": {"rw": "randwrite", "bs": "4k", "iodepth": 1,
+                       "numjobs": 1},
+}
+
+# metric -> True if higher is better
+METRICS = {
+    "iops": True,
+    "bw_mib": True,
+    "lat_mean_us": False,
+    "lat_p99_us": False,
+    "lat_p999_us": False,
+}
+
+# two-sided 95% critical values of Student's t distribution by degrees of
+# freedom, the normal value beyond the table
+T_CRITICAL_95 = [
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+]
+Z_95 = 1.960
+
+
+def fio_args(workload, filename, size, runtime, ramp_time, ioengine, direct):
+    args = [
+        f"--name={workload}",
+        f"--filename={filename}",
+        f"--size={size}",
+        f"--ioengine={ioengine}",
+        f"--direct={1 if direct else 0}",
+        "--time_based=1",
+        f"--runtime={runtime}",
+        f"--ramp_time={ramp_time}",
+        "--group_reporting=1",
+        "--percentile_list=50:99:99.9",
+        "--output-format=json",
+    ]
+    for k, v in WORKLOADS[workload].items():
+        args.append(f"--{k}={v}")
+    return args
+
+
+def parse_fio_output(output):
+    """
+    Return the metrics of one fio JSON report, summed over jobs and
+    directions, latencies from the direction that did the I/O.
+    """
+    # fio may print warnings before the JSON document
+    report = json.loads(output[output.index("{"):])
+    iops = 0.0
+    bw_kib = 0.0
+    lat = None
+    for job in report["jobs"]:
+        for direction in ("read", "write"):
+            stats = job[direction]
+            if stats["total_ios"] == 0:
+                continue
+            iops += stats["iops"]
+            bw_kib += stats["bw"]
+            clat = stats["clat_ns"]
+            percentile = clat.get("percentile", {})
+            job_lat = {
+                "lat_mean_us": clat["mean"] / 1000,
+                "lat_p99_us": percentile.get("99.000000", 0) / 1000,
+                "lat_p999_us": percentile.get("99.900000", 0) / 1000,
+            }
+            if lat is None or job_lat["lat_mean_us"] > lat["lat_mean_us"]:
+                lat = job_lat
+    metrics = {"iops": iops, "bw_mib": bw_kib / 1024}
+    metrics.update(lat or {"lat_mean_us": 0.0, "lat_p99_us": 0.0,
+                           "lat_p999_us": 0.0})
+    return metrics
+
+
+class LocalTarget:
+    """
+    Runs fio on a local file.
+    """
+
+    def __init__(self, path, fio="fio", ioengine="libaio", direct=True):
+        self.path = path
+        self.fio = fio
+        self.ioengine = ioengine
+        self.direct = direct
+
+    def describe(self):
+        return f"local:{self.path}"
+
+    def run(self, workloads, size, runtime, ramp_time):
+        results = {}
+        try:
+            for workload in workloads:
+                print(f"running {workload} on {self.path}")
+                output = subprocess.check_output(
+                    [self.fio] + fio_args(workload, self.path, size, runtime,
+                                          ramp_time, self.ioengine,
+                                          self.direct),
+                    universal_newlines=True)
+                results[workload] = parse_fio_output(output)
+        finally:
+            if os.path.isfile(self.path):
+                os.remove(self.path)
+        return results
+
+
+class KubernetesTarget:
+    """
+    Runs fio in a Job on a PVC of the storage class, and reads the fio JSON
+    reports back from the pod log.
+    """
+
+    def __init__(self, storage_class, volume_size, namespace=NAMESPACE,
+                 image=IMAGE, volume_mode="Filesystem"):
+        self.storage_class = storage_class
+        self.volume_size = volume_size
+        self.namespace = namespace
+        self.image = image
+        self.volume_mode = volume_mode
+
+    def describe(self):
+        return f"k8s:{self.storage_class}"
+
+    def kubectl(self, *args, stdin=None):
+        return subprocess.run(
+            ["kubectl", "-n", self.namespace] + list(args), input=stdin,
+            check=True, universal_newlines=True,
+            stdout=subprocess.PIPE).stdout
+
+    def manifests(self, name, workloads, size, runtime, ramp_time):
+        filename = "/volume/test"
+        if self.volume_mode == "Block":
+            mount = {"volumeDevices": [{"name": "vol",
+                                        "devicePath": filename}]}
+        else:
+            mount = {"volumeMounts": [{"name": "vol",
+                                       "mountPath": "/volume/"}]}
+
+        script = ["set -e"]
+        for workload in workloads:
+            args = fio_args(workload, filename, size, runtime, ramp_time,
+                            "libaio", True)
+            script.append(f"echo '{WORKLOAD_MARKER}{workload}'")
+            script.append("fio " + " ".join(args))
+
+        pvc = {
+            "apiVersion": "v1",
+            "kind": "PersistentVolumeClaim",
+            "metadata": {"name": name, "labels": {"app": JOB_LABEL}},
+            "spec": {
+                "volumeMode": self.volume_mode,
+                "storageClassName": self.storage_class,
+                "accessModes": ["ReadWriteOnce"],
+                "resources": {"requests": {"storage": self.volume_size}},
+            },
+        }
+        container = {
+            "name": "fio",
+            "image": self.image,
+            "command": ["sh", "-c", "\n".join(script)],
+        }
+        container.update(mount)
+        job = {
+            "apiVersion": "batch/v1",
+            "kind": "Job",
+            "metadata": {"name": name, "labels": {"app": JOB_LABEL}},
+            "spec": {
+                "backoffLimit": 0,
+                "template": {
+                    "metadata": {"labels": {"app": JOB_LABEL}},
+                    "spec": {
+                        "restartPolicy": "Never",
+                        "containers": [container],
+                        "volumes": [{
+                            "name": "vol",
+                            "persistentVolumeClaim": {"claimName": name},
+                        }],
+                    },
+                },
+            },
+        }
+        return {"apiVersion": "v1", "kind": "List", "items": [pvc, job]}
+
+    def run(self, workloads, size, runtime, ramp_time):
+        name = f"{JOB_LABEL}-{uuid.uuid4().hex[:8]}"
+        manifest = json.dumps(self.manifests(name, workloads, size, runtime,
+                                             ramp_time))
+        self.kubectl("apply", "-f", "-", stdin=manifest)
+        try:
+            print(f"waiting for job {name} on {self.storage_class}")
+            self.wait_for_job(name)
+            log = self.kubectl("logs", f"job/{name}")
+        finally:
+            self.kubectl("delete", "--ignore-not-found", "--wait=false",
+                         "-f", "-", stdin=manifest)
+        return parse_job_log(log)
+
+    def wait_for_job(self, name):
+        # kubectl wait --for=condition=complete never returns for a failed
+        # Job, so poll for either outcome
+        deadline = time.time() + JOB_TIMEOUT
+        while time.time() < deadline:
+            status = self.kubectl(
+                "get", f"job/{name}", "-o",
+                "jsonpath={.status.succeeded},{.status.failed}")
+            succeeded, _, failed = status.partition(",")
+            if succeeded and int(succeeded) > 0:
+                return
+            if failed and int(failed) > 0:
+                try:
+                    log = self.kubectl("logs", f"job/{name}")
+                except subprocess.CalledProcessError:
+                    log = "(no pod log)"
+                sys.exit(f"job {name} failed, pod log:\n{log}")
+            time.sleep(JOB_POLL_INTERVAL)
+        sys.exit(f"job {name} did not finish within {JOB_TIMEOUT}s")
+
+
+def parse_job_log(log):
+    results = {}
+    for section in log.split(WORKLOAD_MARKER)[1:]:
+        workload, _, output = section.partition("\n")
+        results[workload.strip()] = parse_fio_output(output)
+    return results
+
+
+def open_db(path):
+    db = sqlite3.connect(path)
+    migrate_db(db)
+    return db
+
+
+def migrate_db(db):
+    version = db.execute("PRAGMA user_version").fetchone()[0]
+    if version > DB_SCHEMA_VERSION:
+        sys.exit(f"{DB_FILE} has schema version {version}, newer than "
+                 f"{DB_SCHEMA_VERSION} supported by this script")
+    if version < 1:
+        db.executescript("""
+            CREATE TABLE runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                label TEXT NOT NULL,
+                target TEXT NOT NULL,
+                longhorn_version TEXT,
+                size TEXT NOT NULL,
+                runtime INTEGER NOT NULL,
+                started_at REAL NOT NULL
+            );
+            CREATE TABLE samples (
+                run_id INTEGER NOT NULL REFERENCES runs(id),
+                iteration INTEGER NOT NULL,
+                workload TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                value REAL NOT NULL
+            );
+            CREATE INDEX samples_run ON samples (run_id, workload, metric);
+            CREATE INDEX runs_label ON runs (label);
+        """)
+    db.execute(f"PRAGMA user_version = {DB_SCHEMA_VERSION}")
+    db.commit()
+
+
+def save_run(db, label, target, longhorn_version, size, runtime, started_at,
+             iterations):
+    cursor = db.execute(
+        "INSERT INTO runs (label, target, longhorn_version, size, runtime, "
+        "started_at) VALUES (?, ?, ?, ?, ?, ?)",
+        (label, target, longhorn_version, size, runtime, started_at))
+    run_id = cursor.lastrowid
+    db.executemany(
+        "INSERT INTO samples (run_id, iteration, workload, metric, value) "
+        "VALUES (?, ?, ?, ?, ?)",
+        [(run_id, iteration, workload, metric, value)
+         for iteration, results in enumerate(iterations)
+         for workload, metrics in results.items()
+         for metric, value in metrics.items()])
+    db.commit()
+    return run_id
+
+
+def load_samples(db, label):
+    """
+    Return {(workload, metric): [values]} of every run with the label.
+    """
+    samples = {}
+    rows = db.execute(
+        "SELECT s.workload, s.metric, s.value FROM samples s "
+        "JOIN runs r ON r.id = s.run_id WHERE r.label = ? "
+        "ORDER BY r.id, s.iteration", (label,))
+    for workload, metric, value in rows:
+        samples.setdefault((workload, metric), []).append(value)
+    return samples
+
+
+def t_critical(df):
+    if df < 1:
+        return float("inf")
+    index = int(math.floor(df)) - 1
+    if index < len(T_CRITICAL_95):
+        return T_CRITICAL_95[index]
+    return Z_95
+
+
+def mean_ci(values):
+    """
+    Return (mean, half width of the 95% confidence interval).
+    """
+    mean = statistics.mean(values)
+    if len(values) < 2:
+        return mean, float("nan")
+    sem = statistics.stdev(values) / math.sqrt(len(values))
+    return mean, t_critical(len(values) - 1) * sem
+
+
+def diff_ci(baseline, candidate):
+    """
+    Return (candidate mean - baseline mean, half width of its 95% Welch
+    confidence interval).
+    """
+    diff = statistics.mean(candidate) - statistics.mean(baseline)
+    if len(baseline) < 2 or len(candidate) < 2:
+        return diff, float("nan")
+    vb = statistics.variance(baseline) / len(baseline)
+    vc = statistics.variance(candidate) / len(candidate)
+    se = math.sqrt(vb + vc)
+    if se == 0:
+        return diff, 0.0
+    df = (vb + vc) ** 2 / (vb ** 2 / (len(baseline) - 1) +
+                           vc ** 2 / (len(candidate) - 1))
+    return diff, t_critical(df) * se
+
+
+def compare(baseline, candidate, threshold):
+    """
+    Compare the samples of two labels. A metric regresses when it got worse
+    by more than the threshold and, with at least two samples on each side,
+    the confidence interval of the difference excludes zero.
+    """
+    rows = []
+    regressions = []
+    for key in sorted(set(baseline) & set(candidate)):
+        workload, metric = key
+        higher_is_better = METRICS.get(metric, True)
+        base_mean, base_ci = mean_ci(baseline[key])
+        cand_mean, cand_ci = mean_ci(candidate[key])
+        diff, ci = diff_ci(baseline[key], candidate[key])
+        change = diff / base_mean if base_mean else 0.0
+        worse = -change if higher_is_better else change
+        significant = math.isnan(ci) or abs(diff) > ci
+        regressed = worse > threshold and significant
+        rows.append((workload, metric, base_mean, base_ci, cand_mean,
+                     cand_ci, change, regressed))
+        if regressed:
+            regressions.append(key)
+    return rows, regressions
+
+
+def format_ci(mean, ci):
+    if math.isnan(ci):
+        return f"{mean:12.1f}"
+    return f"{mean:12.1f} ±{ci:<8.1f}"
+
+
+def print_comparison(rows):
+    print(f"{'workload':16} {'metric':12} {'baseline':>22} "
+          f"{'candidate':>22} {'change':>8}")
+    for (workload, metric, base_mean, base_ci, cand_mean, cand_ci, change,
+         regressed) in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{workload:16} {metric:12} {format_ci(base_mean, base_ci):>22}"
+              f" {format_ci(cand_mean, cand_ci):>22} {change:+8.1%}{flag}")
+
+
+def get_target(args):
+    if args.target == "local":
+        return LocalTarget(args.path, fio=args.fio, ioengine=args.ioengine,
+                           direct=args.direct)
+    return KubernetesTarget(args.storage_class, args.volume_size,
+                            namespace=args.namespace, image=args.image,
+                            volume_mode=args.volume_mode)
+
+
+def cmd_run(args):
+    workloads = args.workloads or list(WORKLOADS)
+    for workload in workloads:
+        if workload not in WORKLOADS:
+            sys.exit(f"unknown workload {workload}, "
+                     f"choose from {', '.join(WORKLOADS)}")
+    target = get_target(args)
+    started_at = time.time()
+    iterations = []
+    for i in range(args.runs):
+        print(f"run {i + 1}/{args.runs} on {target.describe()}")
+        iterations.append(target.run(workloads, args.size, args.runtime,
+                                     args.ramp_time))
+
+    db = open_db(args.db)
+    run_id = save_run(db, args.label, target.describe(),
+                      args.longhorn_version, args.size, args.runtime,
+                      started_at, iterations)
+    print(f"saved run {run_id} as {args.label}")
+    samples = {}
+    for results in iterations:
+        for workload, metrics in results.items():
+            for metric, value in metrics.items():
+                samples.setdefault((workload, metric), []).append(value)
+    for (workload, metric), values in sorted(samples.items()):
+        print(f"{workload:16} {metric:12} "
+              f"{format_ci(*mean_ci(values)):>22}")
+
+
+def cmd_compare(args):
+    db = open_db(args.db)
+    baseline = load_samples(db, args.baseline)
+    candidate = load_samples(db, args.candidate)
+    if not baseline or not candidate:
+        sys.exit(f"no samples for {args.baseline if not baseline else ''}"
+                 f"{args.candidate if not candidate else ''}")
+    rows, regressions = compare(baseline, candidate, args.threshold)
+    print_comparison(rows)
+    if regressions:
+        print(f"{len(regressions)} regressions of {args.candidate} against "
+              f"{args.baseline}")
+        sys.exit(1)
+
+
+def cmd_list(args):
+    db = open_db(args.db)
+    rows = db.execute(
+        "SELECT r.label, r.target, r.longhorn_version, COUNT(*), "
+        "MAX(r.started_at) FROM runs r GROUP BY r.label, r.target, "
+        "r.longhorn_version ORDER BY MAX(r.started_at)")
+    for label, target, version, count, started_at in rows:
+        last = time.strftime("%Y-%m-%d %H:%M", time.localtime(started_at))
+        print(f"{label:32} {target:24} {version or '-':16} {count:3} runs, "
+              f"last {last}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fio benchmark driver")
+    parser.add_argument("--db", default=DB_FILE,
+                        help=f"result database (default: {DB_FILE})")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="run the workloads and store "
+                                            "the results under a label")
+    run.add_argument("--label", required=True)
+    run.add_argument("--longhorn-version", default=None)
+    run.add_argument("--target", choices=["k8s", "local"], default="k8s")
+    run.add_argument("--workloads", nargs="*", default=None,
+                     help=f"subset of {', '.join(WORKLOADS)}")
+    run.add_argument("--runs", type=int, default=DEFAULT_RUNS,
+                     help="repetitions of the workloads, at least 2 to get "
+                          "confidence intervals")
+    run.add_argument("--size", default=DEFAULT_SIZE,
+                     help="size of the fio test file")
+    run.add_argument("--runtime", type=int, default=DEFAULT_RUNTIME)
+    run.add_argument("--ramp-time", type=int, default=DEFAULT_RAMP_TIME)
+    run.add_argument("--storage-class", default="longhorn")
+    run.add_argument("--volume-size", default=None,
+                     help="PVC size (default: size + 10%%)")
+    run.add_argument("--volume-mode", choices=["Filesystem", "Block"],
+                     default="Filesystem")
+    run.add_argument("--namespace", default=NAMESPACE)
+    run.add_argument("--image", default=IMAGE)
+    run.add_argument("--path", default="/tmp/fio-benchmark.dat",
+                     help="test file of the local target")
+    run.add_argument("--fio", default="fio", help="fio binary of the local "
+                                                  "target")
+    run.add_argument("--ioengine", default="libaio")
+    run.add_argument("--no-direct", dest="direct", action="store_false",
+                     help="buffered I/O for the local target, e.g. on tmpfs")
+    run.set_defaults(func=cmd_run)
+
+    cmp = subparsers.add_parser("compare", help="compare a candidate label "
+                                                "against a baseline label")
+    cmp.add_argument("baseline")
+    cmp.add_argument("candidate")
+    cmp.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                     help="relative change counted as a regression")
+    cmp.set_defaults(func=cmd_compare)
+
+    lst = subparsers.add_parser("list", help="list the stored runs")
+    lst.set_defaults(func=cmd_list)
+
+    args = parser.parse_args()
+    if getattr(args, "volume_size", None) is None and args.command == "run":
+        args.volume_size = volume_size_for(args.size)
+    args.func(args)
+
+
+def volume_size_for(size):
+    """
+    PVC size for a fio file size, 10% larger for the filesystem overhead.
+    """
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    value = size.rstrip("iB")
+    unit = value[-1].upper()
+    if unit in units:
+        size_bytes = float(value[:-1]) * units[unit]
+    else:
+        size_bytes = float(value)
+    return f"{math.ceil(size_bytes * 1.1 / (1 << 20))}Mi"
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
 from abc import ABC, abstractmethod
 
 from utility.utility import set_annotation
+from utility.utility import set_annotations
 from utility.utility import get_annotation_value
+from utility.watcher import find_cached_crs_by_annotation
 
 
 class Base(ABC):
@@ -24,6 +26,29 @@ class Base(ABC):
             annotation_value=backup_id
         )
 
+    def set_backup_metadata(self, backup_name, backup_id, checksum):
+        set_annotations(
+            group="longhorn.io",
+            version="v1beta2",
+            namespace="longhorn-system",
+            plural="backups",
+            name=backup_name,
+            annotations={
+                self.ANNOT_ID: backup_id,
+                self.ANNOT_DATA_CHECKSUM: checksum,
+            }
+        )
+
+    def find_backup_names(self, backup_id):
+        return find_cached_crs_by_annotation(
+            group="longhorn.io",
+            version="v1beta2",
+            namespace="longhorn-system",
+            plural="backups",
+            key=self.ANNOT_ID,
+            value=backup_id
+        )
+
     def get_backup_id(self, backup_name):
         return get_annotation_value(
             group="longhorn.io",
@@ -1,5 +1,7 @@
 import time
 
+from kubernetes.client.rest import ApiException
+
 from backup.base import Base
 from backup.crd import CRD
 
@@ -9,6 +11,7 @@ from utility.utility import logging
 from utility.utility import get_all_crs
 from utility.utility import get_longhorn_client
 from utility.utility import get_retry_count_and_interval
+from utility.watcher import get_cached_cr
 
 from volume import Rest as RestVolume
 
@@ -49,18 +52,33 @@ class Rest(Base):
         assert volume.lastBackupAt != "", \
             f"expect volume lastBackupAt is not empty, but it's {volume.lastBackupAt}"
 
-        self.set_backup_id(backup.name, backup_id)
-        self.set_data_checksum(backup.name, self.volume.get_last_data_checksum(volume_name))
+        self.set_backup_metadata(backup.name, backup_id,
+                                 self.volume.get_last_data_checksum(volume_name))
 
         return backup
 
     def get(self, backup_id, volume_name):
+        # the backup id annotation is looked up in the index of the backup
+        # watch cache, backup_id may also be the backup name itself
+        backup_names = self.find_backup_names(backup_id) + [backup_id]
+        if not volume_name:
+            volume_name = self.get_backup_volume_name(backup_names)
         backups = self.list(volume_name)
-        for backup in backups:
-            if self.get_backup_id(backup.name) == backup_id:
-                return backup
-            elif backup.name == backup_id:
-                return backup
+        for backup_name in backup_names:
+            for backup in backups:
+                if backup.name == backup_name:
+                    return backup
+        return None
+
+    def get_backup_volume_name(self, backup_names):
+        for backup_name in backup_names:
+            try:
+                backup = get_cached_cr("longhorn.io", "v1beta2", "longhorn-system", "backups", backup_name)
+            except ApiException:
+                continue
+            volume_name = backup.get('status', {}).get('volumeName')
+            if volume_name:
+                return volume_name
         return None
 
     def get_latest(self, volume_name):
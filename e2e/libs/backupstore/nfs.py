@@ -1,3 +1,4 @@
+import itertools
 import os
 import subprocess
 import time
@@ -10,13 +11,37 @@ from backupstore.base import Base
 
 from urllib.parse import urlparse
 
+
+def walk_files(directory):
+    """
+    Yield the paths of the regular files under the directory, walked in
+    process with os.scandir instead of a find subprocess. A missing
+    directory has no files.
+    """
+    dirs = [directory]
+    while dirs:
+        try:
+            with os.scandir(dirs.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry.path
+        except FileNotFoundError:
+            continue
+
+
 class Nfs(Base):
 
     def __init__(self):
         super().__init__()
+        self.mount_point = None
         self.mount_nfs_backupstore()
 
     def mount_nfs_backupstore(self, mount_path="/mnt/nfs"):
+        # every keyword library instance shares the mount of the run
+        if os.path.ismount(mount_path):
+            return
         cmd = ["mkdir", "-p", mount_path]
         subprocess.check_output(cmd)
         nfs_backuptarget = self.backup_target
@@ -30,8 +55,12 @@ class Nfs(Base):
         subprocess.check_output(cmd)
         cmd = ["rmdir", mount_path]
         subprocess.check_output(cmd)
+        self.mount_point = None
 
     def get_nfs_mount_point(self):
+        if self.mount_point is not None:
+            return self.mount_point
+
         nfs_backuptarget = self.backup_target
         nfs_url = urlparse(nfs_backuptarget).netloc + \
             urlparse(nfs_backuptarget).path
@@ -41,7 +70,8 @@ class Nfs(Base):
         mount_info = stdout.decode().strip().split(" ")
 
         assert mount_info[0] == nfs_url
-        return mount_info[1]
+        self.mount_point = mount_info[1]
+        return self.mount_point
 
     def get_backup_volume_prefix(self, volume_name):
         mount_point = self.get_nfs_mount_point()
@@ -95,28 +125,29 @@ class Nfs(Base):
             print("error while deleting backup cfg file:", nfs_volume_cfg_path)
             print(ex)
 
-    def delete_random_backup_block(self, volume_name):
+    def list_backup_block_files(self, volume_name, limit=None):
         backup_blocks_dir = self.get_backup_blocks_dir(volume_name)
-        cmd = ["find", backup_blocks_dir, "-type", "f"]
-        find_cmd = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-        head_cmd = subprocess.check_output(["/usr/bin/head", "-1"], stdin=find_cmd.stdout)
-        backup_block_file_path = head_cmd.decode().strip()
+        return list(itertools.islice(walk_files(backup_blocks_dir), limit))
+
+    def delete_backup_blocks(self, volume_name, count=None):
+        backup_block_file_paths = self.list_backup_block_files(volume_name,
+                                                               limit=count)
+        for backup_block_file_path in backup_block_file_paths:
+            try:
+                os.remove(backup_block_file_path)
+            except Exception as ex:
+                print("error while deleting backup block file:",
+                      backup_block_file_path)
+                print(ex)
+        return backup_block_file_paths
 
-        try:
-            os.remove(backup_block_file_path)
-        except Exception as ex:
-            print("error while deleting backup block file:",
-                  backup_block_file_path)
-            print(ex)
+    def delete_random_backup_block(self, volume_name):
+        deleted = self.delete_backup_blocks(volume_name, count=1)
+        assert len(deleted) == 1, f"No backup block of volume {volume_name}"
 
     def count_backup_block_files(self, volume_name):
         backup_blocks_dir = self.get_backup_blocks_dir(volume_name)
-        cmd = ["find", backup_blocks_dir, "-type", "f"]
-        find_cmd = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-        wc_cmd = subprocess.check_output(["/usr/bin/wc", "-l"], stdin=find_cmd.stdout)
-        backup_blocks_count = int(wc_cmd.decode().strip())
-
-        return backup_blocks_count
+        return sum(1 for _ in walk_files(backup_blocks_dir))
 
     def cleanup_backup_volumes(self):
         super().cleanup_backup_volumes()
@@ -1,10 +1,18 @@
+import atexit
 import os
 import base64
+import io
+import itertools
 import json
+import queue
+import re
 import tempfile
 import subprocess
+import threading
 import time
 
+import urllib3
+
 from minio import Minio
 from minio.error import ResponseError
 
@@ -16,45 +24,164 @@ from urllib.parse import urlparse
 from utility.utility import logging
 from utility.utility import subprocess_exec_cmd
 
-class S3(Base):
 
-    MINIO_SERVER_PORT = 9000
-    PORT_FORWARD = 39000
+class MinioSession:
+    """
+    One port-forward to the MinIO service and one pooled client shared by
+    every S3 helper of the run.
 
-    def port_forward(self):
-        return subprocess.Popen(
-            ["/usr/local/bin/kubectl", "port-forward", "service/minio-service", f"{self.PORT_FORWARD}:{self.MINIO_SERVER_PORT}"])
+    The port-forward listens on a random local port, so parallel runs on the
+    same host do not collide, and it is restarted if kubectl exits. The
+    secret is read and the CA cert written once, when the session starts.
+    """
 
-    def get_api_client(self, minio_secret_name):
-        secret = self.core_api.read_namespaced_secret(name=minio_secret_name,
+    MINIO_SERVICE = "service/minio-service"
+    MINIO_SERVER_PORT = 9000
+    PORT_FORWARD_TIMEOUT = 30
+    FORWARDING_REGEX = re.compile(r"Forwarding from 127\.0\.0\.1:(\d+)")
+
+    def __init__(self, core_api, minio_secret_name):
+        self.core_api = core_api
+        self.secret_name = minio_secret_name
+        self.lock = threading.Lock()
+        self.process = None
+        self.minio = None
+        self.http = None
+        self.cert_file_path = None
+
+    def _load_secret(self):
+        secret = self.core_api.read_namespaced_secret(name=self.secret_name,
                                                       namespace='longhorn-system')
 
-        base64_minio_access_key = secret.data['AWS_ACCESS_KEY_ID']
-        base64_minio_secret_key = secret.data['AWS_SECRET_ACCESS_KEY']
-        base64_minio_endpoint_url = secret.data['AWS_ENDPOINTS']
-        base64_minio_cert = secret.data['AWS_CERT']
-
-        minio_access_key = \
-            base64.b64decode(base64_minio_access_key).decode("utf-8")
-        minio_secret_key = \
-            base64.b64decode(base64_minio_secret_key).decode("utf-8")
-
-        minio_endpoint_url = \
-            base64.b64decode(base64_minio_endpoint_url).decode("utf-8")
-        minio_endpoint_url = f"localhost:{self.PORT_FORWARD}"
+        self.access_key = \
+            base64.b64decode(secret.data['AWS_ACCESS_KEY_ID']).decode("utf-8")
+        self.secret_key = \
+            base64.b64decode(secret.data['AWS_SECRET_ACCESS_KEY']).decode("utf-8")
+
+        fd, self.cert_file_path = tempfile.mkstemp(prefix="minio_cert_",
+                                                   suffix=".crt")
+        with os.fdopen(fd, 'w') as minio_cert_file:
+            minio_cert_file.write(
+                base64.b64decode(secret.data['AWS_CERT']).decode("utf-8"))
+
+        self.http = urllib3.PoolManager(
+            timeout=urllib3.Timeout.DEFAULT_TIMEOUT,
+            maxsize=10,
+            cert_reqs='CERT_REQUIRED',
+            ca_certs=self.cert_file_path,
+            retries=urllib3.Retry(total=5,
+                                  backoff_factor=0.2,
+                                  status_forcelist=[500, 502, 503, 504]))
+
+    def _drain(self, process, ports):
+        # kubectl logs every forwarded connection, keep reading its output
+        # so it never blocks on a full pipe
+        for line in process.stdout:
+            match = self.FORWARDING_REGEX.search(line)
+            if match:
+                ports.put(int(match.group(1)))
+        ports.put(None)
+
+    def _start_port_forward(self):
+        process = subprocess.Popen(
+            ["/usr/local/bin/kubectl", "port-forward", self.MINIO_SERVICE,
+             f":{self.MINIO_SERVER_PORT}"],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        ports = queue.Queue()
+        threading.Thread(target=self._drain, args=(process, ports),
+                         daemon=True).start()
+        try:
+            port = ports.get(timeout=self.PORT_FORWARD_TIMEOUT)
+        except queue.Empty:
+            port = None
+        if port is None:
+            process.kill()
+            raise Exception(f"Failed to port-forward {self.MINIO_SERVICE}")
+
+        logging(f"Port-forwarded {self.MINIO_SERVICE} to localhost:{port}")
+        self.process = process
+        self.minio = Minio(f"localhost:{port}",
+                           access_key=self.access_key,
+                           secret_key=self.secret_key,
+                           secure=True,
+                           http_client=self.http)
+
+    @property
+    def client(self):
+        with self.lock:
+            if self.http is None:
+                self._load_secret()
+            if self.process is None or self.process.poll() is not None:
+                self._start_port_forward()
+            return self.minio
+
+    def put_object(self, bucket_name, object_name, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.client.put_object(bucket_name, object_name, io.BytesIO(data),
+                               len(data))
+
+    def get_object(self, bucket_name, object_name):
+        return self.client.get_object(bucket_name, object_name).data
+
+    def list_objects(self, bucket_name, prefix, limit=None):
+        objects = self.client.list_objects(bucket_name, prefix=prefix,
+                                           recursive=True)
+        return [obj.object_name for obj in itertools.islice(objects, limit)]
+
+    def count_objects(self, bucket_name, prefix):
+        return sum(1 for _ in self.client.list_objects(bucket_name,
+                                                       prefix=prefix,
+                                                       recursive=True))
+
+    def delete_objects(self, bucket_name, object_names):
+        """
+        Delete the objects with multi-object delete requests and return the
+        errors, remove_objects only sends them while its result is consumed.
+        """
+        return list(self.client.remove_objects(bucket_name, object_names))
+
+    def close(self):
+        with self.lock:
+            if self.process is not None:
+                self.process.kill()
+                self.process.wait()
+                self.process = None
+            if self.http is not None:
+                self.http.clear()
+                self.http = None
+            if self.cert_file_path is not None:
+                os.remove(self.cert_file_path)
+                self.cert_file_path = None
+
+
+_minio_sessions = {}
+_minio_sessions_lock = threading.Lock()
+
+
+def get_minio_session(core_api, minio_secret_name):
+    with _minio_sessions_lock:
+        session = _minio_sessions.get(minio_secret_name)
+        if session is None:
+            session = MinioSession(core_api, minio_secret_name)
+            _minio_sessions[minio_secret_name] = session
+        return session
+
+
+@atexit.register
+def close_minio_sessions():
+    with _minio_sessions_lock:
+        for session in _minio_sessions.values():
+            session.close()
+        _minio_sessions.clear()
 
-        minio_cert_file_path = os.path.join(os.getcwd(), "minio_cert.crt")
-        with open(minio_cert_file_path, 'w') as minio_cert_file:
-            base64_minio_cert = \
-                base64.b64decode(base64_minio_cert).decode("utf-8")
-            minio_cert_file.write(base64_minio_cert)
 
-        os.environ["SSL_CERT_FILE"] = minio_cert_file_path
+class S3(Base):
 
-        return Minio(minio_endpoint_url,
-                     access_key=minio_access_key,
-                     secret_key=minio_secret_key,
-                     secure=True)
+    @property
+    def session(self):
+        assert self.secret != ''
+        return get_minio_session(self.core_api, self.secret)
 
     def get_backupstore_bucket_name(self):
         backupstore = self.backup_target
@@ -86,137 +213,82 @@ class S3(Base):
         return prefix + "/blocks"
 
     def create_file_in_backupstore(self, file_path, data={}): # NOQA
-
-        process = self.port_forward()
-
-        secret_name = self.secret
-
-        minio_api = self.get_api_client(secret_name)
         bucket_name = self.get_backupstore_bucket_name()
 
         if len(data) == 0:
             data = {"testkey": "test data from create_file_in_backupstore()"}
 
-        with tempfile.NamedTemporaryFile('w') as fp:
-            json.dump(data, fp)
-            fp.flush()
-            try:
-                with open(fp.name, mode='rb') as f:
-                    temp_file_stat = os.stat(fp.name)
-                    minio_api.put_object(bucket_name,
-                                         file_path,
-                                         f,
-                                         temp_file_stat.st_size)
-                    read_back = minio_api.get_object(bucket_name,
-                                                     file_path)
-                    assert read_back.data.decode("utf-8") == json.dumps(data), f"{read_back.data.decode('utf-8')}, {json.dumps(data)}"
-                    logging(f"Created file {file_path} in backupstore")
-            except ResponseError as err:
-                print(err)
-
-        process.kill()
+        try:
+            self.session.put_object(bucket_name, file_path, json.dumps(data))
+            read_back = self.session.get_object(bucket_name, file_path)
+            assert read_back.decode("utf-8") == json.dumps(data), f"{read_back.decode('utf-8')}, {json.dumps(data)}"
+            logging(f"Created file {file_path} in backupstore")
+        except ResponseError as err:
+            print(err)
 
     def write_backup_cfg_file(self, volume_name, backup_name, backup_cfg_data): # NOQA
-        secret_name = self.secret
-        assert secret_name != ''
-
-        minio_api = self.get_api_client(secret_name)
         bucket_name = self.get_backupstore_bucket_name()
         minio_backup_cfg_file_path = self.get_backup_cfg_file_path(volume_name,
                                                                    backup_name)
 
-        with tempfile.NamedTemporaryFile(delete_on_close=False) as fp:
-            fp.write(str(backup_cfg_data))
-            fp.close()
-            try:
-                with open(fp.name, mode='rb') as f:
-                    tmp_bkp_cfg_file_stat = os.stat(fp.name)
-                    minio_api.put_object(bucket_name,
-                                         minio_backup_cfg_file_path,
-                                         f,
-                                         tmp_bkp_cfg_file_stat.st_size)
-            except ResponseError as err:
-                print(err)
+        try:
+            self.session.put_object(bucket_name,
+                                    minio_backup_cfg_file_path,
+                                    str(backup_cfg_data))
+        except ResponseError as err:
+            print(err)
 
     def delete_file_in_backupstore(self, file_path):
-
-        process = self.port_forward()
-
-        secret_name = self.secret
-
-        minio_api = self.get_api_client(secret_name)
         bucket_name = self.get_backupstore_bucket_name()
 
         try:
-            minio_api.remove_object(bucket_name, file_path)
+            self.session.client.remove_object(bucket_name, file_path)
         except ResponseError as err:
             print(err)
         logging(f"Deleted file {file_path} in backupstore")
 
-        process.kill()
-
     def delete_backup_cfg_file(self, volume_name, backup_name):
-        secret_name = self.secret
-        assert secret_name != ''
-
-        minio_api = self.get_api_client(secret_name)
         bucket_name = self.get_backupstore_bucket_name()
         minio_backup_cfg_file_path = self.get_backup_cfg_file_path(volume_name,
                                                                    backup_name)
 
         try:
-            minio_api.remove_object(bucket_name, minio_backup_cfg_file_path)
+            self.session.client.remove_object(bucket_name,
+                                              minio_backup_cfg_file_path)
         except ResponseError as err:
             print(err)
 
     def delete_volume_cfg_file(self, volume_name):
-        secret_name = self.secret
-        assert secret_name != ''
-
-        minio_api = self.get_api_client(secret_name)
         bucket_name = self.get_backupstore_bucket_name()
         minio_volume_cfg_file_path = self.get_volume_cfg_file_path(volume_name)
 
         try:
-            minio_api.remove_object(bucket_name, minio_volume_cfg_file_path)
+            self.session.client.remove_object(bucket_name,
+                                              minio_volume_cfg_file_path)
         except ResponseError as err:
             print(err)
 
-    def delete_random_backup_block(self, volume_name):
-        secret_name = self.secret
-        assert secret_name != ''
-
-        minio_api = self.get_api_client(secret_name)
-
+    def list_backup_block_files(self, volume_name, limit=None):
         bucket_name = self.get_backupstore_bucket_name()
         backup_blocks_dir = self.get_backup_blocks_dir(volume_name)
+        return self.session.list_objects(bucket_name, backup_blocks_dir,
+                                         limit=limit)
 
-        block_object_files = minio_api.list_objects(bucket_name,
-                                                    prefix=backup_blocks_dir,
-                                                    recursive=True)
-
-        object_file = block_object_files.__next__().object_name
-
-        try:
-            minio_api.remove_object(bucket_name, object_file)
-        except ResponseError as err:
+    def delete_backup_blocks(self, volume_name, count=None):
+        bucket_name = self.get_backupstore_bucket_name()
+        object_files = self.list_backup_block_files(volume_name, limit=count)
+        for err in self.session.delete_objects(bucket_name, object_files):
             print(err)
+        return object_files
 
-    def count_backup_block_files(self, volume_name):
-        secret_name = self.secret
-        assert secret_name != ''
+    def delete_random_backup_block(self, volume_name):
+        deleted = self.delete_backup_blocks(volume_name, count=1)
+        assert len(deleted) == 1, f"No backup block of volume {volume_name}"
 
-        minio_api = self.get_api_client(secret_name)
+    def count_backup_block_files(self, volume_name):
         bucket_name = self.get_backupstore_bucket_name()
         backup_blocks_dir = self.get_backup_blocks_dir(volume_name)
-
-        block_object_files = minio_api.list_objects(bucket_name,
-                                                    prefix=backup_blocks_dir,
-                                                    recursive=True)
-
-        block_object_files_list = list(block_object_files)
-
-        return len(block_object_files_list)
+        return self.session.count_objects(bucket_name, backup_blocks_dir)
 
     def create_dummy_backup(self, filename):
         logging(f"Creating dummy backup from file {filename}")
@@ -2,6 +2,7 @@ from kubernetes import client
 
 from engine.base import Base
 from utility.utility import logging
+from utility.watcher import list_cached_crs
 
 
 class CRD(Base):
@@ -20,7 +21,7 @@ class CRD(Base):
         if node_name:
             label_selector.append(f"longhornnode={node_name}")
 
-        api_response = self.obj_api.list_namespaced_custom_object(
+        engines = list_cached_crs(
             group="longhorn.io",
             version="v1beta2",
             namespace="longhorn-system",
@@ -28,10 +29,9 @@ class CRD(Base):
             label_selector=",".join(label_selector)
         )
 
-        if api_response == "" or api_response is None:
+        if engines is None:
             raise Exception(f"failed to get volume {volume_name} engine")
 
-        engines = api_response["items"]
         if len(engines) == 0:
             logging(f"Cannot get volume {volume_name} engines")
 
@@ -1,6 +1,7 @@
 from node import Node
 from node_exec import NodeExec
 
+from utility.constant import E2E_SHARD
 from utility.utility import convert_size_to_bytes
 from utility.utility import init_k8s_api_client
 from utility.utility import generate_name_with_suffix
@@ -17,6 +18,9 @@ class common_keywords:
     def generate_name_with_suffix(self, kind, suffix):
         return generate_name_with_suffix(kind, suffix)
 
+    def is_cluster_shared(self):
+        return E2E_SHARD != ''
+
     def get_worker_nodes(self):
         return Node().list_node_names_by_role("worker")
 
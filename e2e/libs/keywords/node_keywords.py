@@ -28,9 +28,8 @@ class node_keywords:
 
     def cleanup_disks(self):
         nodes = self.node.list_node_names_by_role("worker")
-        for node_name in nodes:
-            logging(f"Resetting node {node_name} disks to default")
-            self.node.reset_disks(node_name)
+        logging(f"Resetting nodes {nodes} disks to default")
+        self.node.reset_disks_of_nodes(nodes)
 
     def reset_node_disks_tags(self):
         nodes = self.node.list_node_names_by_role("worker")
@@ -60,3 +60,6 @@ class stress_keywords:
         if isinstance(nodes, str):
             nodes = [nodes]
         self.stress.filesystem(nodes)
+
+    def get_node_stress_start_skew(self):
+        return self.stress.start_skew
@@ -28,17 +28,39 @@ class volume_keywords:
         volumes = self.volume.list(label_selector=f"{LABEL_TEST}={LABEL_TEST_VALUE}")
 
         logging(f'Cleaning up {len(volumes)} volumes')
-        for volume in volumes:
-            self.delete_volume(volume['metadata']['name'])
+        self.delete_volumes([volume['metadata']['name'] for volume in volumes])
 
     def create_volume(self, volume_name, size="2Gi", numberOfReplicas=3, frontend="blockdev", migratable=False, dataLocality="disabled", accessMode="RWO", dataEngine="v1", backingImage="", Standby=False, fromBackup="", encrypted=False, nodeSelector=[], diskSelector=[]):
         logging(f'Creating volume {volume_name}')
         self.volume.create(volume_name, size, numberOfReplicas, frontend, migratable, dataLocality, accessMode, dataEngine, backingImage, Standby, fromBackup, encrypted, nodeSelector, diskSelector)
 
+    def create_volumes(self, volume_names, size="2Gi", numberOfReplicas=3, frontend="blockdev", migratable=False, dataLocality="disabled", accessMode="RWO", dataEngine="v1", backingImage="", Standby=False, fromBackup="", encrypted=False, nodeSelector=[], diskSelector=[]):
+        logging(f'Creating volumes {volume_names}')
+        spec = {
+            "size": size,
+            "numberOfReplicas": numberOfReplicas,
+            "frontend": frontend,
+            "migratable": migratable,
+            "dataLocality": dataLocality,
+            "accessMode": accessMode,
+            "dataEngine": dataEngine,
+            "backingImage": backingImage,
+            "Standby": Standby,
+            "fromBackup": fromBackup,
+            "encrypted": encrypted,
+            "nodeSelector": nodeSelector,
+            "diskSelector": diskSelector
+        }
+        self.volume.create_volumes({volume_name: spec for volume_name in volume_names})
+
     def delete_volume(self, volume_name):
         logging(f'Deleting volume {volume_name}')
         self.volume.delete(volume_name)
 
+    def delete_volumes(self, volume_names):
+        logging(f'Deleting volumes {volume_names}')
+        self.volume.delete_volumes(volume_names)
+
     def attach_volume(self, volume_name, node_name=None):
         if not node_name:
             node_name = self.node.get_node_by_index(0)
@@ -48,6 +70,12 @@ class volume_keywords:
     def is_attached_to(self, volume_name, node_name):
         return self.volume.is_attached_to(volume_name, node_name)
 
+    def attach_volumes(self, volume_names, node_name=None):
+        if not node_name:
+            node_name = self.node.get_node_by_index(0)
+        logging(f'Attaching volumes {volume_names} to node {node_name}')
+        self.volume.attach_volumes(volume_names, node_name, disable_frontend=False)
+
     def attach_volume_in_maintenance_mode(self, volume_name, node_name=None):
         if not node_name:
             node_name = self.node.get_node_by_index(0)
@@ -60,6 +88,12 @@ class volume_keywords:
         logging(f'Detaching volume {volume_name} from node {node_name}')
         self.volume.detach(volume_name, node_name)
 
+    def detach_volumes(self, volume_names, node_name=None):
+        if not node_name:
+            node_name = self.node.get_node_by_index(0)
+        logging(f'Detaching volumes {volume_names} from node {node_name}')
+        self.volume.detach_volumes(volume_names, node_name)
+
     def list_volumes(self, dataEngine=None):
         logging(f'Listing volumes')
         return self.volume.list_names(dataEngine=dataEngine)
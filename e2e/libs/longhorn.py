@@ -2,7 +2,7 @@
 
 from __future__ import print_function
 
-import collections
+import functools
 import hashlib
 import json
 import operator
@@ -12,6 +12,8 @@ import requests
 import six
 import time
 
+from requests.adapters import HTTPAdapter
+
 from functools import reduce
 
 try:
@@ -55,6 +57,17 @@ LIST_METHODS = {'__iter__': True, '__len__': True, '__getitem__': True}
 
 DEFAULT_TIMEOUT = 45
 
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 32
+POOL_MAX_RETRIES = 3
+
+# parsed schemas shared by every client in the process, keyed by schema url
+_SCHEMA_CACHE = {}
+
+
+def evict_schema(url):
+    _SCHEMA_CACHE.pop(url, None)
+
 
 def echo(fn):
     def wrapped(*args, **kw):
@@ -64,6 +77,40 @@ def echo(fn):
     return wrapped
 
 
+# callables invoked with the requests.Response of every API call of every
+# client, e.g. to trace the calls
+RESPONSE_HOOKS = []
+
+
+def add_response_hook(hook):
+    RESPONSE_HOOKS.append(hook)
+
+
+def _run_response_hooks(r, *args, **kw):
+    for hook in RESPONSE_HOOKS:
+        hook(r)
+
+
+# callables invoked with the url and the exception of every API call that
+# got no response at all, e.g. to fail over to another server
+ERROR_HOOKS = []
+
+
+def add_error_hook(hook):
+    ERROR_HOOKS.append(hook)
+
+
+class _Session(requests.Session):
+    def request(self, method, url, *args, **kw):
+        try:
+            return super(_Session, self).request(method, url, *args, **kw)
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout) as e:
+            for hook in ERROR_HOOKS:
+                hook(url, e)
+            raise
+
+
 def timed_url(fn):
     def wrapped(*args, **kw):
         if TIME:
@@ -78,6 +125,10 @@ def timed_url(fn):
 
 
 class RestObject:
+    # set on the per-client subclass that decoded the object, see
+    # GdapiClient._object_class
+    _client = None
+
     def __init__(self):
         pass
 
@@ -133,8 +184,63 @@ class RestObject:
     def __getattr__(self, k):
         if self._is_list() and k in LIST_METHODS:
             return getattr(self.data, k)
+        method = self._client_method(k)
+        if method is not None:
+            return method
         return getattr(self.__dict__, k)
 
+    def _has_field(self, k):
+        return k in self.__dict__ or hasattr(dict, k) or \
+            hasattr(type(self), k) or self._pagination_url(k) is not None
+
+    def _pagination_url(self, k):
+        pagination = self.__dict__.get('pagination')
+        if k not in ('next', 'prev') or not isinstance(pagination, RestObject):
+            return None
+        return pagination.__dict__.get(k)
+
+    def _client_method(self, k):
+        # Links and actions are resolved when they are accessed instead of
+        # binding a closure for each of them to every decoded object. The
+        # names are the same as before: a link or action whose name is
+        # already taken by a field gets the '_link' or '_action' suffix.
+        client = self._client
+        if client is None or k.startswith('__'):
+            return None
+
+        url = self._pagination_url(k)
+        if url is not None:
+            return lambda: client._get(url)
+
+        if not isinstance(self.__dict__.get('type'), six.string_types):
+            return None
+
+        links = self.__dict__.get('links')
+        links = links.__dict__ if isinstance(links, RestObject) else {}
+        if k.endswith('_link') and k[:-5] in links and self._has_field(k[:-5]):
+            name = k[:-5]
+        elif k in links and not self._has_field(k):
+            name = k
+        else:
+            name = None
+        if name is not None:
+            link = links[name]
+            return lambda **kw: client._get(link, data=kw)
+
+        actions = self.__dict__.get('actions')
+        actions = actions.__dict__ if isinstance(actions, RestObject) else {}
+
+        def action_name_taken(name):
+            return self._has_field(name) or name in links or \
+                (name.endswith('_link') and name[:-5] in links)
+
+        if k.endswith('_action') and k[:-7] in actions and \
+                action_name_taken(k[:-7]):
+            return functools.partial(client.action, self, k[:-7])
+        if k in actions and not action_name_taken(k):
+            return functools.partial(client.action, self, k)
+        return None
+
     def __iter__(self):
         if self._is_list():
             return iter(self.data)
@@ -218,7 +324,19 @@ class GdapiClient(object):
         self._cache_time = cache_time
         self._strict = strict
         self.schema = None
-        self._session = requests.Session()
+        # decoded objects resolve their links and actions through this
+        # client without holding a reference to it in their fields
+        self._object_class = type('RestObject', (RestObject,),
+                                  {'_client': self})
+        self._url_base = url.replace("/v1/schemas", "") if url else url
+        self._session = _Session()
+        self._session.hooks['response'].append(_run_response_hooks)
+        adapter = HTTPAdapter(
+            pool_connections=POOL_CONNECTIONS,
+            pool_maxsize=POOL_MAXSIZE,
+            max_retries=POOL_MAX_RETRIES)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
 
         if not self._cache_time:
             self._cache_time = 60 * 60 * 24  # 24 Hours
@@ -233,52 +351,27 @@ class GdapiClient(object):
             return [self.object_hook(x) for x in obj]
 
         if isinstance(obj, dict):
-            result = RestObject()
+            result = self._object_class()
 
             for k, v in six.iteritems(obj):
                 setattr(result, k, self.object_hook(v))
 
-            for link in ['next', 'prev']:
-                try:
-                    url = getattr(result.pagination, link)
-                    if url is not None:
-                        setattr(result, link, lambda url=url: self._get(url))
-                except AttributeError:
-                    pass
-
-            if hasattr(result, 'type') and isinstance(getattr(result, 'type'),
-                                                      six.string_types):
-                if hasattr(result, 'links'):
-                    for link_name, link in six.iteritems(result.links):
-                        def cb(_link=link, **kw):
-                            return self._get(_link, data=kw)
-                        if hasattr(result, link_name):
-                            setattr(result, link_name + '_link', cb)
-                        else:
-                            setattr(result, link_name, cb)
-
-                if hasattr(result, 'actions'):
-                    for link_name, link in six.iteritems(result.actions):
-                        def cb(_link_name=link_name,
-                               _result=result, *args, **kw):
-                            return self.action(_result, _link_name,
-                                               *args, **kw)
-                        if hasattr(result, link_name):
-                            setattr(result, link_name + '_action', cb)
-                        else:
-                            setattr(result, link_name, cb)
-
             return result
 
-        if type(obj) == str and '/v1/' in obj:
-            obj = self._url.replace("/v1/schemas", "") + obj[obj.find("/v1/"):]
+        if type(obj) == str and '/v1/' in obj and obj.startswith('http'):
+            obj = self._url_base + obj[obj.find("/v1/"):]
         return obj
 
     def object_pairs_hook(self, pairs):
-        ret = collections.OrderedDict()
+        # json decodes the innermost objects first, so the values here are
+        # already converted and only this level has to be built
+        result = self._object_class()
+        fields = result.__dict__
         for k, v in pairs:
-            ret[k] = v
-        return self.object_hook(ret)
+            if isinstance(v, (list, str)):
+                v = self.object_hook(v)
+            fields[k] = v
+        return result
 
     def _get(self, url, data=None):
         return self._unmarshall(self._get_raw(url, data=data))
@@ -342,6 +435,12 @@ class GdapiClient(object):
         if self.schema and not force:
             return
 
+        if not force and self._url in _SCHEMA_CACHE:
+            schema = _SCHEMA_CACHE[self._url]
+            self._bind_methods(schema)
+            self.schema = schema
+            return
+
         schema_text = self._get_cached_schema()
 
         if force or not schema_text:
@@ -360,10 +459,14 @@ class GdapiClient(object):
         if len(schema.types) > 0:
             self._bind_methods(schema)
             self.schema = schema
+            _SCHEMA_CACHE[self._url] = schema
 
     def reload_schema(self):
         self._load_schemas(force=True)
 
+    def close(self):
+        self._session.close()
+
     def by_id(self, type, id, **kw):
         id = str(id)
         url = self.schema.types[type].links.collection
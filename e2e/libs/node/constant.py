@@ -7,3 +7,4 @@ NODE_STRESS_TIMEOUT_SECOND = 60 * 60  # 1 hour
 
 STRESS_HELPER_LABEL = "longhorn-stress-helper"
 STRESS_HELPER_POD_NAME_PREFIX = "longhorn-stress-helper-"
+STRESS_HELPER_KIND_LABEL = "longhorn-stress-kind"
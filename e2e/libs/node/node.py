@@ -2,6 +2,8 @@ import time
 import re
 import os
 
+from concurrent.futures import ThreadPoolExecutor
+
 from kubernetes import client
 from robot.libraries.BuiltIn import BuiltIn
 
@@ -12,12 +14,16 @@ from utility.utility import get_longhorn_client
 from utility.utility import get_retry_count_and_interval
 from utility.utility import logging
 from utility.utility import subprocess_exec_cmd
+from utility.watcher import get_cached_cr
+from utility.watcher import patch_cr
+from utility.watcher import wait_for_cr
 from node_exec import NodeExec
 
 class Node:
 
     DEFAULT_DISK_PATH = "/var/lib/longhorn/"
     DEFAULT_VOLUME_PATH = "/dev/longhorn/"
+    NODE_CR = ("longhorn.io", "v1beta2", LONGHORN_NAMESPACE, "nodes")
 
     def __init__(self):
         self.retry_count, self.retry_interval = get_retry_count_and_interval()
@@ -82,26 +88,100 @@ class Node:
         assert added, f"Adding disk {disk} to node {node_name} failed"
 
     def reset_disks(self, node_name):
-        node = get_longhorn_client().by_id_node(node_name)
-
-        for disk_name, disk in iter(node.disks.items()):
-            if disk.path != self.DEFAULT_DISK_PATH:
-                disk.allowScheduling = False
-                logging(f"Disabling scheduling disk {disk_name} on node {node_name}")
+        self.reset_disks_of_nodes([node_name])
+
+    def reset_disks_of_nodes(self, node_names):
+        """
+        Reset the disks of the nodes to the schedulable default disk only.
+
+        The target disks of every node are computed from the watch cache of
+        nodes.longhorn.io, the nodes are patched concurrently and then all
+        converge on the same watch. A node already in the target state is
+        neither read from nor written to the API server.
+        """
+        patches = {}
+        for node_name in node_names:
+            node = get_cached_cr(*self.NODE_CR, node_name)
+            node_patches = self.get_reset_disks_patches(node)
+            if node_patches:
+                patches[node_name] = node_patches
             else:
-                disk.allowScheduling = True
-                logging(f"Enabling scheduling disk {disk_name} on node {node_name}")
-        self.update_disks(node_name, node.disks)
-
-        disks = {}
-        for disk_name, disk in iter(node.disks.items()):
-            if disk.path == self.DEFAULT_DISK_PATH:
-                disks[disk_name] = disk
-                disk.allowScheduling = True
-                logging(f"Keeping disk {disk_name} on node {node_name}")
+                logging(f"Node {node_name} disks already reset to default")
+
+        if patches:
+            with ThreadPoolExecutor(max_workers=len(patches)) as executor:
+                futures = [executor.submit(self.patch_disks, node_name, node_patches)
+                           for node_name, node_patches in patches.items()]
+                for future in futures:
+                    future.result()
+
+        for node_name in node_names:
+            self.wait_for_disks_reset(node_name)
+
+    def get_reset_disks_patches(self, node):
+        """
+        Return the merge patches of spec.disks resetting the node to its
+        default disk, in order. Longhorn only removes disks whose scheduling
+        is disabled, so they are disabled by the first patch if needed.
+        """
+        disks = node['spec'].get('disks') or {}
+        default_disk_names = {disk_name for disk_name, disk in disks.items()
+                              if disk['path'] == self.DEFAULT_DISK_PATH}
+        other_disk_names = set(disks) - default_disk_names
+
+        scheduling = {}
+        for disk_name in sorted(other_disk_names):
+            if disks[disk_name].get('allowScheduling'):
+                logging(f"Disabling scheduling disk {disk_name} on node {node['metadata']['name']}")
+                scheduling[disk_name] = {'allowScheduling': False}
+        for disk_name in sorted(default_disk_names):
+            if not disks[disk_name].get('allowScheduling'):
+                logging(f"Enabling scheduling disk {disk_name} on node {node['metadata']['name']}")
+                scheduling[disk_name] = {'allowScheduling': True}
+
+        patches = []
+        if scheduling:
+            patches.append(scheduling)
+        if other_disk_names:
+            logging(f"Removing disks {sorted(other_disk_names)} from node {node['metadata']['name']}")
+            patches.append({disk_name: None for disk_name in other_disk_names})
+        return patches
+
+    def patch_disks(self, node_name, patches):
+        for disks in patches:
+            for i in range(self.retry_count):
+                try:
+                    patch_cr(*self.NODE_CR, node_name, {'spec': {'disks': disks}})
+                    break
+                except Exception as e:
+                    logging(f"Failed to update node {node_name} disks {disks}: {e} ({i})")
+                time.sleep(self.retry_interval)
             else:
-                logging(f"Removing disk {disk_name} from node {node_name}")
-        self.update_disks(node_name, disks)
+                assert False, f"Failed to update node {node_name} disks {disks}"
+
+    def is_disks_reset(self, node):
+        disks = node['spec']['disks']
+        if not disks:
+            return False
+        disk_status = node['status'].get('diskStatus') or {}
+        if set(disk_status) != set(disks):
+            return False
+        for disk_name, disk in disks.items():
+            if disk['path'] != self.DEFAULT_DISK_PATH or not disk['allowScheduling']:
+                return False
+            if not disk_status[disk_name].get('diskUUID'):
+                return False
+            conditions = {condition['type']: condition['status']
+                          for condition in disk_status[disk_name].get('conditions') or []}
+            if conditions.get('Ready') != "True":
+                return False
+        return True
+
+    def wait_for_disks_reset(self, node_name):
+        logging(f"Waiting for node {node_name} disks reset to default ...")
+        reset, node = wait_for_cr(*self.NODE_CR, node_name, self.is_disks_reset,
+                                  self.retry_count * self.retry_interval)
+        assert reset, f"Waiting for node {node_name} disks reset to default failed: {node['spec']['disks'] if node else None}"
 
     def set_node_disks_tags(self, node_name, tags):
         node = get_longhorn_client().by_id_node(node_name)
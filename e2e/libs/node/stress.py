@@ -1,126 +1,157 @@
-from kubernetes.client.rest import ApiException
+import time
 
-from node import Node
 from node.constant import NODE_STRESS_CPU_LOAD_PERCENTAGE
 from node.constant import NODE_STRESS_MEM_LOAD_PERCENTAGE
 from node.constant import NODE_STRESS_MEM_VM_WORKERS
 from node.constant import NODE_STRESS_FILESYSTEM_HDD_WORKERS
 from node.constant import NODE_STRESS_FILESYSTEM_LOAD_PERCENTAGE
 from node.constant import NODE_STRESS_TIMEOUT_SECOND
+from node.constant import STRESS_HELPER_KIND_LABEL
 from node.constant import STRESS_HELPER_LABEL
 from node.constant import STRESS_HELPER_POD_NAME_PREFIX
 
+from utility.utility import get_retry_count_and_interval
 from utility.utility import logging
 
 from workload.constant import IMAGE_LITMUX
-from workload.pod import create_pod
+from workload.daemonset import create_daemonset
+from workload.daemonset import delete_daemonset
+from workload.daemonset import get_daemonset
+from workload.daemonset import get_daemonset_node_names
+from workload.daemonset import list_daemonsets
+from workload.daemonset import new_daemonset_manifest
+from workload.daemonset import set_daemonset_node_names
 from workload.pod import delete_pod
-from workload.pod import get_pod
 from workload.pod import new_pod_manifest
 from workload.workload import get_workload_pods
 
 
 class Stress:
+    """
+    Runs stress-ng on nodes with one DaemonSet per kind of stress, so the
+    helpers of all the target nodes start at once rather than one node after
+    another. A node runs one stress helper at a time.
+
+    DaemonSet pods always restart, so stress-ng runs again after its
+    --timeout or an OOM kill until cleanup() instead of ending.
+    """
 
     def __init__(self) -> None:
-        self.node = Node()
+        self.start_skew = {}
 
     def cleanup(self):
+        for daemonset in list_daemonsets(label_selector=f"app={STRESS_HELPER_LABEL}"):
+            delete_daemonset(daemonset.metadata.name)
         for pod in get_workload_pods(STRESS_HELPER_LABEL):
             logging(f"Deleting stress pod {pod.metadata.name}")
             delete_pod(pod.metadata.name, pod.metadata.namespace)
+        self.start_skew = {}
 
     def cpu(self, node_names):
-        for node_name in node_names:
-            pod_name = f"{STRESS_HELPER_POD_NAME_PREFIX}{node_name}"
-
-            # If the helper pod creation is called inside of a test case loop,
-            # we need to check if the pod already running.
-            try:
-                pod = get_pod(pod_name)
-                if pod and pod.status.phase != "Running":
-                    logging(f"Deleting stress pod {pod_name} in phase {pod.status.phase}")
-                    delete_pod(pod_name)
-                elif pod:
-                    logging(f"Stress pod {pod_name} already running")
-                    continue
-            except ApiException as e:
-                assert e.status == 404
-
-            manifest = new_pod_manifest(
-                pod_name=pod_name,
-                image=IMAGE_LITMUX,
-                command=["stress-ng"],
-                args=['--cpu', str(self.node.get_node_cpu_cores(node_name)),
-                      '--cpu-load', str(NODE_STRESS_CPU_LOAD_PERCENTAGE),
-                      '--timeout', str(NODE_STRESS_TIMEOUT_SECOND)],
-                node_name=node_name,
-                labels={'app': STRESS_HELPER_LABEL}
-            )
-
-            pod_name = manifest['metadata']['name']
-            logging(f"Creating cpu stress pod {pod_name} on {node_name}")
-            create_pod(manifest, is_wait_for_pod_running=True)
+        # 0 cpu workers starts one per online CPU of the node
+        return self.rollout("cpu", node_names,
+                            ['--cpu', '0',
+                             '--cpu-load', str(NODE_STRESS_CPU_LOAD_PERCENTAGE),
+                             '--timeout', str(NODE_STRESS_TIMEOUT_SECOND)])
 
     def memory(self, node_names):
-        for node_name in node_names:
-            pod_name = f"{STRESS_HELPER_POD_NAME_PREFIX}{node_name}"
-
-            # If the helper pod creation is called inside of a test case loop,
-            # we need to check if the pod already running.
-            try:
-                pod = get_pod(pod_name)
-                if pod and pod.status.phase != "Running":
-                    logging(f"Deleting stress pod {pod_name} in phase {pod.status.phase}")
-                    delete_pod(pod_name)
-                elif pod:
-                    logging(f"Stress pod {pod_name} already running")
-                    continue
-            except ApiException as e:
-                assert e.status == 404
-
-            manifest = new_pod_manifest(
-                pod_name=pod_name,
-                image=IMAGE_LITMUX,
-                command=["stress-ng"],
-                args=['--vm', str(NODE_STRESS_MEM_VM_WORKERS),
-					  '--vm-bytes', f"{NODE_STRESS_MEM_LOAD_PERCENTAGE}%",
-					  '--timeout', str(NODE_STRESS_TIMEOUT_SECOND)],
-                node_name=node_name,
-                labels={'app': STRESS_HELPER_LABEL}
-            )
-
-            pod_name = manifest['metadata']['name']
-            logging(f"Creating memory stress pod {pod_name} on {node_name}")
-            create_pod(manifest, is_wait_for_pod_running=True)
+        return self.rollout("memory", node_names,
+                            ['--vm', str(NODE_STRESS_MEM_VM_WORKERS),
+                             '--vm-bytes', f"{NODE_STRESS_MEM_LOAD_PERCENTAGE}%",
+                             '--timeout', str(NODE_STRESS_TIMEOUT_SECOND)])
 
     def filesystem(self, node_names):
-        for node_name in node_names:
-            pod_name = f"{STRESS_HELPER_POD_NAME_PREFIX}{node_name}"
-
-            # If the helper pod creation is called inside of a test case loop,
-            # we need to check if the pod already running.
-            try:
-                pod = get_pod(pod_name)
-                if pod and pod.status.phase != "Running":
-                    logging(f"Deleting stress pod {pod_name} in phase {pod.status.phase}")
-                    delete_pod(pod_name)
-                elif pod:
-                    logging(f"Stress pod {pod_name} already running")
-                    continue
-            except ApiException as e:
-                assert e.status == 404
+        return self.rollout("filesystem", node_names,
+                            ['--hdd', str(NODE_STRESS_FILESYSTEM_HDD_WORKERS),
+                             '--hdd-bytes', f"{NODE_STRESS_FILESYSTEM_LOAD_PERCENTAGE}%"])
+
+    def rollout(self, kind, node_names, args):
+        """
+        Start the stress helper of the kind on the nodes and wait for all of
+        them to run. Returns the start skew of the helpers started by this
+        call, see get_start_skew().
+        """
+        name = f"{STRESS_HELPER_POD_NAME_PREFIX}{kind}"
+        labels = {'app': STRESS_HELPER_LABEL, STRESS_HELPER_KIND_LABEL: kind}
+
+        # If the helper creation is called inside of a test case loop, the
+        # helpers may already be running.
+        daemonset = get_daemonset(name)
+        current_node_names = set()
+        if daemonset is not None:
+            current_node_names = get_daemonset_node_names(daemonset)
+
+        busy_node_names = set()
+        for pod in get_workload_pods(STRESS_HELPER_LABEL):
+            if pod.metadata.labels.get(STRESS_HELPER_KIND_LABEL) != kind:
+                busy_node_names.add(pod.spec.node_name)
 
+        target_node_names = set(node_names) - busy_node_names
+        new_node_names = target_node_names - current_node_names
+        for node_name in set(node_names) & busy_node_names:
+            logging(f"Stress pod already running on {node_name}")
+
+        if daemonset is None:
             manifest = new_pod_manifest(
-                pod_name=pod_name,
+                pod_name=name,
                 image=IMAGE_LITMUX,
                 command=["stress-ng"],
-                args=['--hdd', str(NODE_STRESS_FILESYSTEM_HDD_WORKERS),
-					  '--hdd-bytes', f"{NODE_STRESS_FILESYSTEM_LOAD_PERCENTAGE}%"],
-                node_name=node_name,
-                labels={'app': STRESS_HELPER_LABEL}
+                args=args,
+                labels=labels
             )
-
-            pod_name = manifest['metadata']['name']
-            logging(f"Creating filesystem stress pod {pod_name} on {node_name}")
-            create_pod(manifest, is_wait_for_pod_running=True)
+            logging(f"Creating {kind} stress daemonset {name} on {sorted(new_node_names)}")
+            create_daemonset(new_daemonset_manifest(name, manifest,
+                                                    new_node_names, labels))
+        elif new_node_names:
+            logging(f"Adding {sorted(new_node_names)} to {kind} stress daemonset {name}")
+            set_daemonset_node_names(name, current_node_names | new_node_names)
+        else:
+            logging(f"Stress daemonset {name} already covers {sorted(target_node_names)}")
+
+        pods = self.wait_for_stress_pods_running(kind, target_node_names)
+        self.start_skew = self.get_start_skew(
+            {node_name: pods[node_name] for node_name in new_node_names})
+        return self.start_skew
+
+    def wait_for_stress_pods_running(self, kind, node_names):
+        """
+        Wait for the stress helpers of the kind to run on all the nodes
+        together. Returns the running pods by node name.
+        """
+        label_selector = f"app={STRESS_HELPER_LABEL},{STRESS_HELPER_KIND_LABEL}={kind}"
+        retry_count, retry_interval = get_retry_count_and_interval()
+        pending = set(node_names)
+        for i in range(retry_count):
+            running = {}
+            for pod in get_workload_pods(STRESS_HELPER_LABEL, label_selector=label_selector):
+                if pod.metadata.deletion_timestamp is None and \
+                        pod.status.phase == "Running" and \
+                        pod.status.container_statuses and \
+                        pod.status.container_statuses[0].state.running:
+                    running[pod.spec.node_name] = pod
+            pending = set(node_names) - set(running)
+            if not pending:
+                return running
+            logging(f"Waiting for {kind} stress pods on {sorted(pending)} running ({i}) ...")
+            time.sleep(retry_interval)
+        assert False, f"Failed to wait for {kind} stress pods on {sorted(pending)} running"
+
+    def get_start_skew(self, pods):
+        """
+        Return, per node, how many seconds after the first helper of the
+        rollout the helper on the node started running.
+        """
+        started_at = {
+            node_name: pod.status.container_statuses[0].state.running.started_at
+            for node_name, pod in pods.items()
+        }
+        if not started_at:
+            return {}
+
+        first = min(started_at.values())
+        start_skew = {
+            node_name: (started - first).total_seconds()
+            for node_name, started in sorted(started_at.items())
+        }
+        logging(f"Stress pods start skew {start_skew}, max {max(start_skew.values())}s")
+        return start_skew
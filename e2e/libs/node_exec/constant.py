@@ -1,4 +1,8 @@
 DEFAULT_POD_TIMEOUT = 180
 DEFAULT_POD_INTERVAL = 1
 
+# no timeout by default, full device checksums can run for a long time
+DEFAULT_CMD_TIMEOUT = None
+EXEC_POLL_INTERVAL = 1
+
 HOST_ROOTFS = "/rootfs"
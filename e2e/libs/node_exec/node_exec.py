@@ -1,17 +1,37 @@
 import os
+import threading
 import time
 
 from kubernetes import client
 from kubernetes.stream import stream
 
+from node_exec.constant import DEFAULT_CMD_TIMEOUT
 from node_exec.constant import DEFAULT_POD_INTERVAL
 from node_exec.constant import DEFAULT_POD_TIMEOUT
+from node_exec.constant import EXEC_POLL_INTERVAL
 from node_exec.constant import HOST_ROOTFS
 
 from utility.utility import logging
 from utility.utility import delete_pod, get_pod
 
 
+# commands reuse the long-lived node exec pod of a node as long as it is
+# still running. A pod launch can take minutes, so each node has its own
+# lock and a slow node never holds up the commands issued on the others.
+_node_locks = {}
+_node_locks_lock = threading.Lock()
+
+
+def _node_lock(node_name):
+    with _node_locks_lock:
+        return _node_locks.setdefault(node_name, threading.Lock())
+
+
+def _is_running(pod):
+    return pod is not None and pod.status.phase == 'Running' and \
+        pod.metadata.deletion_timestamp is None
+
+
 class NodeExec:
 
     def __init__(self, node_name):
@@ -19,17 +39,81 @@ class NodeExec:
         self.core_api = client.CoreV1Api()
 
     def cleanup(self):
-        if get_pod(self.node_name):
-            logging(f"Cleaning up pod {self.node_name}")
-            delete_pod(self.node_name)
+        with _node_lock(self.node_name):
+            if get_pod(self.node_name):
+                logging(f"Cleaning up pod {self.node_name}")
+                delete_pod(self.node_name)
 
-    def issue_cmd(self, cmd):
+    def get_running_pod(self):
+        with _node_lock(self.node_name):
+            pod = get_pod(self.node_name)
+            if not _is_running(pod):
+                if pod is not None:
+                    delete_pod(self.node_name)
+                pod = self.launch_pod()
+            return pod
 
-        self.cleanup()
-        self.pod = self.launch_pod()
+    def issue_cmd(self, cmd, timeout=DEFAULT_CMD_TIMEOUT, on_output=None):
+        res, _ = self.issue_cmd_with_exit_code(cmd, timeout=timeout,
+                                               on_output=on_output)
+        return res
 
+    def issue_cmd_with_exit_code(self, cmd, timeout=DEFAULT_CMD_TIMEOUT,
+                                 on_output=None):
         logging(f"Issuing command on {self.node_name}: {cmd}")
 
+        exec_command = self.get_exec_command(cmd)
+        res, exit_code = self.exec(exec_command, timeout, on_output)
+
+        logging(f"Issued command: {cmd} on {self.node_name} with exit code {exit_code} and result:\n{res}")
+        return res, exit_code
+
+    def connect(self, exec_command):
+        pod = self.get_running_pod()
+        return stream(
+            self.core_api.connect_get_namespaced_pod_exec,
+            pod.metadata.name,
+            'default',
+            command=exec_command,
+            stderr=True,
+            stdin=False,
+            stdout=True,
+            tty=False,
+            _preload_content=False
+        )
+
+    def exec(self, exec_command, timeout, on_output):
+        try:
+            resp = self.connect(exec_command)
+        except Exception as e:
+            # the pod may have gone away with a node reboot or a manual
+            # cleanup, relaunch it once before the command starts running
+            logging(f"Connecting to {self.node_name} pod failed: {e}, relaunching pod ...")
+            self.cleanup()
+            resp = self.connect(exec_command)
+
+        output = []
+        deadline = time.time() + timeout if timeout else None
+        try:
+            while resp.is_open():
+                if deadline and time.time() > deadline:
+                    raise TimeoutError(f"Timeout on executing {exec_command} on {self.node_name} after {timeout}s")
+                resp.update(timeout=EXEC_POLL_INTERVAL)
+                for data in (resp.read_stdout(), resp.read_stderr()):
+                    if data:
+                        output.append(data)
+                        if on_output:
+                            on_output(data)
+        finally:
+            resp.close()
+
+        try:
+            exit_code = resp.returncode
+        except Exception:
+            exit_code = None
+        return "".join(output), exit_code
+
+    def get_exec_command(self, cmd):
         if isinstance(cmd, list):
             exec_command = cmd
         else:
@@ -41,18 +125,7 @@ class NodeExec:
                 f'--net={ns_net}',
                 '--', 'sh', '-c', cmd
             ]
-        res = stream(
-            self.core_api.connect_get_namespaced_pod_exec,
-            self.pod.metadata.name,
-            'default',
-            command=exec_command,
-            stderr=True,
-            stdin=False,
-            stdout=True,
-            tty=False
-        )
-        logging(f"Issued command: {cmd} on {self.node_name} with result:\n{res}")
-        return res
+        return exec_command
 
     def launch_pod(self):
         pod_manifest = {
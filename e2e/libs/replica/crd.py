@@ -4,6 +4,7 @@ from replica.base import Base
 from replica.rest import Rest
 
 from utility.utility import logging
+from utility.watcher import list_cached_crs
 
 
 class CRD(Base):
@@ -21,15 +22,15 @@ class CRD(Base):
         label_selector = ",".join(label_selector)
         logging(f"Getting replicas with labels {label_selector}")
 
-        replicas = self.obj_api.list_namespaced_custom_object(
+        replicas = list_cached_crs(
             group="longhorn.io",
             version="v1beta2",
             namespace="longhorn-system",
             plural="replicas",
             label_selector=label_selector
         )
-        logging(f"Got replicas {replicas['items']}")
-        return replicas["items"]
+        logging(f"Got replicas {replicas}")
+        return replicas
 
     def get_replica_names(self, volume_name, numberOfReplicas):
         logging(f"Getting volume {volume_name} replica names")
@@ -3,6 +3,8 @@ import yaml
 from kubernetes import client
 from kubernetes.client.rest import ApiException
 
+from utility.constant import LABEL_TEST
+from utility.constant import LABEL_TEST_VALUE
 from utility.utility import logging
 
 
@@ -18,6 +20,7 @@ class Secret():
         with open(filepath, 'r') as f:
             manifest_dict = yaml.safe_load(f)
             namespace = manifest_dict['metadata']['namespace']
+            manifest_dict['metadata']['labels'][LABEL_TEST] = LABEL_TEST_VALUE
             logging(f"Creating secret {manifest_dict['metadata']['name']}")
             self.api.create_namespaced_secret(namespace, body=manifest_dict)
 
@@ -29,6 +32,6 @@ class Secret():
             assert e.status == 404
 
     def cleanup(self):
-        secrets = self.api.list_secret_for_all_namespaces(label_selector="test.longhorn.io=e2e")
+        secrets = self.api.list_secret_for_all_namespaces(label_selector=f"{LABEL_TEST}={LABEL_TEST_VALUE}")
         for item in secrets.items:
             self.delete(item.metadata.name, item.metadata.namespace)
@@ -4,6 +4,8 @@ from snapshot.rest import Rest
 
 from strategy import LonghornOperationStrategy
 
+from volume.checksum import invalidate_volume_checksums
+
 
 class Snapshot(Base):
 
@@ -40,6 +42,7 @@ class Snapshot(Base):
         return self.snapshot.delete(volume_name, snapshot_id)
 
     def revert(self, volume_name, snapshot_id):
+        invalidate_volume_checksums(volume_name)
         return self.snapshot.revert(volume_name, snapshot_id)
 
     def purge(self, volume_name):
@@ -4,6 +4,8 @@ import json
 from kubernetes import client
 from kubernetes.client.rest import ApiException
 
+from utility.constant import LABEL_TEST
+from utility.constant import LABEL_TEST_VALUE
 from utility.utility import logging
 
 class StorageClass():
@@ -18,6 +20,7 @@ class StorageClass():
         with open(filepath, 'r') as f:
             manifest_dict = yaml.safe_load(f)
             manifest_dict['metadata']['name'] = name
+            manifest_dict['metadata']['labels'][LABEL_TEST] = LABEL_TEST_VALUE
 
             manifest_dict['parameters']['numberOfReplicas'] = numberOfReplicas
             manifest_dict['parameters']['migratable'] = migratable
@@ -47,7 +50,7 @@ class StorageClass():
             assert e.status == 404
 
     def cleanup(self):
-        storage_classes = self.api.list_storage_class(label_selector="test.longhorn.io=e2e")
+        storage_classes = self.api.list_storage_class(label_selector=f"{LABEL_TEST}={LABEL_TEST_VALUE}")
         for item in storage_classes.items:
             self.delete(item.metadata.name)
 
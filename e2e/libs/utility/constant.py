@@ -1,21 +1,40 @@
+import os
+
 KIND_DEPLOYMENT = 'deployment'
 KIND_STATEFULSET = 'statefulset'
 
 LABEL_LONGHORN_COMPONENT = "longhorn.io/component"
+
+# set by run.sh when the suites run in parallel shards, resources of each
+# shard get their own label value and name prefix so that the cleanup of one
+# shard never touches the resources of another
+E2E_SHARD = os.getenv('E2E_SHARD', '')
+SHARD_SUFFIX = f'-{E2E_SHARD}' if E2E_SHARD else ''
+
 LABEL_TEST = 'test.longhorn.io'
-LABEL_TEST_VALUE = 'e2e'
+LABEL_TEST_VALUE = f'e2e{SHARD_SUFFIX}'
 
+# test metadata annotations, indexed by the watch cache
+ANNOT_TEST_PREFIX = f'{LABEL_TEST}/'
 ANNOT_CHECKSUM = f'{LABEL_TEST}/last-recorded-checksum'
 ANNOT_EXPANDED_SIZE = f'{LABEL_TEST}/last-recorded-expanded-size'
 ANNOT_REPLICA_NAMES = f'{LABEL_TEST}/replica-names'
 
-NAME_PREFIX = 'e2e-test'
-STORAGECLASS_NAME_PREFIX = 'longhorn-test'
+NAME_PREFIX = f'e2e-test{SHARD_SUFFIX}'
+STORAGECLASS_NAME_PREFIX = f'longhorn-test{SHARD_SUFFIX}'
 
 STREAM_EXEC_TIMEOUT = 300
 
 LONGHORN_NAMESPACE = 'longhorn-system'
 
+LONGHORN_MGR_PORT = 9500
+LONGHORN_MGR_CONNECT_TIMEOUT = 3
+
+BULK_MAX_WORKERS = 8
+
+WATCH_STREAM_TIMEOUT = 300
+WATCH_RESYNC_INTERVAL = 1
+
 DISK_BEING_SYNCING = "being syncing and please retry later"
 NODE_UPDATE_RETRY_INTERVAL = 6
 
@@ -0,0 +1,364 @@
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+from kubernetes.client import rest
+
+import longhorn
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60, 300, 1800)
+
+SPANS_FILE = "api-spans.jsonl"
+SUMMARY_FILE = "api-trace.json"
+METRICS_FILE = "api-trace.prom"
+
+CLIENT_LONGHORN = "longhorn"
+CLIENT_KUBERNETES = "kubernetes"
+
+
+class Histogram:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q quantile, the max for the
+        overflow bucket.
+        """
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank and cumulative > 0:
+                return min(bound, self.max)
+        return self.max
+
+    def cumulative(self):
+        result = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            result.append((bound, cumulative))
+        return result
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "max": round(self.max, 6),
+            "p50": round(self.quantile(0.5), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "p99": round(self.quantile(0.99), 6),
+        }
+
+
+def parse_resource(client, url):
+    """
+    Return (resource, action) of an API url, e.g. ("volumes", "attach") for
+    .../v1/volumes/vol-1?action=attach or ("pods/log", None) for
+    .../api/v1/namespaces/default/pods/pod-1/log.
+    """
+    parsed = urlparse(url)
+    parts = [p for p in parsed.path.split("/") if p]
+    action = parse_qs(parsed.query).get("action", [None])[0]
+
+    if client == CLIENT_LONGHORN:
+        if "v1" in parts:
+            parts = parts[parts.index("v1") + 1:]
+        return (parts[0] if parts else "root"), action
+
+    if parts[:1] == ["api"]:
+        parts = parts[2:]
+    elif parts[:1] == ["apis"]:
+        parts = parts[3:]
+    if parts[:1] == ["namespaces"] and len(parts) > 2:
+        parts = parts[2:]
+    if not parts:
+        return "root", action
+    if len(parts) > 2:
+        return f"{parts[0]}/{parts[2]}", action
+    return parts[0], action
+
+
+class Tracer:
+    """
+    Records a span for every Longhorn REST and Kubernetes API call and
+    aggregates the latencies per call kind, per test and per keyword.
+
+    The current test and keyword stack are set by the test runner, see
+    ApiTracer. A call counts for every keyword on the stack, including the
+    calls made from threads started by a keyword.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans_file = None
+        self.test = None
+        self.keywords = []
+        self.calls = {}
+        self.test_api = {}
+        self.test_durations = {}
+        self.keyword_api = {}
+        self.keyword_durations = {}
+
+    def open(self, spans_path):
+        self.spans_file = open(spans_path, "w")
+
+    @staticmethod
+    def _observe(histograms, key, value):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def record(self, client, method, url, status, size, latency):
+        resource, action = parse_resource(client, url)
+        with self.lock:
+            keyword = self.keywords[-1] if self.keywords else None
+            key = (client, method, resource, action or "", str(status))
+            self._observe(self.calls, key, latency)
+            if self.test is not None:
+                self._observe(self.test_api, self.test, latency)
+            # each keyword of the stack includes the calls of the keywords
+            # it runs
+            for name in set(self.keywords):
+                self._observe(self.keyword_api, name, latency)
+            if self.spans_file is not None:
+                self.spans_file.write(json.dumps({
+                    "time": round(time.time() - latency, 6),
+                    "client": client,
+                    "method": method,
+                    "resource": resource,
+                    "action": action,
+                    "status": status,
+                    "bytes": size,
+                    "latency": round(latency, 6),
+                    "test": self.test,
+                    "keyword": keyword,
+                }) + "\n")
+
+    def start_test(self, name):
+        with self.lock:
+            self.test = name
+
+    def end_test(self, name, elapsed):
+        with self.lock:
+            self.test_durations[name] = elapsed
+            self.test = None
+
+    def start_keyword(self, name):
+        with self.lock:
+            self.keywords.append(name)
+
+    def end_keyword(self, name, elapsed):
+        with self.lock:
+            if self.keywords:
+                self.keywords.pop()
+            self._observe(self.keyword_durations, name, elapsed)
+
+    def summary(self):
+        with self.lock:
+            return {
+                "calls": [
+                    dict(zip(("client", "method", "resource", "action",
+                              "status"), key), **histogram.to_dict())
+                    for key, histogram in sorted(self.calls.items())
+                ],
+                "tests": {
+                    test: dict(self.test_api.get(test, Histogram()).to_dict(),
+                               duration=round(duration, 3))
+                    for test, duration in self.test_durations.items()
+                },
+                "keywords": {
+                    keyword: {
+                        "duration": self.keyword_durations.get(
+                            keyword, Histogram()).to_dict(),
+                        "api": self.keyword_api.get(
+                            keyword, Histogram()).to_dict(),
+                    }
+                    for keyword in sorted(
+                        set(self.keyword_durations) | set(self.keyword_api))
+                },
+            }
+
+    def openmetrics(self):
+        lines = []
+
+        def histogram_family(name, help, label_names, histograms):
+            lines.append(f"# TYPE {name} histogram")
+            lines.append(f"# UNIT {name} seconds")
+            lines.append(f"# HELP {name} {help}")
+            for key, histogram in sorted(histograms.items()):
+                if not isinstance(key, tuple):
+                    key = (key,)
+                labels = ",".join(f'{label}="{escape_label(value)}"'
+                                  for label, value in zip(label_names, key))
+                for bound, count in histogram.cumulative():
+                    le = "+Inf" if bound == float("inf") else bound
+                    lines.append(
+                        f'{name}_bucket{{{labels},le="{le}"}} {count}')
+                lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+                lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+
+        with self.lock:
+            histogram_family(
+                "longhorn_test_api_request_duration_seconds",
+                "Latency of the API calls.",
+                ("client", "method", "resource", "action", "status"),
+                self.calls)
+            histogram_family(
+                "longhorn_test_case_api_request_duration_seconds",
+                "Latency of the API calls of each test.",
+                ("test",), self.test_api)
+            histogram_family(
+                "longhorn_test_keyword_api_request_duration_seconds",
+                "Latency of the API calls of each keyword.",
+                ("keyword",), self.keyword_api)
+            histogram_family(
+                "longhorn_test_keyword_duration_seconds",
+                "Duration of each keyword call.",
+                ("keyword",), self.keyword_durations)
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def export(self, summary_path, metrics_path):
+        with open(summary_path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        with open(metrics_path, "w") as f:
+            f.write(self.openmetrics())
+        with self.lock:
+            if self.spans_file is not None:
+                self.spans_file.close()
+                self.spans_file = None
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace(
+        "\"", "\\\"").replace("\n", "\\n")
+
+
+_tracer = None
+_installed = False
+
+
+def _on_longhorn_response(r):
+    tracer = _tracer
+    if tracer is None:
+        return
+    tracer.record(CLIENT_LONGHORN, r.request.method, r.url, r.status_code,
+                  len(r.content), r.elapsed.total_seconds())
+
+
+def _traced_request(request):
+    @functools.wraps(request)
+    def wrapped(self, method, url, *args, **kwargs):
+        tracer = _tracer
+        if tracer is None:
+            return request(self, method, url, *args, **kwargs)
+
+        query_params = kwargs.get("query_params", args[0] if args else None)
+        preload = kwargs.get("_preload_content",
+                             args[4] if len(args) > 4 else True)
+        if any(k == "watch" and v for k, v in query_params or []):
+            method = "WATCH"
+        status = "error"
+        size = 0
+        start = time.monotonic()
+        try:
+            r = request(self, method, url, *args, **kwargs)
+            status = r.status
+            if preload:
+                size = len(r.data or b"")
+            return r
+        except rest.ApiException as e:
+            status = e.status
+            size = len(e.body or b"")
+            raise
+        finally:
+            tracer.record(CLIENT_KUBERNETES, method, url, status, size,
+                          time.monotonic() - start)
+    return wrapped
+
+
+def install(tracer):
+    """
+    Send the spans of every Longhorn and Kubernetes client in the process to
+    the tracer.
+    """
+    global _tracer, _installed
+    _tracer = tracer
+    if not _installed:
+        longhorn.add_response_hook(_on_longhorn_response)
+        rest.RESTClientObject.request = _traced_request(
+            rest.RESTClientObject.request)
+        _installed = True
+
+
+def uninstall():
+    global _tracer
+    _tracer = None
+
+
+class ApiTracer:
+    """
+    Robot Framework listener tracing the API calls of a run.
+
+    Use it with `--listener utility.tracing.ApiTracer:<output dir>`. When the
+    run is closed it writes api-spans.jsonl with one span per call,
+    api-trace.json with the latency summary per call kind, test and keyword,
+    and the same histograms in OpenMetrics format to api-trace.prom.
+    """
+
+    ROBOT_LISTENER_API_VERSION = 2
+
+    TRACED_KEYWORD_TYPES = ("KEYWORD", "SETUP", "TEARDOWN")
+
+    def __init__(self, output_dir="."):
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.tracer = Tracer()
+        self.tracer.open(os.path.join(output_dir, SPANS_FILE))
+        install(self.tracer)
+
+    def start_test(self, name, attrs):
+        self.tracer.start_test(attrs["longname"])
+
+    def end_test(self, name, attrs):
+        self.tracer.end_test(attrs["longname"], attrs["elapsedtime"] / 1000)
+
+    def _keyword_name(self, attrs):
+        if attrs.get("libname"):
+            return f"{attrs['libname']}.{attrs['kwname']}"
+        return attrs["kwname"]
+
+    def start_keyword(self, name, attrs):
+        if attrs["type"] in self.TRACED_KEYWORD_TYPES:
+            self.tracer.start_keyword(self._keyword_name(attrs))
+
+    def end_keyword(self, name, attrs):
+        if attrs["type"] in self.TRACED_KEYWORD_TYPES:
+            self.tracer.end_keyword(self._keyword_name(attrs),
+                                    attrs["elapsedtime"] / 1000)
+
+    def close(self):
+        self.tracer.export(os.path.join(self.output_dir, SUMMARY_FILE),
+                           os.path.join(self.output_dir, METRICS_FILE))
+        uninstall()
@@ -7,9 +7,13 @@ import yaml
 import signal
 import subprocess
 
+from concurrent.futures import ThreadPoolExecutor
+
 from robot.api import logger
 from robot.libraries.BuiltIn import BuiltIn
 
+from longhorn import add_error_hook
+from longhorn import evict_schema
 from longhorn import from_env
 
 from kubernetes import client
@@ -22,6 +26,11 @@ from utility.constant import NAME_PREFIX
 from utility.constant import STREAM_EXEC_TIMEOUT
 from utility.constant import STORAGECLASS_NAME_PREFIX
 from utility.constant import DEFAULT_BACKUPSTORE
+from utility.constant import LONGHORN_MGR_PORT
+from utility.constant import BULK_MAX_WORKERS
+from utility.constant import LONGHORN_MGR_CONNECT_TIMEOUT
+from utility.watcher import get_cached_annotation
+from utility.watcher import patch_cr_annotations
 
 
 class timeout:
@@ -221,37 +230,18 @@ def list_namespaced_pod(namespace, label_selector=""):
 
 
 def set_annotation(group, version, namespace, plural, name, annotation_key, annotation_value):
-    api = client.CustomObjectsApi()
-    # retry conflict error
-    retry_count, retry_interval = get_retry_count_and_interval()
-    for i in range(retry_count):
-        logging(f"Try to set custom resource {plural} {name} annotation {annotation_key}={annotation_value} ... ({i})")
-        try:
-            cr = get_cr(group, version, namespace, plural, name)
-            annotations = cr['metadata'].get('annotations', {})
-            annotations[annotation_key] = f"{annotation_value}"
-            cr['metadata']['annotations'] = annotations
-            api.replace_namespaced_custom_object(
-                group=group,
-                version=version,
-                namespace=namespace,
-                plural=plural,
-                name=name,
-                body=cr
-            )
-            break
-        except Exception as e:
-            if e.status == 409:
-                logging(f"Conflict error: {e.body}, retry ({i}) ...")
-            else:
-                raise e
-        time.sleep(retry_interval)
+    set_annotations(group, version, namespace, plural, name, {annotation_key: annotation_value})
+
+
+def set_annotations(group, version, namespace, plural, name, annotations):
+    annotations = {key: f"{value}" for key, value in annotations.items()}
+    logging(f"Setting custom resource {plural} {name} annotations {annotations}")
+    patch_cr_annotations(group, version, namespace, plural, name, annotations)
 
 
 def get_annotation_value(group, version, namespace, plural, name, annotation_key):
     try:
-        cr = get_cr(group, version, namespace, plural, name)
-        return cr['metadata']['annotations'].get(annotation_key)
+        return get_cached_annotation(group, version, namespace, plural, name, annotation_key)
     except Exception as e:
         logging(f"Failed to get annotation {annotation_key} from {plural} {name} in {namespace}: {e}")
         return ""
@@ -318,39 +308,119 @@ def get_mgr_ips():
     return mgr_ips
 
 
+# longhorn clients shared by the whole test process, keyed by schema url
+_longhorn_clients = {}
+_longhorn_client_url = None
+# manager addresses a request could not reach since they were last probed
+_unreachable_mgr_addresses = set()
+
+
+def get_url_address(url):
+    return url.split("//")[1].split("/")[0]
+
+
+def mark_mgr_unreachable(url, error):
+    _unreachable_mgr_addresses.add(get_url_address(url))
+
+
+add_error_hook(mark_mgr_unreachable)
+
+
+def is_mgr_port_open(ip):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(LONGHORN_MGR_CONNECT_TIMEOUT)
+    try:
+        return sock.connect_ex((ip, LONGHORN_MGR_PORT)) == 0
+    finally:
+        sock.close()
+
+
+def get_pooled_longhorn_client(url):
+    global _longhorn_client_url
+    longhorn_client = _longhorn_clients.get(url)
+    if longhorn_client is None:
+        longhorn_client = from_env(url=url)
+        _longhorn_clients[url] = longhorn_client
+    _unreachable_mgr_addresses.discard(get_url_address(url))
+    _longhorn_client_url = url
+    return longhorn_client
+
+
+def evict_longhorn_client(url):
+    global _longhorn_client_url
+    longhorn_client = _longhorn_clients.pop(url, None)
+    if longhorn_client is not None:
+        longhorn_client.close()
+    evict_schema(url)
+    if _longhorn_client_url == url:
+        _longhorn_client_url = None
+
+
 def get_longhorn_client():
-    retry_count, retry_interval = get_retry_count_and_interval()
     if os.getenv('LONGHORN_CLIENT_URL'):
         # for develop or debug
         # manually expose longhorn client
         # to access longhorn manager in local environment
-        longhorn_client_url = os.getenv('LONGHORN_CLIENT_URL')
+        longhorn_client_url = f"{os.getenv('LONGHORN_CLIENT_URL')}/v1/schemas"
+        if longhorn_client_url in _longhorn_clients:
+            return _longhorn_clients[longhorn_client_url]
+        retry_count, retry_interval = get_retry_count_and_interval()
         for i in range(retry_count):
             try:
-                longhorn_client = from_env(url=f"{longhorn_client_url}/v1/schemas")
-                return longhorn_client
+                return get_pooled_longhorn_client(longhorn_client_url)
             except Exception as e:
                 logging(f"Getting longhorn client error: {e}, retry ({i}) ...")
                 time.sleep(retry_interval)
     else:
         # for ci, run test in in-cluster environment
         # directly use longhorn manager cluster ip
+        # reuse the current manager until a request fails to reach it, then
+        # keep it only if its port still answers, otherwise fail over to
+        # another manager ip
+        current_url = _longhorn_client_url
+        if current_url in _longhorn_clients:
+            current_address = get_url_address(current_url)
+            if current_address not in _unreachable_mgr_addresses:
+                return _longhorn_clients[current_url]
+            _unreachable_mgr_addresses.discard(current_address)
+            current_ip = current_address.split(":")[0]
+            if is_mgr_port_open(current_ip):
+                return _longhorn_clients[current_url]
+            logging(f"Longhorn manager {current_ip} stopped answering, failing over ...")
+            evict_longhorn_client(current_url)
+
+        retry_count, retry_interval = get_retry_count_and_interval()
         for i in range(retry_count):
             try:
                 config.load_incluster_config()
                 ips = get_mgr_ips()
                 # check if longhorn manager port is open before calling get_client
                 for ip in ips:
-                    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    mgr_port_open = sock.connect_ex((ip, 9500))
-                    if mgr_port_open == 0:
-                        longhorn_client = from_env(url=f"http://{ip}:9500/v1/schemas")
-                        return longhorn_client
+                    if is_mgr_port_open(ip):
+                        url = f"http://{ip}:{LONGHORN_MGR_PORT}/v1/schemas"
+                        return get_pooled_longhorn_client(url)
             except Exception as e:
                 logging(f"Getting longhorn client error: {e}, retry ({i}) ...")
                 time.sleep(retry_interval)
 
 
+def run_concurrently(tasks, max_workers=BULK_MAX_WORKERS):
+    """
+    Runs a dict of name -> callable on a bounded worker pool and returns
+    name -> {"result", "error", "elapsed"} once every task has finished.
+    """
+    def run(task):
+        start = time.time()
+        try:
+            return {"result": task(), "error": None, "elapsed": time.time() - start}
+        except Exception as e:
+            return {"result": None, "error": e, "elapsed": time.time() - start}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {name: executor.submit(run, task) for name, task in tasks.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
 def get_test_case_namespace(test_name):
     return test_name.lower().replace(' ', '-')
 
@@ -0,0 +1,393 @@
+import copy
+import threading
+import time
+
+from kubernetes import client
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+
+from utility.constant import ANNOT_TEST_PREFIX
+from utility.constant import WATCH_RESYNC_INTERVAL
+from utility.constant import WATCH_STREAM_TIMEOUT
+
+
+class CustomResourceWatcher:
+    """
+    Keeps the latest copy of every object of one custom resource kind,
+    fed by a single watch stream that resumes from the last seen
+    resourceVersion. Any number of waiters can block on it at once and
+    are woken on every event instead of polling the API server.
+
+    Objects are also indexed by label, by owner uid and by the values of
+    their test.longhorn.io/ annotations so that reads can be served from
+    memory while the watch is in sync.
+    """
+
+    def __init__(self, group, version, namespace, plural):
+        self.group = group
+        self.version = version
+        self.namespace = namespace
+        self.plural = plural
+        self.obj_api = client.CustomObjectsApi()
+
+        self.objects = {}
+        self.label_index = {}
+        self.owner_index = {}
+        self.annotation_index = {}
+        self.resource_version = None
+        self.condition = threading.Condition()
+        self.thread = None
+        self.synced = False
+
+    def start(self):
+        with self.condition:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            try:
+                self.relist()
+            except Exception:
+                # the watch thread keeps retrying the relist
+                pass
+            self.thread = threading.Thread(target=self.run, daemon=True,
+                                           name=f"watch-{self.plural}")
+            self.thread.start()
+
+    def relist(self):
+        resp = self.obj_api.list_namespaced_custom_object(
+            self.group, self.version, self.namespace, self.plural)
+        with self.condition:
+            self.objects = {}
+            self.label_index = {}
+            self.owner_index = {}
+            self.annotation_index = {}
+            for item in resp['items']:
+                self.add(item)
+            self.resource_version = resp['metadata']['resourceVersion']
+            self.synced = True
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            try:
+                if not self.synced:
+                    self.relist()
+                self.stream()
+            except Exception:
+                # events may have been missed while disconnected, serve
+                # reads from the API server until the next relist
+                self.mark_unsynced()
+                time.sleep(WATCH_RESYNC_INTERVAL)
+
+    def mark_unsynced(self):
+        # wake the waiters so that they stop trusting the cache
+        with self.condition:
+            self.synced = False
+            self.condition.notify_all()
+
+    def stream(self):
+        w = watch.Watch()
+        for event in w.stream(self.obj_api.list_namespaced_custom_object,
+                              self.group, self.version, self.namespace,
+                              self.plural,
+                              resource_version=self.resource_version,
+                              allow_watch_bookmarks=True,
+                              timeout_seconds=WATCH_STREAM_TIMEOUT):
+            event_type = event['type']
+            obj = event['object']
+            if event_type == 'ERROR':
+                if obj.get('code') == 410:
+                    self.mark_unsynced()
+                w.stop()
+                return
+            with self.condition:
+                self.resource_version = obj['metadata']['resourceVersion']
+                if event_type == 'DELETED':
+                    self.remove(obj['metadata']['name'])
+                elif event_type in ('ADDED', 'MODIFIED'):
+                    current = self.objects.get(obj['metadata']['name'])
+                    if current is None or not is_older(obj, current):
+                        self.add(obj)
+                self.condition.notify_all()
+
+    def add(self, obj):
+        name = obj['metadata']['name']
+        self.remove(name)
+        self.objects[name] = obj
+        for key, value in (obj['metadata'].get('labels') or {}).items():
+            self.label_index.setdefault((key, value), set()).add(name)
+        for owner in obj['metadata'].get('ownerReferences') or []:
+            self.owner_index.setdefault(owner['uid'], set()).add(name)
+        for key, value in test_annotations(obj).items():
+            self.annotation_index.setdefault((key, value), set()).add(name)
+
+    def update(self, obj):
+        """
+        Store an object returned by a write to the API server, so that it can
+        be read back before its watch event arrives. Events older than it
+        that are still in flight do not overwrite it.
+        """
+        with self.condition:
+            current = self.objects.get(obj['metadata']['name'])
+            if current is not None and is_older(obj, current):
+                return
+            self.add(obj)
+            self.condition.notify_all()
+
+    def remove(self, name):
+        obj = self.objects.pop(name, None)
+        if obj is None:
+            return
+        for key, value in (obj['metadata'].get('labels') or {}).items():
+            self.label_index.get((key, value), set()).discard(name)
+        for owner in obj['metadata'].get('ownerReferences') or []:
+            self.owner_index.get(owner['uid'], set()).discard(name)
+        for key, value in test_annotations(obj).items():
+            self.annotation_index.get((key, value), set()).discard(name)
+
+    def get(self, name):
+        """
+        Returns a copy of the named object, or None if it does not exist.
+        Raises CacheNotSyncedError while the watch is out of sync.
+        """
+        with self.condition:
+            if not self.synced:
+                raise CacheNotSyncedError(self.plural)
+            return copy.deepcopy(self.objects.get(name))
+
+    def list(self, label_selector=""):
+        """
+        Returns copies of the objects matching an equality-based label
+        selector such as "longhornvolume=vol-1,longhornnode=node-1".
+        Raises CacheNotSyncedError while the watch is out of sync and
+        ValueError for selectors the index cannot answer.
+        """
+        terms = parse_label_selector(label_selector)
+        with self.condition:
+            if not self.synced:
+                raise CacheNotSyncedError(self.plural)
+            names = set(self.objects)
+            for term in terms:
+                names &= self.label_index.get(term, set())
+            return [copy.deepcopy(self.objects[name]) for name in sorted(names)]
+
+    def list_by_owner(self, owner_uid):
+        with self.condition:
+            if not self.synced:
+                raise CacheNotSyncedError(self.plural)
+            names = self.owner_index.get(owner_uid, set())
+            return [copy.deepcopy(self.objects[name]) for name in sorted(names)]
+
+    def get_annotation(self, name, key):
+        """
+        Returns the annotation value of the named object without copying the
+        object, None if it has no such annotation. Raises KeyError if the
+        object is not cached and CacheNotSyncedError while the watch is out
+        of sync.
+        """
+        with self.condition:
+            if not self.synced:
+                raise CacheNotSyncedError(self.plural)
+            obj = self.objects[name]
+            return (obj['metadata'].get('annotations') or {}).get(key)
+
+    def list_by_annotation(self, key, value):
+        """
+        Returns the names of the objects with a test.longhorn.io/ annotation
+        set to the value.
+        """
+        with self.condition:
+            if not self.synced:
+                raise CacheNotSyncedError(self.plural)
+            return sorted(self.annotation_index.get((key, value), set()))
+
+    def read(self, name):
+        """
+        Reads the named object from the API server, None if it does not
+        exist.
+        """
+        try:
+            return self.obj_api.get_namespaced_custom_object(
+                self.group, self.version, self.namespace, self.plural, name)
+        except ApiException as e:
+            if e.status == 404:
+                return None
+            raise e
+
+    def wait_for(self, name, predicate, timeout):
+        """
+        Block until predicate(obj) holds for the named object or timeout
+        seconds pass. obj is None while the object does not exist.
+        Returns (matched, obj).
+
+        The cache may miss or still hold objects while the watch is out of
+        sync, so until it is synced again the predicate is evaluated on the
+        object read from the API server every resync interval.
+        """
+        self.start()
+        deadline = time.time() + timeout
+        obj = None
+        with self.condition:
+            while True:
+                synced = self.synced
+                if synced:
+                    obj = self.objects.get(name)
+                    known = True
+                else:
+                    self.condition.release()
+                    try:
+                        obj = self.read(name)
+                        known = True
+                    except Exception:
+                        known = False
+                    finally:
+                        self.condition.acquire()
+                try:
+                    if known and predicate(obj):
+                        return True, copy.deepcopy(obj)
+                except (KeyError, TypeError):
+                    pass
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False, copy.deepcopy(obj)
+                if not synced:
+                    remaining = min(remaining, WATCH_RESYNC_INTERVAL)
+                self.condition.wait(remaining)
+
+
+class CacheNotSyncedError(Exception):
+    pass
+
+
+def test_annotations(obj):
+    return {key: value
+            for key, value in (obj['metadata'].get('annotations') or {}).items()
+            if key.startswith(ANNOT_TEST_PREFIX)}
+
+
+def is_older(obj, than):
+    """
+    Whether obj is an older version of the same object than than. Resource
+    versions are opaque, but are integers on every supported API server.
+    """
+    if obj['metadata'].get('uid') != than['metadata'].get('uid'):
+        return False
+    try:
+        return int(obj['metadata']['resourceVersion']) < \
+            int(than['metadata']['resourceVersion'])
+    except (KeyError, ValueError):
+        return False
+
+
+def parse_label_selector(label_selector):
+    terms = []
+    for term in (label_selector or "").split(","):
+        term = term.strip()
+        if not term:
+            continue
+        if "!=" in term or "=" not in term:
+            raise ValueError(f"unsupported label selector {label_selector}")
+        separator = "==" if "==" in term else "="
+        key, value = term.split(separator, 1)
+        terms.append((key.strip(), value.strip()))
+    return terms
+
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+def get_cr_watcher(group, version, namespace, plural):
+    key = (group, version, namespace, plural)
+    with _watchers_lock:
+        watcher = _watchers.get(key)
+        if watcher is None:
+            watcher = CustomResourceWatcher(group, version, namespace, plural)
+            _watchers[key] = watcher
+    watcher.start()
+    return watcher
+
+
+def wait_for_cr(group, version, namespace, plural, name, predicate, timeout):
+    watcher = get_cr_watcher(group, version, namespace, plural)
+    return watcher.wait_for(name, predicate, timeout)
+
+
+def get_cached_cr(group, version, namespace, plural, name):
+    """
+    Reads an object from the shared watch cache, falling back to the API
+    server while the cache is out of sync or does not have the object yet.
+    """
+    watcher = get_cr_watcher(group, version, namespace, plural)
+    try:
+        obj = watcher.get(name)
+        if obj is not None:
+            return obj
+    except CacheNotSyncedError:
+        pass
+    return watcher.obj_api.get_namespaced_custom_object(
+        group, version, namespace, plural, name)
+
+
+def get_cached_annotation(group, version, namespace, plural, name, key):
+    """
+    Reads an annotation of an object from the shared watch cache, falling
+    back to the API server like get_cached_cr.
+    """
+    watcher = get_cr_watcher(group, version, namespace, plural)
+    try:
+        return watcher.get_annotation(name, key)
+    except (CacheNotSyncedError, KeyError):
+        pass
+    obj = watcher.obj_api.get_namespaced_custom_object(
+        group, version, namespace, plural, name)
+    return (obj['metadata'].get('annotations') or {}).get(key)
+
+
+def find_cached_crs_by_annotation(group, version, namespace, plural, key,
+                                  value):
+    """
+    Returns the names of the objects whose test.longhorn.io/ annotation key
+    is set to value, from the index of the shared watch cache, or from one
+    list call while the cache is out of sync.
+    """
+    watcher = get_cr_watcher(group, version, namespace, plural)
+    try:
+        return watcher.list_by_annotation(key, value)
+    except CacheNotSyncedError:
+        items = watcher.obj_api.list_namespaced_custom_object(
+            group, version, namespace, plural)['items']
+        return sorted(item['metadata']['name'] for item in items
+                      if test_annotations(item).get(key) == value)
+
+
+def patch_cr_annotations(group, version, namespace, plural, name,
+                         annotations):
+    """
+    Sets the annotations of an object with one merge patch, which needs no
+    read beforehand and cannot conflict, and stores the patched object in
+    the shared watch cache.
+    """
+    return patch_cr(group, version, namespace, plural, name,
+                    {"metadata": {"annotations": annotations}})
+
+
+def patch_cr(group, version, namespace, plural, name, body):
+    """
+    Applies a merge patch to an object and stores the patched object in the
+    shared watch cache, so reads right after the patch see it.
+    """
+    watcher = get_cr_watcher(group, version, namespace, plural)
+    obj = watcher.obj_api.patch_namespaced_custom_object(
+        group, version, namespace, plural, name, body)
+    watcher.update(obj)
+    return obj
+
+
+def list_cached_crs(group, version, namespace, plural, label_selector=""):
+    watcher = get_cr_watcher(group, version, namespace, plural)
+    try:
+        return watcher.list(label_selector)
+    except (CacheNotSyncedError, ValueError):
+        return watcher.obj_api.list_namespaced_custom_object(
+            group, version, namespace, plural,
+            label_selector=label_selector)['items']
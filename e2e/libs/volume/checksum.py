@@ -0,0 +1,125 @@
+import hashlib
+import threading
+
+from node_exec import NodeExec
+
+from utility.utility import logging
+
+from volume.constant import CHECKSUM_EXTENT_SIZE_MIB
+from volume.constant import MEBIBYTE
+
+
+# per-extent md5 digests keyed by (node, device) and holding the device
+# generation they were computed for. the generation is the engine identity
+# given by the caller plus the device major:minor and size, so a new engine
+# or an expansion invalidates every cached digest. writes do not change it,
+# unlike the ctime of the device node. a frontend restarted by an attach or
+# a revert can come back with the same engine and device numbers, so those
+# operations drop the digests with invalidate_volume_checksums.
+_extent_digests = {}
+_extent_digests_lock = threading.Lock()
+
+
+def hash_extents_cmd(endpoint, extents):
+    extent_list = " ".join(str(i) for i in extents) if extents is not None \
+        else f"$(seq 0 $(( ($size + {CHECKSUM_EXTENT_SIZE_MIB * MEBIBYTE} - 1) / {CHECKSUM_EXTENT_SIZE_MIB * MEBIBYTE} - 1 )))"
+    return [
+        "sh", "-c",
+        f"size=$(blockdev --getsize64 {endpoint}); "
+        f"echo generation $(stat -L -c '%t:%T' {endpoint}):$size; "
+        f"for i in {extent_list}; do echo $i; done | "
+        f"xargs -P $(nproc) -I{{}} sh -c "
+        f"'echo {{}} $(dd if={endpoint} bs=1M skip=$(({{}} * {CHECKSUM_EXTENT_SIZE_MIB})) count={CHECKSUM_EXTENT_SIZE_MIB} status=none | md5sum | cut -d\" \" -f1)'"
+    ]
+
+
+def parse_extent_digests(output):
+    generation = None
+    digests = {}
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) != 2:
+            continue
+        if fields[0] == "generation":
+            generation = fields[1]
+        else:
+            digests[int(fields[0])] = fields[1]
+    return generation, digests
+
+
+def merkle_root(digests):
+    level = [bytes.fromhex(digests[i]) for i in sorted(digests)]
+    if not level:
+        return hashlib.md5(b"").hexdigest()
+    while len(level) > 1:
+        next_level = []
+        for i in range(0, len(level), 2):
+            if i + 1 < len(level):
+                next_level.append(hashlib.md5(level[i] + level[i + 1]).digest())
+            else:
+                next_level.append(level[i])
+        level = next_level
+    return level[0].hex()
+
+
+def dirty_extents(offset_mib, size_mib):
+    first = offset_mib // CHECKSUM_EXTENT_SIZE_MIB
+    last = (offset_mib + size_mib - 1) // CHECKSUM_EXTENT_SIZE_MIB
+    return list(range(first, last + 1))
+
+
+def invalidate_device_checksum(node_name, endpoint):
+    """
+    Drop the cached digests of a device written outside of
+    get_device_checksum's dirty ranges.
+    """
+    with _extent_digests_lock:
+        _extent_digests.pop((node_name, endpoint), None)
+
+
+def invalidate_volume_checksums(volume_name):
+    """
+    Drop the cached digests of the volume device on every node, e.g. when
+    the volume is attached, detached or reverted to a snapshot.
+    """
+    with _extent_digests_lock:
+        for key in [key for key in _extent_digests
+                    if key[1].rstrip("/").split("/")[-1] == volume_name]:
+            del _extent_digests[key]
+
+
+def get_device_checksum(node_name, endpoint, dirty_ranges=None, identity=""):
+    """
+    Hash the device in fixed-size extents in parallel on the node and
+    return the Merkle root over the extent digests.
+
+    With dirty_ranges, a list of (offset_mib, size_mib) written since the
+    last call, only the extents covering them are rehashed as long as the
+    device generation is unchanged; otherwise the whole device is hashed.
+    identity names the engine serving the device, see crd.get_engine_identity.
+    """
+    key = (node_name, endpoint)
+    with _extent_digests_lock:
+        cached_generation, cached_digests = _extent_digests.get(key, (None, {}))
+
+    extents = None
+    if dirty_ranges is not None and cached_digests:
+        extents = sorted({extent for offset_mib, size_mib in dirty_ranges
+                          for extent in dirty_extents(offset_mib, size_mib)})
+
+    output = NodeExec(node_name).issue_cmd(hash_extents_cmd(endpoint, extents))
+    generation, digests = parse_extent_digests(output)
+    generation = f"{identity}/{generation}"
+
+    if extents is not None:
+        if generation != cached_generation:
+            logging(f"Device {endpoint} on {node_name} changed from generation {cached_generation} to {generation}, rehashing all extents")
+            return get_device_checksum(node_name, endpoint, identity=identity)
+        merged = dict(cached_digests)
+        merged.update(digests)
+        digests = merged
+
+    with _extent_digests_lock:
+        _extent_digests[key] = (generation, digests)
+
+    return merkle_root(digests)
@@ -6,3 +6,5 @@ VOLUME_FRONTEND_BLOCKDEV = "blockdev"
 VOLUME_FRONTEND_ISCSI = "iscsi"
 
 DEV_PATH = "/dev/longhorn/"
+
+CHECKSUM_EXTENT_SIZE_MIB = 64
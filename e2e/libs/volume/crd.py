@@ -12,8 +12,13 @@ from utility.constant import LABEL_TEST_VALUE
 from utility.utility import get_retry_count_and_interval
 from utility.utility import logging
 from utility.utility import get_cr
+from utility.watcher import get_cached_cr
+from utility.watcher import list_cached_crs
+from utility.watcher import wait_for_cr
 
 from volume.base import Base
+from volume.checksum import get_device_checksum
+from volume.checksum import invalidate_device_checksum
 from volume.constant import GIBIBYTE, MEBIBYTE
 from volume.rest import Rest
 
@@ -173,7 +178,7 @@ class CRD(Base):
                 Exception(f'exception for patching volumeattachments:', e)
 
     def get(self, volume_name):
-        return self.obj_api.get_namespaced_custom_object(
+        return get_cached_cr(
             group="longhorn.io",
             version="v1beta2",
             namespace="longhorn-system",
@@ -182,13 +187,13 @@ class CRD(Base):
         )
 
     def list(self, label_selector=None, dataEngine=None):
-        items = self.obj_api.list_namespaced_custom_object(
+        items = list_cached_crs(
             group="longhorn.io",
             version="v1beta2",
             namespace="longhorn-system",
             plural="volumes",
             label_selector=label_selector
-        )["items"]
+        )
 
         if not dataEngine:
             return items
@@ -223,79 +228,54 @@ class CRD(Base):
         volume = self.get(volume_name)
         return volume['metadata']['annotations'].get(annotation_key)
 
+    def wait_for_volume(self, volume_name, predicate):
+        # fires on the first watch event where predicate holds instead of
+        # polling every retry interval; the deadline matches the retry budget
+        return wait_for_cr(
+            group="longhorn.io",
+            version="v1beta2",
+            namespace="longhorn-system",
+            plural="volumes",
+            name=volume_name,
+            predicate=predicate,
+            timeout=self.retry_count * self.retry_interval
+        )
+
     def wait_for_volume_deleted(self, volume_name):
-        for i in range(self.retry_count):
-            logging(f"Waiting for volume {volume_name} deleted ... ({i})")
-            try:
-                self.obj_api.get_namespaced_custom_object(
-                    group="longhorn.io",
-                    version="v1beta2",
-                    namespace="longhorn-system",
-                    plural="volumes",
-                    name=volume_name
-                )
-            except Exception as e:
-                if e.reason == 'Not Found':
-                    logging(f"Deleted volume {volume_name}")
-                    return
-                else:
-                    logging(f"Waiting for volume deleting error: {e}")
-            time.sleep(self.retry_interval)
-        assert False, f"expect volume {volume_name} deleted but it still exists"
+        logging(f"Waiting for volume {volume_name} deleted ...")
+        deleted, _ = self.wait_for_volume(volume_name, lambda volume: volume is None)
+        assert deleted, f"expect volume {volume_name} deleted but it still exists"
+        logging(f"Deleted volume {volume_name}")
 
     def wait_for_volume_status(self, volume_name, status, value):
-        volume = None
-        for i in range(self.retry_count):
-            logging(f"Waiting for {volume_name} {status}={value} ({i}) ...")
-            try:
-                volume = self.get(volume_name)
-                if volume["status"][status] == value:
-                    break
-            except Exception as e:
-                logging(f"Getting volume {volume_name} {status} status error: {e}")
-            time.sleep(self.retry_interval)
-        assert volume["status"][status] == value, \
+        logging(f"Waiting for {volume_name} {status}={value} ...")
+        matched, volume = self.wait_for_volume(
+            volume_name, lambda volume: volume["status"][status] == value)
+        assert volume is not None, f"Volume {volume_name} not found"
+        assert matched, \
             f"Expected volume {volume_name} {status}={value},\n" \
-            f"but got {volume['status'][status]}\n"
+            f"but got {volume.get('status', {}).get(status)}\n"
 
     def wait_for_restore_required_status(self, volume_name, restore_required_state):
-        volume = None
-        for i in range(self.retry_count):
-            logging(f"Waiting for {volume_name} restoreRequired={restore_required_state} ({i}) ...")
-            try:
-                volume = self.get(volume_name)
-                if volume["status"]["restoreRequired"] == restore_required_state:
-                    break
-            except Exception as e:
-                logging(f"Getting volume {volume_name} restoreRequired status error: {e}")
-            time.sleep(self.retry_interval)
-        assert volume["status"]["restoreRequired"] == restore_required_state, \
+        logging(f"Waiting for {volume_name} restoreRequired={restore_required_state} ...")
+        matched, volume = self.wait_for_volume(
+            volume_name, lambda volume: volume["status"]["restoreRequired"] == restore_required_state)
+        assert volume is not None, f"Volume {volume_name} not found"
+        assert matched, \
             f"Expected volume {volume_name} restoreRequired={restore_required_state},\n" \
-            f"but got {volume['status']['restoreRequired']}\n"
+            f"but got {volume.get('status', {}).get('restoreRequired')}\n"
 
     def wait_for_volume_to_be_created(self, volume_name):
-        for i in range(self.retry_count):
-            logging(f"Waiting for volume {volume_name} to be created ... ({i})")
-            try:
-                self.get(volume_name)
-                return
-            except Exception as e:
-                logging(f"Failed to wait for volume {volume_name} to be created: {e}")
-            time.sleep(self.retry_interval)
-        assert False, f"Failed to wait for volume {volume_name} to be created"
+        logging(f"Waiting for volume {volume_name} to be created ...")
+        created, _ = self.wait_for_volume(volume_name, lambda volume: volume is not None)
+        assert created, f"Failed to wait for volume {volume_name} to be created"
 
     def wait_for_volume_state(self, volume_name, desired_state):
-        volume = None
-        for i in range(self.retry_count):
-            logging(f"Waiting for {volume_name} {desired_state} ... ({i})")
-            try:
-                volume = self.get(volume_name)
-                if volume["status"]["state"] == desired_state:
-                    break
-            except Exception as e:
-                logging(f"Getting volume {volume} status error: {e}")
-            time.sleep(self.retry_interval)
-        assert volume["status"]["state"] == desired_state
+        logging(f"Waiting for {volume_name} {desired_state} ...")
+        matched, volume = self.wait_for_volume(
+            volume_name, lambda volume: volume["status"]["state"] == desired_state)
+        assert volume is not None, f"Volume {volume_name} not found"
+        assert matched, volume
 
     def wait_for_volume_attaching(self, volume_name):
         self.wait_for_volume_state(volume_name, "attaching")
@@ -304,31 +284,22 @@ class CRD(Base):
         assert volume["status"]["currentNodeID"] == ""
 
     def wait_for_volume_clone_status(self, volume_name, desired_state):
-        volume = None
-        for i in range(self.retry_count):
-            logging(f"Waiting for {volume_name} cloneStatus to be {desired_state} ... ({i})")
-            try:
-                volume = self.get(volume_name)
-                if volume["status"]["cloneStatus"]["state"] == desired_state:
-                    break
-            except Exception as e:
-                logging(f"Getting volume {volume} cloneStatus error: {e}")
-            time.sleep(self.retry_interval)
-        assert volume["status"]["cloneStatus"]["state"] == desired_state
+        logging(f"Waiting for {volume_name} cloneStatus to be {desired_state} ...")
+        matched, volume = self.wait_for_volume(
+            volume_name, lambda volume: volume["status"]["cloneStatus"]["state"] == desired_state)
+        assert volume is not None, f"Volume {volume_name} not found"
+        assert matched, volume
 
     def wait_for_volume_condition(self, volume_name, condition_name, condition_status, reason):
-        volume = None
-        for i in range(self.retry_count):
-            logging(f"Waiting for {volume_name} {condition_name}={condition_status} reason={reason} ... ({i})")
-            try:
-                volume = self.get(volume_name)
-                for condition in volume["status"]["conditions"]:
-                    if condition["type"].lower() == condition_name.lower() and condition["status"].lower() == condition_status.lower() and reason in condition["reason"]:
-                        return
-            except Exception as e:
-                logging(f"Getting volume {volume} conditions error: {e}")
-            time.sleep(self.retry_interval)
-        assert False, f"Failed to wait for {volume_name} {condition_name}={condition_status} reason={reason}: {volume}"
+        def is_condition_met(volume):
+            for condition in volume["status"]["conditions"]:
+                if condition["type"].lower() == condition_name.lower() and condition["status"].lower() == condition_status.lower() and reason in condition["reason"]:
+                    return True
+            return False
+
+        logging(f"Waiting for {volume_name} {condition_name}={condition_status} reason={reason} ...")
+        met, volume = self.wait_for_volume(volume_name, is_condition_met)
+        assert met, f"Failed to wait for {volume_name} {condition_name}={condition_status} reason={reason}: {volume}"
 
     def is_replica_running(self, volume_name, node_name, is_running):
         return Rest().is_replica_running(volume_name, node_name, is_running)
@@ -353,30 +324,18 @@ class CRD(Base):
             time.sleep(self.retry_interval)
 
     def wait_for_volume_robustness(self, volume_name, desired_state):
-        volume = None
-        for i in range(self.retry_count):
-            logging(f"Waiting for {volume_name} {desired_state} ({i}) ...")
-            try:
-                volume = self.get(volume_name)
-                if volume["status"]["robustness"] == desired_state:
-                    break
-            except Exception as e:
-                logging(f"Getting volume {volume} robustness error: {e}")
-            time.sleep(self.retry_interval)
-        assert volume["status"]["robustness"] == desired_state
+        logging(f"Waiting for {volume_name} {desired_state} ...")
+        matched, volume = self.wait_for_volume(
+            volume_name, lambda volume: volume["status"]["robustness"] == desired_state)
+        assert volume is not None, f"Volume {volume_name} not found"
+        assert matched, volume
 
     def wait_for_volume_robustness_not(self, volume_name, not_desired_state):
-        volume = None
-        for i in range(self.retry_count):
-            logging(f"Waiting for {volume_name} robustness not {not_desired_state} ({i}) ...")
-            try:
-                volume = self.get(volume_name)
-                if volume["status"]["robustness"] != not_desired_state:
-                    break
-            except Exception as e:
-                logging(f"Getting volume {volume} robustness error: {e}")
-            time.sleep(self.retry_interval)
-        assert volume["status"]["robustness"] != not_desired_state
+        logging(f"Waiting for {volume_name} robustness not {not_desired_state} ...")
+        matched, volume = self.wait_for_volume(
+            volume_name, lambda volume: volume["status"]["robustness"] != not_desired_state)
+        assert volume is not None, f"Volume {volume_name} not found"
+        assert matched, volume
 
     def wait_for_volume_migration_to_be_ready(self, volume_name):
         ready = False
@@ -496,6 +455,22 @@ class CRD(Base):
     def get_endpoint(self, volume_name):
         return Rest().get_endpoint(volume_name)
 
+    def get_engine_identity(self, volume_name):
+        """
+        Identify the engines serving the volume frontend. It changes when an
+        engine is replaced or moves to another instance manager, but not
+        always when the same engine is started again, see
+        checksum.invalidate_volume_checksums.
+        """
+        identities = []
+        for engine in self.engine.get_engines(volume_name):
+            status = engine.get('status', {})
+            identities.append(f"{engine['metadata']['uid']}:"
+                              f"{status.get('instanceManagerName')}:"
+                              f"{status.get('ip')}:{status.get('port')}:"
+                              f"{status.get('endpoint')}")
+        return ",".join(sorted(identities))
+
     def write_random_data(self, volume_name, size, data_id):
 
         self.wait_for_volume_state(volume_name, "attached")
@@ -508,13 +483,17 @@ class CRD(Base):
 
         endpoint = self.get_endpoint(volume_name)
 
+        offset, size = 0, int(size)
         cmd = [
             "sh", "-c",
-            f"dd if=/dev/urandom of={endpoint} bs=1M count={size} status=none; "
-            "sync; "
-            f"md5sum {endpoint} | awk '{{print $1}}' | tr -d ' \n'"
+            f"dd if=/dev/urandom of={endpoint} bs=1M seek={offset} count={size} status=none; "
+            "sync"
         ]
-        checksum = NodeExec(node_name).issue_cmd(cmd)
+        NodeExec(node_name).issue_cmd(cmd)
+        # only the extents covered by this write are rehashed
+        checksum = get_device_checksum(node_name, endpoint,
+                                       dirty_ranges=[(offset, size)],
+                                       identity=self.get_engine_identity(volume_name))
 
         if data_id:
             logging(f"Storing volume {volume_name} data {data_id} checksum = {checksum}")
@@ -534,27 +513,28 @@ class CRD(Base):
             time.sleep(self.retry_interval)
 
         endpoint = self.get_endpoint(volume_name)
+        # the background writes make any cached digest of the device stale
+        invalidate_device_checksum(node_name, endpoint)
         logging(f"Keeping writing data to volume {volume_name}")
         res = NodeExec(node_name).issue_cmd(
             f"while true; do dd if=/dev/urandom of={endpoint} bs=1M count={size} status=none; done > /dev/null 2> /dev/null &")
         logging(f"Created process to keep writing data to volume {volume_name}")
 
     def delete_replica(self, volume_name, node_name):
-        replica_list = self.obj_api.list_namespaced_custom_object(
+        replica_list = list_cached_crs(
             group="longhorn.io",
             version="v1beta2",
             namespace="longhorn-system",
             plural="replicas",
-            label_selector=f"longhornvolume={volume_name}\
-                             ,longhornnode={node_name}"
+            label_selector=f"longhornvolume={volume_name},longhornnode={node_name}"
         )
-        logging(f"Deleting replica {replica_list['items'][0]['metadata']['name']}")
+        logging(f"Deleting replica {replica_list[0]['metadata']['name']}")
         self.obj_api.delete_namespaced_custom_object(
             group="longhorn.io",
             version="v1beta2",
             namespace="longhorn-system",
             plural="replicas",
-            name=replica_list['items'][0]['metadata']['name']
+            name=replica_list[0]['metadata']['name']
         )
 
     def delete_replica_by_name(self, volume_name, replica_name):
@@ -602,19 +582,19 @@ class CRD(Base):
     def get_checksum(self, volume_name):
         node_name = self.get(volume_name)["spec"]["nodeID"]
         endpoint = self.get_endpoint(volume_name)
-        checksum = NodeExec(node_name).issue_cmd(
-            ["sh", "-c", f"md5sum {endpoint} | awk '{{print $1}}' | tr -d ' \n'"])
+        checksum = get_device_checksum(node_name, endpoint,
+                                       identity=self.get_engine_identity(volume_name))
         logging(f"Calculated volume {volume_name} checksum {checksum}")
         return checksum
 
     def validate_volume_replicas_anti_affinity(self, volume_name):
-        replica_list = self.obj_api.list_namespaced_custom_object(
+        replica_list = list_cached_crs(
             group="longhorn.io",
             version="v1beta2",
             namespace="longhorn-system",
             plural="replicas",
             label_selector=f"longhornvolume={volume_name}"
-        )['items']
+        )
         node_set = set()
         for replica in replica_list:
             node_set.add(replica['status']['ownerID'])
@@ -2,12 +2,11 @@ import os
 import time
 import asyncio
 
-from node_exec import NodeExec
-
 from persistentvolumeclaim.persistentvolumeclaim import PersistentVolumeClaim
 from persistentvolume.persistentvolume import PersistentVolume
 
 from volume.base import Base
+from volume.checksum import get_device_checksum
 from volume.constant import DEV_PATH
 from volume.constant import VOLUME_FRONTEND_BLOCKDEV
 from volume.constant import VOLUME_FRONTEND_ISCSI
@@ -354,8 +353,7 @@ class Rest(Base):
     def get_checksum(self, volume_name):
         node_name = self.get(volume_name).controllers[0].hostId
         endpoint = self.get_endpoint(volume_name)
-        checksum = NodeExec(node_name).issue_cmd(
-            ["sh", "-c", f"md5sum {endpoint} | awk '{{print $1}}' | tr -d ' \n'"])
+        checksum = get_device_checksum(node_name, endpoint)
         logging(f"Calculated volume {volume_name} checksum {checksum}")
         return checksum
 
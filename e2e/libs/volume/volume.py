@@ -1,6 +1,10 @@
 from strategy import LonghornOperationStrategy
 
+from utility.utility import logging
+from utility.utility import run_concurrently
+
 from volume.base import Base
+from volume.checksum import invalidate_volume_checksums
 from volume.crd import CRD
 from volume.rest import Rest
 
@@ -21,16 +25,62 @@ class Volume(Base):
     def delete(self, volume_name):
         return self.volume.delete(volume_name)
 
+    def run_bulk(self, operation, tasks):
+        # every waiter shares the same volumes watch, so waiting on all the
+        # volumes together costs one watch stream instead of N poll loops
+        results = run_concurrently(tasks)
+        failed = {}
+        for volume_name, res in results.items():
+            logging(f"{operation} volume {volume_name} took {res['elapsed']:.1f}s" +
+                    (f" and failed: {res['error']}" if res['error'] else ""))
+            if res['error']:
+                failed[volume_name] = res['error']
+        assert not failed, f"Failed to {operation.lower()} volumes: {failed}"
+        return results
+
+    def create_volumes(self, volume_specs):
+        """
+        volume_specs maps volume names to keyword arguments of create().
+        """
+        return self.run_bulk("Create", {
+            volume_name: lambda volume_name=volume_name, spec=spec: self.create(volume_name, **spec)
+            for volume_name, spec in volume_specs.items()
+        })
+
+    def delete_volumes(self, volume_names):
+        return self.run_bulk("Delete", {
+            volume_name: lambda volume_name=volume_name: self.delete(volume_name)
+            for volume_name in volume_names
+        })
+
+    def attach_volumes(self, volume_names, node_name, disable_frontend):
+        return self.run_bulk("Attach", {
+            volume_name: lambda volume_name=volume_name: self.attach(volume_name, node_name, disable_frontend)
+            for volume_name in volume_names
+        })
+
+    def detach_volumes(self, volume_names, node_name):
+        def detach(volume_name):
+            self.detach(volume_name, node_name)
+            self.wait_for_volume_detached(volume_name)
+
+        return self.run_bulk("Detach", {
+            volume_name: lambda volume_name=volume_name: detach(volume_name)
+            for volume_name in volume_names
+        })
+
     def wait_for_volume_deleted(self, volume_name):
         return self.volume.wait_for_volume_deleted(volume_name)
 
     def attach(self, volume_name, node_name, disable_frontend):
+        invalidate_volume_checksums(volume_name)
         return self.volume.attach(volume_name, node_name, disable_frontend)
 
     def is_attached_to(self, volume_name, node_name):
         return self.volume.is_attached_to(volume_name, node_name)
 
     def detach(self, volume_name, node_name):
+        invalidate_volume_checksums(volume_name)
         return self.volume.detach(volume_name, node_name)
 
     def get(self, volume_name):
@@ -0,0 +1,132 @@
+import time
+
+from kubernetes import client
+from kubernetes.client.rest import ApiException
+
+from utility.utility import get_retry_count_and_interval
+from utility.utility import logging
+
+
+def new_daemonset_manifest(name, pod_manifest, node_names, labels={}):
+    """
+    Return a DaemonSet running the pod of pod_manifest on the given nodes.
+    The nodes are selected by name, so the pods start on all of them at
+    once instead of one pod creation after another.
+
+    The DaemonSet uses the OnDelete update strategy: adding nodes changes
+    the pod template, and a rolling update would restart the pods already
+    running, one node at a time.
+    """
+    pod_spec = dict(pod_manifest['spec'])
+    pod_spec.pop('nodeName', None)
+    # a DaemonSet restarts its pods when they exit
+    pod_spec['restartPolicy'] = 'Always'
+    pod_spec['affinity'] = new_node_names_affinity(node_names)
+
+    return {
+        'apiVersion': 'apps/v1',
+        'kind': 'DaemonSet',
+        'metadata': {
+            'name': name,
+            'namespace': pod_manifest['metadata']['namespace'],
+            'labels': labels
+        },
+        'spec': {
+            'selector': {
+                'matchLabels': labels
+            },
+            'updateStrategy': {
+                'type': 'OnDelete'
+            },
+            'template': {
+                'metadata': {
+                    'labels': labels
+                },
+                'spec': pod_spec
+            }
+        }
+    }
+
+
+def new_node_names_affinity(node_names):
+    return {
+        'nodeAffinity': {
+            'requiredDuringSchedulingIgnoredDuringExecution': {
+                'nodeSelectorTerms': [{
+                    'matchFields': [{
+                        'key': 'metadata.name',
+                        'operator': 'In',
+                        'values': sorted(node_names)
+                    }]
+                }]
+            }
+        }
+    }
+
+
+def get_daemonset_node_names(daemonset):
+    terms = daemonset.spec.template.spec.affinity.node_affinity. \
+        required_during_scheduling_ignored_during_execution.node_selector_terms
+    return set(terms[0].match_fields[0].values)
+
+
+def create_daemonset(manifest):
+    api = client.AppsV1Api()
+    logging(f"Creating daemonset {manifest['metadata']['name']}")
+    return api.create_namespaced_daemon_set(
+        namespace=manifest['metadata']['namespace'],
+        body=manifest)
+
+
+def get_daemonset(name, namespace='default'):
+    api = client.AppsV1Api()
+    try:
+        return api.read_namespaced_daemon_set(name=name, namespace=namespace)
+    except ApiException as e:
+        if e.status == 404:
+            return None
+        raise e
+
+
+def set_daemonset_node_names(name, node_names, namespace='default'):
+    api = client.AppsV1Api()
+    logging(f"Updating daemonset {name} nodes to {sorted(node_names)}")
+    body = {
+        'spec': {
+            'template': {
+                'spec': {
+                    'affinity': new_node_names_affinity(node_names)
+                }
+            }
+        }
+    }
+    return api.patch_namespaced_daemon_set(name=name, namespace=namespace,
+                                           body=body)
+
+
+def list_daemonsets(namespace='default', label_selector=None):
+    api = client.AppsV1Api()
+    return api.list_namespaced_daemon_set(
+        namespace=namespace,
+        label_selector=label_selector
+    ).items
+
+
+def delete_daemonset(name, namespace='default'):
+    api = client.AppsV1Api()
+    logging(f"Deleting daemonset {name} in namespace {namespace}")
+
+    try:
+        api.delete_namespaced_daemon_set(
+            name=name,
+            namespace=namespace,
+            grace_period_seconds=0)
+    except ApiException as e:
+        assert e.status == 404
+
+    retry_count, retry_interval = get_retry_count_and_interval()
+    for _ in range(retry_count):
+        if get_daemonset(name, namespace) is None:
+            return
+        time.sleep(retry_interval)
+    assert False, f"Failed to delete daemonset {name}"
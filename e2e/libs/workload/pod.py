@@ -109,6 +109,7 @@ def new_busybox_manifest(pod_name, claim_name):
         manifest_dict['spec']['volumes'][0]['persistentVolumeClaim']['claimName'] = claim_name
         manifest_dict['metadata']['name'] = pod_name
         manifest_dict['metadata']['labels']['app'] = pod_name
+        manifest_dict['metadata']['labels'][LABEL_TEST] = LABEL_TEST_VALUE
         return manifest_dict
 
 
@@ -22,6 +22,7 @@ def create_statefulset(statefulset_name, volume_type, sc_name, size, node_name):
         # correct workload name
         manifest_dict['metadata']['name'] = statefulset_name
         manifest_dict['metadata']['labels'][LABEL_TEST] = LABEL_TEST_VALUE
+        manifest_dict['spec']['volumeClaimTemplates'][0]['metadata']['labels'][LABEL_TEST] = LABEL_TEST_VALUE
         manifest_dict['spec']['selector']['matchLabels']['app'] = statefulset_name
         manifest_dict['spec']['serviceName'] = statefulset_name
         manifest_dict['spec']['template']['metadata']['labels']['app'] = statefulset_name
@@ -1,3 +1,107 @@
 #!/bin/bash
 
-robot -x junit.xml -P ./libs -d /tmp/test-report "$@" ./tests
+REPORT_DIR="/tmp/test-report"
+EXCLUSIVE_TAG="cluster-exclusive"
+TRACER="utility.tracing.ApiTracer"
+
+if [[ -z "${E2E_WORKERS}" || "${E2E_WORKERS}" -le 1 ]]; then
+  robot -x junit.xml -P ./libs -d "${REPORT_DIR}" \
+    --listener "${TRACER}:${REPORT_DIR}" "$@" ./tests
+  exit $?
+fi
+
+# Parallel run: the suites that are not tagged cluster-exclusive are
+# partitioned across E2E_WORKERS robot processes, each with its own
+# E2E_SHARD so its resources get a distinct name prefix and label value.
+# The cluster-exclusive suites run afterwards in a single process, then the
+# outputs are merged into one report and junit.xml.
+shared_suites=()
+exclusive_suites=()
+while IFS= read -r suite; do
+  if grep -qE "^(Test|Force) Tags .*\b${EXCLUSIVE_TAG}\b" "${suite}"; then
+    exclusive_suites+=("${suite}")
+  else
+    shared_suites+=("${suite}")
+  fi
+done < <(find ./tests -name "*.robot" | sort)
+
+# longest suites first, each to the currently least loaded worker
+declare -a shard_suites shard_load
+for ((i = 0; i < E2E_WORKERS; i++)); do
+  shard_suites[i]=""
+  shard_load[i]=0
+done
+while read -r size suite; do
+  [[ -z "${suite}" ]] && continue
+  target=0
+  for ((i = 1; i < E2E_WORKERS; i++)); do
+    if (( shard_load[i] < shard_load[target] )); then
+      target=${i}
+    fi
+  done
+  shard_suites[target]+="${suite} "
+  shard_load[target]=$(( shard_load[target] + size ))
+done < <(for suite in "${shared_suites[@]}"; do
+           echo "$(grep -c "" "${suite}") ${suite}"
+         done | sort -rn)
+
+rm -rf "${REPORT_DIR}"/shard-* "${REPORT_DIR}/exclusive"
+mkdir -p "${REPORT_DIR}"
+pids=()
+names=()
+outputs=()
+for ((i = 0; i < E2E_WORKERS; i++)); do
+  [[ -z "${shard_suites[i]}" ]] && continue
+  shard_dir="${REPORT_DIR}/shard-${i}"
+  echo "shard ${i}: ${shard_suites[i]}"
+  # shellcheck disable=SC2086
+  E2E_SHARD="shard${i}" robot --runemptysuite -P ./libs -d "${shard_dir}" \
+    --listener "${TRACER}:${shard_dir}" --name "Shard ${i}" \
+    --console dotted "$@" ${shard_suites[i]} \
+    > "${shard_dir}.log" 2>&1 &
+  pids+=($!)
+  names+=("shard ${i}")
+  outputs+=("${shard_dir}/output.xml")
+done
+statuses=()
+for pid in "${pids[@]}"; do
+  wait "${pid}"
+  statuses+=($?)
+done
+
+if (( ${#exclusive_suites[@]} > 0 )); then
+  robot --runemptysuite -P ./libs -d "${REPORT_DIR}/exclusive" \
+    --listener "${TRACER}:${REPORT_DIR}/exclusive" \
+    --name "Cluster Exclusive" "$@" "${exclusive_suites[@]}"
+  statuses+=($?)
+  names+=("cluster exclusive")
+  outputs+=("${REPORT_DIR}/exclusive/output.xml")
+fi
+
+# robot exits with the number of failed tests up to 250, higher statuses
+# mean the run itself broke; such a run is reported even if it managed to
+# write a partial output.xml
+crashed=0
+existing_outputs=()
+for ((i = 0; i < ${#outputs[@]}; i++)); do
+  if (( statuses[i] > 250 )); then
+    echo "${names[i]} exited with status ${statuses[i]}" >&2
+    crashed=1
+  fi
+  if [[ -f "${outputs[i]}" ]]; then
+    existing_outputs+=("${outputs[i]}")
+  else
+    echo "${names[i]} did not write ${outputs[i]}" >&2
+    crashed=1
+  fi
+done
+if (( ${#existing_outputs[@]} == 0 )); then
+  exit 255
+fi
+rebot --name Tests -x junit.xml -d "${REPORT_DIR}" -o output.xml \
+  "${existing_outputs[@]}"
+status=$?
+if (( crashed )); then
+  exit 255
+fi
+exit ${status}
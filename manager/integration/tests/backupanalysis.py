@@ -0,0 +1,413 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+
+# size of the volume data a Longhorn backup block holds before compression
+BACKUP_BLOCK_SIZE = 2 * 1024 * 1024
+BACKUPSTORE_BV_PREFIX = "backupstore/volumes/"
+BLOCK_FILE_SUFFIX = ".blk"
+BACKUP_CFG_PREFIX = "backup_"
+BACKUP_CFG_SUFFIX = ".cfg"
+
+# rows buffered by sqlite3 executemany while the stores are streamed
+INSERT_BATCH_SIZE = 10000
+# orphaned and missing blocks listed in the report, the counts are exact
+SAMPLE_SIZE = 20
+
+
+def backup_volume_dir(volume_name):
+    volume_name_sha512 = \
+        hashlib.sha512(volume_name.encode('utf-8')).hexdigest()
+    return BACKUPSTORE_BV_PREFIX + volume_name_sha512[0:2] + "/" + \
+        volume_name_sha512[2:4] + "/" + volume_name
+
+
+class LocalStore:
+    """
+    A backup volume directory on a mounted NFS backupstore, or on a local
+    copy of one.
+    """
+
+    def __init__(self, volume_dir):
+        self.volume_dir = volume_dir
+
+    def read(self, path):
+        with open(os.path.join(self.volume_dir, path), 'rb') as f:
+            return f.read()
+
+    def list(self, path):
+        """
+        Yield (path, size) of the files under the path, both relative to the
+        volume directory.
+        """
+        dirs = [path]
+        while dirs:
+            try:
+                entries = os.scandir(os.path.join(self.volume_dir, dirs.pop()))
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    rel_path = os.path.relpath(entry.path, self.volume_dir)
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(rel_path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield rel_path, entry.stat().st_size
+
+
+class MinioStore:
+    """
+    A backup volume in an S3 bucket, read with a minio client.
+    """
+
+    def __init__(self, minio_api, bucket_name, volume_prefix):
+        self.minio_api = minio_api
+        self.bucket_name = bucket_name
+        self.volume_prefix = volume_prefix.strip("/") + "/"
+
+    def read(self, path):
+        response = self.minio_api.get_object(self.bucket_name,
+                                             self.volume_prefix + path)
+        try:
+            return response.data
+        finally:
+            response.release_conn()
+
+    def list(self, path):
+        objects = self.minio_api.list_objects(self.bucket_name,
+                                              prefix=self.volume_prefix +
+                                              path.strip("/") + "/",
+                                              recursive=True)
+        for obj in objects:
+            yield obj.object_name[len(self.volume_prefix):], obj.size
+
+
+def batched(iterable, size=INSERT_BATCH_SIZE):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class BackupVolumeAnalyzer:
+    """
+    Build the block to backup reference index of one backup volume and
+    report how the stored blocks are shared by its backups.
+
+    volume.cfg, the backup cfg files and the blocks tree are streamed into
+    an on-disk SQLite index, one backup cfg at a time, so only the index
+    pages SQLite caches are held in memory whatever the size of the store.
+    The sizes of the blocks are their stored, compressed, sizes.
+    """
+
+    def __init__(self, store, db_path=None):
+        self.store = store
+        if db_path is None:
+            fd, db_path = tempfile.mkstemp(prefix="backup-index-",
+                                           suffix=".db")
+            os.close(fd)
+            self.temp_db_path = db_path
+        else:
+            self.temp_db_path = None
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript("""
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            DROP TABLE IF EXISTS backups;
+            DROP TABLE IF EXISTS refs;
+            DROP TABLE IF EXISTS blocks;
+            DROP TABLE IF EXISTS block_refs;
+            CREATE TABLE backups (
+                id INTEGER PRIMARY KEY,
+                name TEXT,
+                snapshot_created TEXT,
+                created TEXT,
+                size INTEGER,
+                rank INTEGER
+            );
+            CREATE TABLE refs (backup_id INTEGER, checksum TEXT);
+            CREATE TABLE blocks (checksum TEXT PRIMARY KEY, size INTEGER);
+        """)
+        self.volume = {}
+        self.invalid_backups = []
+
+    def close(self):
+        self.db.close()
+        if self.temp_db_path is not None:
+            os.remove(self.temp_db_path)
+            self.temp_db_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def load_volume(self):
+        try:
+            self.volume = json.loads(self.store.read("volume.cfg"))
+        except (OSError, ValueError) as e:
+            print(f"failed to read volume.cfg: {e}")
+            self.volume = {}
+
+    def load_backups(self):
+        for path, _ in self.store.list("backups"):
+            name = os.path.basename(path)
+            if not (name.startswith(BACKUP_CFG_PREFIX) and
+                    name.endswith(BACKUP_CFG_SUFFIX)):
+                continue
+            try:
+                backup = json.loads(self.store.read(path))
+                blocks = backup.get("Blocks") or []
+                size = int(backup.get("Size") or 0)
+            except (OSError, ValueError, AttributeError) as e:
+                # e.g. a corrupted cfg file or one deleted while listing
+                self.invalid_backups.append({"path": path, "error": str(e)})
+                continue
+
+            backup_name = backup.get("Name") or \
+                name[len(BACKUP_CFG_PREFIX):-len(BACKUP_CFG_SUFFIX)]
+            cursor = self.db.execute(
+                "INSERT INTO backups (name, snapshot_created, created, size) "
+                "VALUES (?, ?, ?, ?)",
+                (backup_name, backup.get("SnapshotCreatedAt", ""),
+                 backup.get("CreatedTime", ""), size))
+            backup_id = cursor.lastrowid
+            self.db.executemany(
+                "INSERT INTO refs VALUES (?, ?)",
+                ((backup_id, block["BlockChecksum"]) for block in blocks))
+            # let the parsed cfg go before the next one is read
+            del backup, blocks
+
+        # backups in the order they were taken, in-progress ones last
+        ranks = self.db.execute(
+            "SELECT id FROM backups ORDER BY created = '', "
+            "snapshot_created, created, name").fetchall()
+        self.db.executemany("UPDATE backups SET rank = ? WHERE id = ?",
+                            ((rank, backup_id)
+                             for rank, (backup_id,) in enumerate(ranks)))
+
+    def load_blocks(self):
+        def block_rows():
+            for path, size in self.store.list("blocks"):
+                name = os.path.basename(path)
+                if name.endswith(BLOCK_FILE_SUFFIX):
+                    yield name[:-len(BLOCK_FILE_SUFFIX)], size
+
+        for batch in batched(block_rows()):
+            self.db.executemany("INSERT OR REPLACE INTO blocks VALUES (?, ?)",
+                                batch)
+
+    def build_index(self):
+        self.load_volume()
+        self.load_backups()
+        self.load_blocks()
+        self.db.executescript("""
+            CREATE INDEX refs_checksum ON refs (checksum);
+            CREATE TABLE block_refs AS
+                SELECT r.checksum AS checksum,
+                       MIN(b.rank) AS first_rank,
+                       COUNT(*) AS refs,
+                       COUNT(DISTINCT r.backup_id) AS backups
+                FROM refs r JOIN backups b ON b.id = r.backup_id
+                GROUP BY r.checksum;
+            CREATE UNIQUE INDEX block_refs_checksum ON block_refs (checksum);
+        """)
+        self.db.commit()
+
+    def backup_reports(self):
+        mappings = dict(self.db.execute(
+            "SELECT backup_id, COUNT(*) FROM refs GROUP BY backup_id"))
+        rows = self.db.execute("""
+            SELECT b.id, b.name, b.created, b.size,
+                   COUNT(u.checksum),
+                   COALESCE(SUM(k.size), 0),
+                   COALESCE(SUM(f.first_rank = b.rank), 0),
+                   COALESCE(SUM(CASE WHEN f.first_rank = b.rank
+                                THEN k.size END), 0),
+                   COUNT(DISTINCT f.first_rank),
+                   COALESCE(SUM(k.checksum IS NULL), 0)
+            FROM backups b
+            LEFT JOIN (SELECT DISTINCT backup_id, checksum FROM refs) u
+                ON u.backup_id = b.id
+            LEFT JOIN block_refs f ON f.checksum = u.checksum
+            LEFT JOIN blocks k ON k.checksum = u.checksum
+            GROUP BY b.id
+            ORDER BY b.rank
+        """)
+        for (backup_id, name, created, size, unique_blocks, stored_bytes,
+             new_blocks, incremental_bytes, source_backups,
+             missing_blocks) in rows:
+            block_count = mappings.get(backup_id, 0)
+            yield {
+                "name": name,
+                "created": created,
+                "in_progress": created == "",
+                "size": size,
+                "blocks": block_count,
+                "unique_blocks": unique_blocks,
+                "new_blocks": new_blocks,
+                "missing_blocks": missing_blocks,
+                "logical_bytes": block_count * BACKUP_BLOCK_SIZE,
+                # what the backup added to the store
+                "incremental_bytes": incremental_bytes,
+                # what a full restore of the backup downloads
+                "restore_read_bytes": stored_bytes,
+                # how many times more a restore reads than the backup
+                # added, and from how many backups its blocks come
+                "restore_read_amplification":
+                    ratio(stored_bytes, incremental_bytes),
+                "restore_source_backups": source_backups,
+            }
+
+    def sample(self, query):
+        return [row[0] for row in
+                self.db.execute(f"{query} LIMIT {SAMPLE_SIZE}")]
+
+    def report(self):
+        """
+        Return the analysis of the backup volume:
+
+        - per backup, its blocks, the blocks it is the first backup to
+          reference and their stored size (its incremental size), and what a
+          full restore of it reads;
+        - the dedup ratio, the block references of every backup together
+          over the distinct blocks they reference, and the compression
+          ratio, the uncompressed size of the referenced blocks in the
+          store over their stored size;
+        - the orphaned blocks no backup references, and the missing blocks
+          referenced but not in the store.
+        """
+        backups = list(self.backup_reports())
+
+        mappings, referenced_blocks, present_blocks, referenced_bytes = \
+            self.db.execute("""
+            SELECT COALESCE(SUM(f.refs), 0), COUNT(*), COUNT(k.checksum),
+                   COALESCE(SUM(k.size), 0)
+            FROM block_refs f LEFT JOIN blocks k ON k.checksum = f.checksum
+        """).fetchone()
+        stored_blocks, stored_bytes = self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blocks").fetchone()
+        orphaned_blocks, orphaned_bytes = self.db.execute("""
+            SELECT COUNT(*), COALESCE(SUM(k.size), 0) FROM blocks k
+            WHERE NOT EXISTS (SELECT 1 FROM block_refs f
+                              WHERE f.checksum = k.checksum)
+        """).fetchone()
+        missing_blocks = self.db.execute("""
+            SELECT COUNT(*) FROM block_refs f
+            WHERE NOT EXISTS (SELECT 1 FROM blocks k
+                              WHERE k.checksum = f.checksum)
+        """).fetchone()[0]
+        logical_bytes = mappings * BACKUP_BLOCK_SIZE
+        unique_bytes = referenced_blocks * BACKUP_BLOCK_SIZE
+
+        return {
+            "volume": {
+                "name": self.volume.get("Name"),
+                "size": int(self.volume.get("Size") or 0),
+                "block_count": int(self.volume.get("BlockCount") or 0),
+                "compression": self.volume.get("CompressionMethod"),
+                "last_backup": self.volume.get("LastBackupName"),
+            },
+            "backups": backups,
+            "invalid_backups": self.invalid_backups,
+            "blocks": {
+                "stored": stored_blocks,
+                "stored_bytes": stored_bytes,
+                "referenced": referenced_blocks,
+                "referenced_bytes": referenced_bytes,
+                "references": mappings,
+                "orphaned": orphaned_blocks,
+                "orphaned_bytes": orphaned_bytes,
+                "orphaned_sample": self.sample("""
+                    SELECT k.checksum FROM blocks k
+                    WHERE NOT EXISTS (SELECT 1 FROM block_refs f
+                                      WHERE f.checksum = k.checksum)
+                    ORDER BY k.checksum"""),
+                "missing": missing_blocks,
+                "missing_sample": self.sample("""
+                    SELECT f.checksum FROM block_refs f
+                    WHERE NOT EXISTS (SELECT 1 FROM blocks k
+                                      WHERE k.checksum = f.checksum)
+                    ORDER BY f.checksum"""),
+            },
+            "logical_bytes": logical_bytes,
+            "unique_bytes": unique_bytes,
+            "dedup_ratio": ratio(mappings, referenced_blocks),
+            "compression_ratio": ratio(present_blocks * BACKUP_BLOCK_SIZE,
+                                       referenced_bytes),
+        }
+
+
+def ratio(numerator, denominator):
+    if not denominator:
+        return None
+    return round(numerator / denominator, 3)
+
+
+def analyze_backup_volume(store, db_path=None):
+    with BackupVolumeAnalyzer(store, db_path=db_path) as analyzer:
+        analyzer.build_index()
+        return analyzer.report()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Report the block dedup, incremental sizes, orphaned "
+                    "blocks and restore reads of a Longhorn backup volume.")
+    parser.add_argument("path", nargs="?",
+                        help="local backup volume directory, or the root of "
+                             "a local backupstore with --volume")
+    parser.add_argument("--volume", help="backup volume name")
+    parser.add_argument("--s3-endpoint",
+                        help="S3 endpoint, e.g. localhost:9000, to read the "
+                             "backup volume of --volume from --bucket")
+    parser.add_argument("--bucket", default="backupbucket")
+    parser.add_argument("--prefix", default="",
+                        help="path of the backupstore in the bucket")
+    parser.add_argument("--access-key",
+                        default=os.environ.get("AWS_ACCESS_KEY_ID"))
+    parser.add_argument("--secret-key",
+                        default=os.environ.get("AWS_SECRET_ACCESS_KEY"))
+    parser.add_argument("--insecure", action="store_true",
+                        help="use http for the S3 endpoint")
+    parser.add_argument("--db", help="keep the index in this SQLite file")
+    args = parser.parse_args(argv)
+    if args.s3_endpoint is None and args.path is None:
+        parser.error("a local path or --s3-endpoint is required")
+    if args.s3_endpoint is not None and args.volume is None:
+        parser.error("--volume is required with --s3-endpoint")
+    return args
+
+
+if __name__ == "__main__":
+    # analyze a backup volume offline:
+    #   python3 backupanalysis.py /mnt/nfs --volume <volume>
+    #   python3 backupanalysis.py --s3-endpoint localhost:9000 \
+    #     --volume <volume> --insecure
+    args = parse_args(sys.argv[1:])
+    if args.s3_endpoint is not None:
+        from minio import Minio
+        store = MinioStore(Minio(args.s3_endpoint,
+                                 access_key=args.access_key,
+                                 secret_key=args.secret_key,
+                                 secure=not args.insecure),
+                           args.bucket,
+                           os.path.join(args.prefix,
+                                        backup_volume_dir(args.volume)))
+    elif args.volume is not None:
+        store = LocalStore(os.path.join(args.path,
+                                        backup_volume_dir(args.volume)))
+    else:
+        store = LocalStore(args.path)
+    json.dump(analyze_backup_volume(store, db_path=args.db), sys.stdout,
+              indent=2)
+    print()
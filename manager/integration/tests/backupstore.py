@@ -1,3 +1,4 @@
+import io
 import os
 import re
 import json
@@ -5,12 +6,18 @@ import time
 import pytest
 import base64
 import hashlib
+import itertools
 import subprocess
+import urllib3
 
 from minio import Minio
 from minio.error import ResponseError
 from urllib.parse import urlparse
 
+from backupanalysis import LocalStore
+from backupanalysis import MinioStore
+from backupanalysis import analyze_backup_volume
+
 from common import SETTING_BACKUP_TARGET
 from common import SETTING_BACKUP_TARGET_CREDENTIAL_SECRET
 from common import SETTING_BACKUPSTORE_POLL_INTERVAL
@@ -46,7 +53,12 @@ SETTING_BACKUP_TARGET_CREDENTIAL_SECRET_NOT_SUPPORTED = \
 SETTING_SETTING_BACKUPSTORE_POLL_INTERVAL_NOT_SUPPORTED = \
     f"setting {SETTING_BACKUPSTORE_POLL_INTERVAL} is not supported"
 
-TEMP_FILE_PATH = "/tmp/temp_file"
+MINIO_CERT_FILE_PATH = "/tmp/minio_cert.crt"
+
+# the MinIO client of each credential secret and the mount point of each NFS
+# backup target, shared by the helpers for the whole test session
+MINIO_API_CLIENTS = {}
+NFS_MOUNT_POINTS = {}
 
 BACKUPSTORE = get_backupstores()
 
@@ -334,6 +346,7 @@ def umount_nfs_backupstore(client, mount_path="/mnt/nfs"):
     subprocess.check_output(cmd)
     cmd = ["rmdir", mount_path]
     subprocess.check_output(cmd)
+    NFS_MOUNT_POINTS.clear()
 
 
 def backup_cleanup():
@@ -406,6 +419,19 @@ def backupstore_cleanup(client):
 
 
 def minio_get_api_client(client, core_api, minio_secret_name):
+    """
+    Return the MinIO client of the secret. It is built once per secret and
+    keeps its connection pool, so the helpers do not read the secret and
+    handshake again on every call.
+    """
+    minio_api = MINIO_API_CLIENTS.get(minio_secret_name)
+    if minio_api is None:
+        minio_api = minio_new_api_client(core_api, minio_secret_name)
+        MINIO_API_CLIENTS[minio_secret_name] = minio_api
+    return minio_api
+
+
+def minio_new_api_client(core_api, minio_secret_name):
     secret = core_api.read_namespaced_secret(name=minio_secret_name,
                                              namespace=LONGHORN_NAMESPACE)
 
@@ -423,18 +449,50 @@ def minio_get_api_client(client, core_api, minio_secret_name):
         base64.b64decode(base64_minio_endpoint_url).decode("utf-8")
     minio_endpoint_url = minio_endpoint_url.replace('https://', '')
 
-    minio_cert_file_path = "/tmp/minio_cert.crt"
-    with open(minio_cert_file_path, 'w') as minio_cert_file:
+    with open(MINIO_CERT_FILE_PATH, 'w') as minio_cert_file:
         base64_minio_cert = \
             base64.b64decode(base64_minio_cert).decode("utf-8")
         minio_cert_file.write(base64_minio_cert)
 
-    os.environ["SSL_CERT_FILE"] = minio_cert_file_path
+    os.environ["SSL_CERT_FILE"] = MINIO_CERT_FILE_PATH
+
+    http_client = urllib3.PoolManager(
+        timeout=urllib3.Timeout.DEFAULT_TIMEOUT,
+        maxsize=10,
+        cert_reqs='CERT_REQUIRED',
+        ca_certs=MINIO_CERT_FILE_PATH,
+        retries=urllib3.Retry(total=5,
+                              backoff_factor=0.2,
+                              status_forcelist=[500, 502, 503, 504]))
 
     return Minio(minio_endpoint_url,
                  access_key=minio_access_key,
                  secret_key=minio_secret_key,
-                 secure=True)
+                 secure=True,
+                 http_client=http_client)
+
+
+def minio_list_objects(minio_api, bucket_name, prefix, limit=None):
+    objects = minio_api.list_objects(bucket_name,
+                                     prefix=prefix,
+                                     recursive=True)
+    return [obj.object_name for obj in itertools.islice(objects, limit)]
+
+
+def minio_delete_objects(minio_api, bucket_name, object_names):
+    # remove_objects only sends the delete requests while its errors are
+    # consumed
+    for err in minio_api.remove_objects(bucket_name, object_names):
+        print(err)
+
+
+def minio_put_object(minio_api, bucket_name, object_name, data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    minio_api.put_object(bucket_name,
+                         object_name,
+                         io.BytesIO(data),
+                         len(data))
 
 
 def minio_get_backupstore_bucket_name(client):
@@ -463,15 +521,36 @@ def get_nfs_mount_point(client):
             raise e
     nfs_url = urlparse(nfs_backuptarget).netloc + \
         urlparse(nfs_backuptarget).path
+    if nfs_url in NFS_MOUNT_POINTS:
+        return NFS_MOUNT_POINTS[nfs_url]
 
     cmd = ["findmnt", "-t", "nfs4", "-n", "--output", "source,target"]
     stdout = subprocess.run(cmd, capture_output=True).stdout
     mount_info = stdout.decode().strip().split(" ")
 
     assert mount_info[0] == nfs_url
+    NFS_MOUNT_POINTS[nfs_url] = mount_info[1]
     return mount_info[1]
 
 
+def nfs_walk_files(directory):
+    """
+    Yield the paths of the regular files under the directory, walked in
+    process instead of with a find subprocess.
+    """
+    dirs = [directory]
+    while dirs:
+        try:
+            with os.scandir(dirs.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry.path
+        except FileNotFoundError:
+            continue
+
+
 def backup_volume_path(volume_name):
     volume_name_sha512 = \
         hashlib.sha512(volume_name.encode('utf-8')).hexdigest()
@@ -631,16 +710,8 @@ def mino_create_file_in_backupstore(client, core_api, file_path, data={}): # NOQ
     if len(data) == 0:
         data = {"testkey": "test data from mino_create_file_in_backupstore()"}
 
-    with open(TEMP_FILE_PATH, 'w') as temp_file:
-        json.dump(data, temp_file)
-
     try:
-        with open(TEMP_FILE_PATH, 'rb') as temp_file:
-            temp_file_stat = os.stat(TEMP_FILE_PATH)
-            minio_api.put_object(bucket_name,
-                                 file_path,
-                                 temp_file,
-                                 temp_file_stat.st_size)
+        minio_put_object(minio_api, bucket_name, file_path, json.dumps(data))
     except ResponseError as err:
         print(err)
 
@@ -686,17 +757,11 @@ def minio_write_backup_cfg_file(client, core_api, volume_name, backup_name, back
     minio_backup_cfg_file_path = minio_get_backup_cfg_file_path(volume_name,
                                                                 backup_name)
 
-    tmp_backup_cfg_file = "/tmp/backup_" + backup_name + ".cfg"
-    with open(tmp_backup_cfg_file, 'w') as tmp_bkp_cfg_file:
-        tmp_bkp_cfg_file.write(str(backup_cfg_data))
-
     try:
-        with open(tmp_backup_cfg_file, 'rb') as tmp_bkp_cfg_file:
-            tmp_bkp_cfg_file_stat = os.stat(tmp_backup_cfg_file)
-            minio_api.put_object(bucket_name,
-                                 minio_backup_cfg_file_path,
-                                 tmp_bkp_cfg_file,
-                                 tmp_bkp_cfg_file_stat.st_size)
+        minio_put_object(minio_api,
+                         bucket_name,
+                         minio_backup_cfg_file_path,
+                         str(backup_cfg_data))
     except ResponseError as err:
         print(err)
 
@@ -867,10 +932,7 @@ def backupstore_delete_random_backup_block(client, core_api, volume_name):
 
 def nfs_delete_random_backup_block(client, volume_name):
     backup_blocks_dir = nfs_get_backup_blocks_dir(client, volume_name)
-    cmd = ["find", backup_blocks_dir, "-type", "f"]
-    find_cmd = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-    head_cmd = subprocess.check_output(["head", "-1"], stdin=find_cmd.stdout)
-    backup_block_file_path = head_cmd.decode().strip()
+    backup_block_file_path = next(nfs_walk_files(backup_blocks_dir), "")
 
     try:
         os.remove(backup_block_file_path)
@@ -889,14 +951,15 @@ def minio_delete_random_backup_block(client, core_api, volume_name):
     bucket_name = minio_get_backupstore_bucket_name(client)
     backup_blocks_dir = minio_get_backup_blocks_dir(volume_name)
 
-    block_object_files = minio_api.list_objects(bucket_name,
-                                                prefix=backup_blocks_dir,
-                                                recursive=True)
-
-    object_file = block_object_files.__next__().object_name
+    object_files = minio_list_objects(minio_api,
+                                      bucket_name,
+                                      backup_blocks_dir,
+                                      limit=1)
+    assert len(object_files) == 1, \
+        f"no backup block of volume {volume_name}"
 
     try:
-        minio_api.remove_object(bucket_name, object_file)
+        minio_delete_objects(minio_api, bucket_name, object_files)
     except ResponseError as err:
         print(err)
 
@@ -916,12 +979,7 @@ def backupstore_count_backup_block_files(client, core_api, volume_name):
 
 def nfs_count_backup_block_files(client, volume_name):
     backup_blocks_dir = nfs_get_backup_blocks_dir(client, volume_name)
-    cmd = ["find", backup_blocks_dir, "-type", "f"]
-    find_cmd = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-    wc_cmd = subprocess.check_output(["wc", "-l"], stdin=find_cmd.stdout)
-    backup_blocks_count = int(wc_cmd.decode().strip())
-
-    return backup_blocks_count
+    return sum(1 for _ in nfs_walk_files(backup_blocks_dir))
 
 
 def minio_count_backup_block_files(client, core_api, volume_name):
@@ -932,13 +990,30 @@ def minio_count_backup_block_files(client, core_api, volume_name):
     bucket_name = minio_get_backupstore_bucket_name(client)
     backup_blocks_dir = minio_get_backup_blocks_dir(volume_name)
 
-    block_object_files = minio_api.list_objects(bucket_name,
-                                                prefix=backup_blocks_dir,
-                                                recursive=True)
+    return len(minio_list_objects(minio_api, bucket_name, backup_blocks_dir))
+
 
-    block_object_files_list = list(block_object_files)
+def backupstore_analyze_backup_volume(client, core_api, volume_name):
+    """
+    Return the block analysis of the backup volume, see
+    backupanalysis.BackupVolumeAnalyzer.report().
+    """
+    backupstore = backupstore_get_backup_target(client)
+
+    if is_backupTarget_s3(backupstore):
+        secret_name = backupstore_get_secret(client)
+        assert secret_name != ''
+        store = MinioStore(minio_get_api_client(client, core_api, secret_name),
+                           minio_get_backupstore_bucket_name(client),
+                           minio_get_backup_volume_prefix(volume_name))
+
+    elif is_backupTarget_nfs(backupstore):
+        store = LocalStore(nfs_get_backup_volume_prefix(client, volume_name))
+
+    else:
+        pytest.skip("Skip test case because the backup store type is not supported") # NOQA
 
-    return len(block_object_files_list)
+    return analyze_backup_volume(store)
 
 
 def backupstore_wait_for_lock_expiration():
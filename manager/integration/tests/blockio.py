@@ -0,0 +1,188 @@
+import concurrent.futures
+import hashlib
+import mmap
+import os
+import string
+import threading
+
+# logical block size every Longhorn frontend supports, the alignment of
+# O_DIRECT offsets and lengths
+BLOCK_SIZE = 4096
+# the unit of parallel hashing and of bulk reads and writes
+EXTENT_SIZE = 4 * 1024 * 1024
+HASH_MAX_WORKERS = 8
+
+RANDOM_DATA_ALPHABET = string.ascii_lowercase + string.digits
+RANDOM_DATA_TABLE = bytes(
+    ord(RANDOM_DATA_ALPHABET[i % len(RANDOM_DATA_ALPHABET)])
+    for i in range(256))
+
+
+def generate_random_bytes(count):
+    """
+    Return count random bytes from [a-z0-9], generated in bulk instead of one
+    character at a time.
+    """
+    return os.urandom(count).translate(RANDOM_DATA_TABLE)
+
+
+def align_down(value, alignment=BLOCK_SIZE):
+    return value - value % alignment
+
+
+def align_up(value, alignment=BLOCK_SIZE):
+    return align_down(value + alignment - 1, alignment)
+
+
+class BlockDevice:
+    """
+    An open block device for positional reads and writes.
+
+    With direct=True the device is opened with O_DIRECT, so reads see what
+    the engine has rather than the page cache of the test pod, and every
+    request goes through page aligned buffers. Unaligned writes are done as
+    read-modify-write of the covering blocks. If the device does not support
+    O_DIRECT it falls back to buffered I/O and fsync after writes.
+
+    The device is opened read-only unless writable=True, so reading needs no
+    write permission and closing the device does not make udev re-probe it.
+
+    The device is kept open until close(), so use it as a context manager
+    around one test step: an open descriptor keeps a detaching volume busy.
+    """
+
+    def __init__(self, dev, direct=True, writable=False):
+        self.dev = dev
+        self.direct = False
+        self.writable = writable
+        self.fd = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        flags = os.O_RDWR if writable else os.O_RDONLY
+        if direct and hasattr(os, "O_DIRECT"):
+            try:
+                self.fd = os.open(dev, flags | os.O_DIRECT)
+                self.direct = True
+            except OSError:
+                self.fd = None
+        if self.fd is None:
+            self.fd = os.open(dev, flags)
+        self.size = os.lseek(self.fd, 0, os.SEEK_END)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _buffer(self, length):
+        # one page aligned buffer per thread, grown on demand
+        buf = getattr(self._local, "buf", None)
+        if buf is None or len(buf) < length:
+            if buf is not None:
+                buf.close()
+            buf = mmap.mmap(-1, align_up(max(length, EXTENT_SIZE),
+                                         mmap.PAGESIZE))
+            self._local.buf = buf
+        return buf
+
+    def _read_aligned(self, start, length):
+        """
+        Read [start, start + length) of the device, both aligned, into the
+        thread's buffer and return a memoryview of the bytes read.
+        """
+        buf = self._buffer(length)
+        view = memoryview(buf)[:length]
+        done = 0
+        while done < length:
+            n = os.preadv(self.fd, [view[done:]], start + done)
+            if n == 0:
+                break
+            done += n
+        return view[:done]
+
+    def _write_aligned(self, start, view):
+        done = 0
+        while done < len(view):
+            done += os.pwritev(self.fd, [view[done:]], start + done)
+
+    def read(self, start, count):
+        count = min(count, max(self.size - start, 0))
+        if not self.direct:
+            return os.pread(self.fd, count, start)
+
+        data = bytearray()
+        pos, end = start, start + count
+        while pos < end:
+            block_start = align_down(pos)
+            block_end = min(align_up(end), block_start + EXTENT_SIZE)
+            view = self._read_aligned(block_start, block_end - block_start)
+            chunk = view[pos - block_start:min(end, block_end) - block_start]
+            if len(chunk) == 0:
+                break
+            data += chunk
+            pos += len(chunk)
+        return bytes(data)
+
+    def write(self, start, data):
+        assert self.writable, f"{self.dev} is opened read-only"
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        data = memoryview(data)
+        if not self.direct:
+            done = 0
+            while done < len(data):
+                done += os.pwrite(self.fd, data[done:], start + done)
+            os.fsync(self.fd)
+            return len(data)
+
+        pos, end = start, start + len(data)
+        with self._lock:
+            while pos < end:
+                block_start = align_down(pos)
+                block_end = min(align_up(end), block_start + EXTENT_SIZE)
+                length = block_end - block_start
+                offset = pos - block_start
+                n = min(end, block_end) - pos
+                if offset == 0 and n == length:
+                    buf = self._buffer(length)
+                    view = memoryview(buf)[:length]
+                else:
+                    # partial blocks keep the data around the write
+                    view = self._read_aligned(block_start, length)
+                view[offset:offset + n] = data[pos - start:pos - start + n]
+                self._write_aligned(block_start, view)
+                pos += n
+        return len(data)
+
+    def _extent_digest(self, start):
+        length = min(EXTENT_SIZE, self.size - start)
+        if self.direct:
+            view = self._read_aligned(start, align_up(length))[:length]
+        else:
+            view = os.pread(self.fd, length, start)
+        return hashlib.blake2b(view).digest()
+
+    def checksum(self, max_workers=HASH_MAX_WORKERS):
+        """
+        Return a hex digest of the whole device.
+
+        The device is hashed in EXTENT_SIZE extents by a pool of threads,
+        hashlib and the reads release the GIL, and the result is the BLAKE2b
+        digest of the ordered extent digests. It is only comparable with
+        other results of this method.
+        """
+        extents = range(0, self.size, EXTENT_SIZE)
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_workers) as executor:
+            digests = executor.map(self._extent_digest, extents)
+            hash = hashlib.blake2b(str(self.size).encode())
+            for digest in digests:
+                hash.update(digest)
+        return hash.hexdigest()
@@ -11,6 +11,7 @@ import hashlib
 import signal
 import types
 import threading
+import concurrent.futures
 import re
 import ipaddress
 
@@ -29,6 +30,8 @@ from kubernetes.client.rest import ApiException
 from datetime import datetime
 from urllib.parse import urlparse
 
+from blockio import BlockDevice, generate_random_bytes
+
 Ki = 1024
 Mi = (1024 * 1024)
 Gi = (1024 * Mi)
@@ -37,7 +40,17 @@ SIZE = str(32 * Mi)
 # See https://github.com/longhorn/longhorn/issues/8488.
 XFS_MIN_SIZE = str(300 * Mi)
 EXPAND_SIZE = str(64 * Mi)
-VOLUME_NAME = "longhorn-testvol"
+# set by run.sh for the workers of a sharded run, each worker creates its
+# volumes, pods, PVs and PVCs under its own names and only cleans up those
+TEST_SHARD = os.environ.get("LONGHORN_TEST_SHARD", "")
+
+
+def shard_name(name):
+    return name + ("-" + TEST_SHARD if TEST_SHARD else "")
+
+
+VOLUME_NAME = shard_name("longhorn-testvol")
+POD_NAME = shard_name("test-pod")
 ATTACHMENT_TICKET_ID_PREFIX = "test-attachment-ticket"
 STATEFULSET_NAME = "longhorn-teststs"
 DEV_PATH = "/dev/longhorn/"
@@ -80,6 +93,8 @@ RETRY_EXEC_INTERVAL = 5
 RETRY_AUTOSCALER_INTERVAL = 30
 RETRY_AUTOSCALER_COUNTS = 10*60//RETRY_AUTOSCALER_INTERVAL  # 10 minutes
 
+TEARDOWN_MAX_WORKERS = 8
+
 LONGHORN_NAMESPACE = "longhorn-system"
 
 COMPATIBILTY_TEST_IMAGE_PREFIX = "longhornio/longhorn-test:version-test"
@@ -438,25 +453,37 @@ def cleanup_all_volumes(client):
     :param client: The Longhorn client to use in the request.
     """
 
-    volumes = client.list_volume()
+    # issue every deletion first and wait for all of them at once, the
+    # volumes are torn down by the manager concurrently
+    volumes = list_shard_volumes(client)
     for v in volumes:
         # ignore the error when clean up
         try:
             client.delete(v)
-            wait_for_volume_delete(client, v.name)
         except Exception as e:
             print("\nException when cleanup volume ", v)
             print(e)
     for i in range(RETRY_COUNTS):
-        volumes = client.list_volume()
+        volumes = list_shard_volumes(client)
         if len(volumes) == 0:
             break
         time.sleep(RETRY_INTERVAL)
 
-    volumes = client.list_volume()
+    volumes = list_shard_volumes(client)
     assert len(volumes) == 0
 
 
+def list_shard_volumes(client):
+    """
+    List the volumes owned by this test process. That is every volume,
+    unless this is a worker of a sharded run sharing the cluster.
+    """
+    volumes = client.list_volume()
+    if not TEST_SHARD:
+        return volumes
+    return [v for v in volumes if v.name.startswith(VOLUME_NAME + "-")]
+
+
 def create_volume_and_backup(client, vol_name, vol_size, backup_data_size):
     client.create_volume(name=vol_name,
                          numberOfReplicas=1,
@@ -816,11 +843,12 @@ def read_volume_data(api, pod_name, filename='test'):
         'cat /data/' + filename
     ]
     with timeout(seconds=STREAM_EXEC_TIMEOUT,
-                 error_message='Timeout on executing stream read'):
+                 error_message='Timeout on executing stream read') as t:
         return stream(
             api.connect_get_namespaced_pod_exec, pod_name, 'default',
             command=read_command, stderr=True, stdin=False, stdout=True,
-            tty=False)
+            tty=False,
+            _request_timeout=t.remaining())
 
 
 def write_pod_volume_data(api, pod_name, test_data, filename='test'):
@@ -838,11 +866,12 @@ def write_pod_volume_data(api, pod_name, test_data, filename='test'):
         'echo -ne ' + test_data + ' > /data/' + filename
     ]
     with timeout(seconds=STREAM_EXEC_TIMEOUT,
-                 error_message='Timeout on executing stream write'):
+                 error_message='Timeout on executing stream write') as t:
         return stream(
             api.connect_get_namespaced_pod_exec, pod_name, 'default',
             command=write_command, stderr=True, stdin=False, stdout=True,
-            tty=False)
+            tty=False,
+            _request_timeout=t.remaining())
 
 
 def write_pod_block_volume_data(api, pod_name, test_data, offset, device_path):
@@ -859,14 +888,16 @@ def write_pod_block_volume_data(api, pod_name, test_data, offset, device_path):
         ' bs=' + str(len(test_data)) + ' count=1 seek=' + str(offset)
     ]
     with timeout(seconds=STREAM_EXEC_TIMEOUT,
-                 error_message='Timeout on executing stream write'):
+                 error_message='Timeout on executing stream write') as t:
         stream(api.connect_get_namespaced_pod_exec, pod_name, 'default',
                command=pre_write_cmd, stderr=True, stdin=False, stdout=True,
-               tty=False)
+               tty=False,
+               _request_timeout=t.remaining())
         return stream(
             api.connect_get_namespaced_pod_exec, pod_name, 'default',
             command=write_cmd, stderr=True, stdin=False, stdout=True,
-            tty=False)
+            tty=False,
+            _request_timeout=t.remaining())
 
 
 def read_pod_block_volume_data(api, pod_name, data_size, offset, device_path):
@@ -877,11 +908,12 @@ def read_pod_block_volume_data(api, pod_name, data_size, offset, device_path):
         ' status=none bs=' + str(data_size) + ' count=1 skip=' + str(offset)
     ]
     with timeout(seconds=STREAM_EXEC_TIMEOUT,
-                 error_message='Timeout on executing stream read'):
+                 error_message='Timeout on executing stream read') as t:
         return stream(
             api.connect_get_namespaced_pod_exec, pod_name, 'default',
             command=read_command, stderr=True, stdin=False, stdout=True,
-            tty=False)
+            tty=False,
+            _request_timeout=t.remaining())
 
 
 def exec_command_in_pod(api, command, pod_name, namespace, container=None):
@@ -901,11 +933,12 @@ def exec_command_in_pod(api, command, pod_name, namespace, container=None):
         command
     ]
     with timeout(seconds=STREAM_EXEC_TIMEOUT,
-                 error_message='Timeout on executing stream read/write'):
+                 error_message='Timeout on executing stream read/write') as t:
         return stream(
             api.connect_get_namespaced_pod_exec, pod_name, namespace,
             command=exec_command, stderr=True, stdin=False, stdout=True,
-            container=container, tty=False)
+            container=container, tty=False,
+            _request_timeout=t.remaining())
 
 
 def get_pod_data_md5sum(api, pod_name, path):
@@ -913,11 +946,12 @@ def get_pod_data_md5sum(api, pod_name, path):
         '/bin/sh', '-c', 'md5sum ' + path + " | awk '{print $1}'"
     ]
     with timeout(seconds=STREAM_EXEC_TIMEOUT * 3,
-                 error_message='Timeout on executing stream md5sum'):
+                 error_message='Timeout on executing stream md5sum') as t:
         return stream(
             api.connect_get_namespaced_pod_exec, pod_name, 'default',
             command=md5sum_command, stderr=True, stdin=False, stdout=True,
-            tty=False)
+            tty=False,
+            _request_timeout=t.remaining())
 
 
 def write_pod_volume_random_data(api, pod_name, path, size_in_mb):
@@ -956,8 +990,8 @@ def copy_file_to_volume_dev_mb_data(src_path, dest_path,
         (src_path, dest_path, size_in_mb, src_offset, dest_offset)
     ]
     with timeout(seconds=STREAM_EXEC_TIMEOUT * timeout_cnt,
-                 error_message='Timeout on copying file to dev'):
-        subprocess.check_call(cmd)
+                 error_message='Timeout on copying file to dev') as t:
+        subprocess.check_call(cmd, timeout=t.remaining())
 
 
 def write_volume_dev_random_mb_data(path, offset_in_mb, length_in_mb,
@@ -969,8 +1003,8 @@ def write_volume_dev_random_mb_data(path, offset_in_mb, length_in_mb,
         (path, offset_in_mb, length_in_mb)
     ]
     with timeout(seconds=STREAM_EXEC_TIMEOUT * timeout_cnt,
-                 error_message='Timeout on writing dev'):
-        subprocess.check_call(write_cmd)
+                 error_message='Timeout on writing dev') as t:
+        subprocess.check_call(write_cmd, timeout=t.remaining())
 
 
 def get_volume_dev_mb_data_md5sum(path, offset_in_mb, length_in_mb):
@@ -981,9 +1015,9 @@ def get_volume_dev_mb_data_md5sum(path, offset_in_mb, length_in_mb):
     ]
 
     with timeout(seconds=STREAM_EXEC_TIMEOUT * 5,
-                 error_message='Timeout on computing dev md5sum'):
+                 error_message='Timeout on computing dev md5sum') as t:
         output = subprocess.check_output(
-            md5sum_command).strip().decode('utf-8')
+            md5sum_command, timeout=t.remaining()).strip().decode('utf-8')
         return output.split(" ")[1]
 
 
@@ -1140,7 +1174,7 @@ def set_node_cordon(api, node_name, to_cordon):
 
 @pytest.fixture
 def pod_make(request):
-    def make_pod(name='test-pod'):
+    def make_pod(name=POD_NAME):
         pod_manifest = {
             'apiVersion': 'v1',
             'kind': 'Pod',
@@ -1209,7 +1243,7 @@ def pod(request):
         'apiVersion': 'v1',
         'kind': 'Pod',
         'metadata': {
-            'name': 'test-pod'
+            'name': POD_NAME
         },
         'spec': {
             'containers': [{
@@ -1812,37 +1846,138 @@ def clients(request):
     return clis
 
 
+def run_teardown_steps(steps, max_workers=TEARDOWN_MAX_WORKERS):
+    """
+    Run teardown steps concurrently in dependency order.
+
+    steps maps a step name to (func, dependencies). A step starts as soon as
+    every step it depends on has finished, so independent resources are
+    cleaned up in parallel. When a step fails, the steps depending on it are
+    skipped, the others still run, and the first error is raised at the end.
+    """
+    for name, (_, deps) in steps.items():
+        for dep in deps:
+            assert dep in steps, f"teardown step {name} depends on " \
+                                 f"unknown step {dep}"
+
+    done = set()
+    failed = {}
+    running = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        while len(done) + len(failed) < len(steps):
+            skipped = False
+            for name, (func, deps) in steps.items():
+                if name in done or name in failed or name in running.values():
+                    continue
+                if any(dep in failed for dep in deps):
+                    failed[name] = None
+                    skipped = True
+                    print(f"\nSkip teardown step {name}, a dependency failed")
+                elif all(dep in done for dep in deps):
+                    running[executor.submit(func)] = name
+
+            if not running:
+                assert skipped, "teardown steps have a dependency cycle"
+                continue
+            finished, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                    done.add(name)
+                except Exception as e:
+                    print(f"\nException in teardown step {name}")
+                    print(e)
+                    failed[name] = e
+
+    for e in failed.values():
+        if e is not None:
+            raise e
+
+
+def is_shard_object_name(name):
+    return name == POD_NAME or name.startswith(VOLUME_NAME + "-")
+
+
+def cleanup_shard_kubernetes_objects(core_api):
+    """
+    Clean up the pods, PVCs and PVs left by the tests of this shard worker,
+    found by the names generate_volume_name() and the pod fixtures give.
+    """
+    for pod in core_api.list_namespaced_pod(namespace='default').items:
+        if is_shard_object_name(pod.metadata.name):
+            delete_and_wait_pod(core_api, pod.metadata.name)
+
+    pvcs = core_api.list_namespaced_persistent_volume_claim(
+        namespace='default').items
+    for pvc in pvcs:
+        if is_shard_object_name(pvc.metadata.name):
+            delete_and_wait_pvc(core_api, pvc.metadata.name)
+
+    for pv in core_api.list_persistent_volume().items:
+        claim_ref = pv.spec.claim_ref
+        if is_shard_object_name(pv.metadata.name) or \
+                (claim_ref is not None and
+                 is_shard_object_name(claim_ref.name)):
+            delete_and_wait_pv(core_api, pv.metadata.name)
+
+
 def cleanup_client():
     core_api = k8sclient.CoreV1Api()
     client = get_longhorn_api_client()
 
-    enable_default_disk(client)
-
-    cleanup_all_volumes(client)
-
-    # cleanup test disks
-    cleanup_test_disks(client)
+    if TEST_SHARD:
+        # Other workers are running against the same cluster. The tests of a
+        # shard never touch cluster-global state, see shard.py, so only the
+        # pods, PVCs, PVs and volumes of this worker are cleaned up.
+        cleanup_shard_kubernetes_objects(core_api)
+        cleanup_all_volumes(client)
+        return
 
+    # resource dependencies of the teardown, anything not ordered here is
+    # cleaned up concurrently:
+    # - replicas and engines must be gone before the disks, backing images,
+    #   crypto secret and engine images they use can be removed
+    # - settings are only applied once no volume is attached, and before
+    #   the nodes and disks whose schedulability depends on them are reset
+    # - updates of the node objects are kept serial to avoid conflicts
+    # - instance managers are restarted by the disk and setting resets
+    steps = {
+        "default_disk": (lambda: enable_default_disk(client), []),
+        "volumes": (lambda: cleanup_all_volumes(client), []),
+        # cleanup test disks
+        "test_disks": (lambda: cleanup_test_disks(client),
+                       ["default_disk", "volumes"]),
+        "crypto_secret": (cleanup_crypto_secret, ["volumes"]),
+        "storage_class": (cleanup_storage_class, []),
+        "support_bundles": (lambda: cleanup_all_support_bundles(client), []),
+        "settings": (lambda: reset_settings(client), ["volumes"]),
+        # enable nodes scheduling
+        "node": (lambda: reset_node(client, core_api),
+                 ["test_disks", "settings"]),
+        "disks": (lambda: reset_disks_for_all_nodes(client),
+                  ["node", "settings"]),
+        "engine_image_daemonset": (
+            lambda: scale_up_engine_image_daemonset(client), ["node"]),
+        "engine_image": (lambda: reset_engine_image(client),
+                         ["volumes", "engine_image_daemonset"]),
+    }
     if recurring_job_feature_supported(client):
-        cleanup_all_recurring_jobs(client)
-
+        steps["recurring_jobs"] = (
+            lambda: cleanup_all_recurring_jobs(client), [])
     if backing_image_feature_supported(client):
-        cleanup_all_backing_images(client)
-
-    cleanup_crypto_secret()
-    cleanup_storage_class()
+        steps["backing_images"] = (
+            lambda: cleanup_all_backing_images(client), ["volumes"])
+        steps["settings"][1].append("backing_images")
     if system_backup_feature_supported(client):
-        system_restores_cleanup(client)
+        steps["system_restores"] = (
+            lambda: system_restores_cleanup(client), [])
+    steps["instance_managers"] = (
+        lambda: wait_for_all_instance_manager_running(client),
+        ["settings", "disks", "engine_image"])
 
-    cleanup_all_support_bundles(client)
-
-    # enable nodes scheduling
-    reset_node(client, core_api)
-    reset_settings(client)
-    reset_disks_for_all_nodes(client)
-    scale_up_engine_image_daemonset(client)
-    reset_engine_image(client)
-    wait_for_all_instance_manager_running(client)
+    run_teardown_steps(steps)
 
     enable_v2 = os.environ.get('RUN_V2_TEST')
     if enable_v2 == "true":
@@ -2516,11 +2651,12 @@ def exec_instance_manager(api, im_name, cmd):
     exec_cmd = ['/bin/sh', '-c', cmd]
 
     with timeout(seconds=STREAM_EXEC_TIMEOUT,
-                 error_message='Timeout on executing stream read'):
+                 error_message='Timeout on executing stream read') as t:
         output = stream(api.connect_get_namespaced_pod_exec,
                         im_name,
                         LONGHORN_NAMESPACE, command=exec_cmd,
-                        stderr=True, stdin=False, stdout=True, tty=False)
+                        stderr=True, stdin=False, stdout=True, tty=False,
+                        _request_timeout=t.remaining())
         return output
 
 
@@ -2713,8 +2849,7 @@ def get_compatibility_test_image(cli_v, cli_minv,
 
 
 def generate_random_data(count):
-    return ''.join(random.choice(string.ascii_lowercase + string.digits)
-                   for _ in range(count))
+    return generate_random_bytes(count).decode('ascii')
 
 
 def check_volume_data(volume, data, check_checksum=True):
@@ -2728,18 +2863,20 @@ def write_volume_random_data(volume, position={}):
 
 
 def check_device_data(dev, data, check_checksum=True):
-    r_data = dev_read(dev, data['pos'], data['len'])
-    assert r_data == bytes(data['content'], encoding='utf8')
-    if check_checksum:
-        r_checksum = get_device_checksum(dev)
-        assert r_checksum == data['checksum']
+    with BlockDevice(dev) as device:
+        r_data = device.read(data['pos'], data['len'])
+        assert r_data == bytes(data['content'], encoding='utf8')
+        if check_checksum:
+            r_checksum = device.checksum()
+            assert r_checksum == data['checksum']
 
 
 def write_device_random_data(dev, position={}):
     data = generate_random_data(VOLUME_RWTEST_SIZE)
     data_pos = generate_random_pos(VOLUME_RWTEST_SIZE, position)
-    data_len = dev_write(dev, data_pos, data)
-    checksum = get_device_checksum(dev)
+    with BlockDevice(dev, writable=True) as device:
+        data_len = device.write(data_pos, data)
+        checksum = device.checksum()
 
     return {
         'content': data,
@@ -2751,8 +2888,9 @@ def write_device_random_data(dev, position={}):
 
 def write_volume_data(volume, data):
     dev = get_volume_endpoint(volume)
-    data_len = dev_write(dev, data['pos'], data['content'])
-    checksum = get_device_checksum(dev)
+    with BlockDevice(dev, writable=True) as device:
+        data_len = device.write(data['pos'], data['content'])
+        checksum = device.checksum()
 
     return {
         'content': data['content'],
@@ -2763,14 +2901,8 @@ def write_volume_data(volume, data):
 
 
 def get_device_checksum(dev):
-    hash = hashlib.sha512()
-
-    with open(dev, 'rb') as fdev:
-        if fdev is not None:
-            for chunk in iter(lambda: fdev.read(4096), b""):
-                hash.update(chunk)
-
-    return hash.hexdigest()
+    with BlockDevice(dev) as device:
+        return device.checksum()
 
 
 def volume_read(v, start, count):
@@ -2779,13 +2911,8 @@ def volume_read(v, start, count):
 
 
 def dev_read(dev, start, count):
-    r_data = ""
-    fdev = open(dev, 'rb')
-    if fdev is not None:
-        fdev.seek(start)
-        r_data = fdev.read(count)
-        fdev.close()
-    return r_data
+    with BlockDevice(dev) as device:
+        return device.read(start, count)
 
 
 def volume_write(v, start, data):
@@ -2794,15 +2921,8 @@ def volume_write(v, start, data):
 
 
 def dev_write(dev, start, data):
-    data = bytes(data, encoding='utf-8')
-    w_length = 0
-    fdev = open(dev, 'rb+')
-    if fdev is not None:
-        fdev.seek(start)
-        fdev.write(data)
-        fdev.close()
-        w_length = len(data)
-    return w_length
+    with BlockDevice(dev, writable=True) as device:
+        return device.write(start, data)
 
 
 def volume_valid(dev):
@@ -3836,7 +3956,10 @@ def reset_disks_for_all_nodes(client, add_block_disks=False):  # NOQA
 
 
 def reset_settings(client):
-
+    # The listed settings already carry their current value and definition,
+    # so the diff against the defaults is computed from a single list call
+    # and only the settings that changed are updated.
+    updates = []
     for setting in client.list_setting():
         setting_name = setting.name
         setting_default_value = setting.definition.default
@@ -3875,25 +3998,33 @@ def reset_settings(client):
 
         if setting_name == "v2-data-engine":
             if v2_data_engine_cr_supported(client):
-                setting = client.by_id_setting(SETTING_V2_DATA_ENGINE)
-                try:
-                    client.update(setting, value="true")
-                except Exception as e:
-                    print(f"\nException setting {setting_name} to true")
-                    print(e)
+                if setting.value != "true":
+                    updates.append((setting, "true"))
                 continue
 
-        s = client.by_id_setting(setting_name)
-        if s.value != setting_default_value and not setting_readonly:
-            try:
-                client.update(s, value=setting_default_value)
-            except Exception as e:
-                print("\nException when resetting ",
-                      setting_name,
-                      " to value: ",
-                      setting_default_value)
-                print(s)
-                print(e)
+        if setting.value != setting_default_value and not setting_readonly:
+            updates.append((setting, setting_default_value))
+
+    update_settings(client, updates)
+
+
+def update_settings(client, updates):
+    """
+    Apply a batch of (setting, value) updates one at a time: some settings
+    restart instance managers or components, and some are validated
+    against each other and the cluster state. Errors are printed and
+    ignored the same way reset_settings always did.
+    """
+    for setting, value in updates:
+        try:
+            client.update(setting, value=value)
+        except Exception as e:
+            print("\nException when resetting ",
+                  setting.name,
+                  " to value: ",
+                  value)
+            print(setting)
+            print(e)
 
 
 def reset_engine_image(client):
@@ -4083,11 +4214,28 @@ class timeout:
         raise Exception(self.error_message)
 
     def __enter__(self):
-        signal.signal(signal.SIGALRM, self.handle_timeout)
-        signal.alarm(self.seconds)
+        self.deadline = time.monotonic() + self.seconds
+        # SIGALRM is only delivered to the main thread. In worker threads
+        # the guarded calls are bounded by remaining() instead, and the
+        # block fails on exit once the deadline has passed.
+        self.alarm = threading.current_thread() is threading.main_thread()
+        if self.alarm:
+            signal.signal(signal.SIGALRM, self.handle_timeout)
+            signal.alarm(self.seconds)
+        return self
+
+    def remaining(self):
+        """
+        Seconds left before the deadline, to pass as the timeout of a
+        blocking call in the block.
+        """
+        return max(self.deadline - time.monotonic(), 0.001)
 
     def __exit__(self, type, value, traceback):
-        signal.alarm(0)
+        if self.alarm:
+            signal.alarm(0)
+        elif type is None and time.monotonic() > self.deadline:
+            raise Exception(self.error_message)
 
 
 def is_backupTarget_s3(s):
@@ -5460,11 +5608,12 @@ def crash_engine_process_with_sigkill(client, core_api, volume_name):
             "kill `pgrep -f \"controller " + volume_name + "\"`"]
 
     with timeout(seconds=STREAM_EXEC_TIMEOUT,
-                 error_message='Timeout on executing stream read'):
+                 error_message='Timeout on executing stream read') as t:
         stream(core_api.connect_get_namespaced_pod_exec,
                ins_mgr_name,
                LONGHORN_NAMESPACE, command=kill_command,
-               stderr=True, stdin=False, stdout=True, tty=False)
+               stderr=True, stdin=False, stdout=True, tty=False,
+               _request_timeout=t.remaining())
 
 
 def remount_volume_read_only(client, core_api, volume_name):
@@ -5481,10 +5630,11 @@ def remount_volume_read_only(client, core_api, volume_name):
     ]
 
     with timeout(seconds=STREAM_EXEC_TIMEOUT,
-                 error_message='Timeout on executing stream read'):
+                 error_message='Timeout on executing stream read') as t:
         stream(core_api.connect_get_namespaced_pod_exec,
                instance_manager_name, LONGHORN_NAMESPACE, command=command,
-               stderr=True, stdin=False, stdout=True, tty=False)
+               stderr=True, stdin=False, stdout=True, tty=False,
+               _request_timeout=t.remaining())
 
 
 def wait_for_pod_restart(core_api, pod_name, namespace="default"):
@@ -8,6 +8,8 @@ from common import get_longhorn_api_client, \
 from common import wait_for_node_mountpropagation_condition
 from common import check_longhorn, check_csi_expansion
 from common import generate_support_bundle
+from shard import SHARD_OPT, parse_shard, select_shard_items
+from tracing import ApiTracePlugin
 
 SKIP_BACKING_IMAGE_OPT = "--skip-backing-image-test"
 SKIP_RECURRING_JOB_OPT = "--skip-recurring-job-test"
@@ -41,6 +43,18 @@ def pytest_addoption(parser):
                      default=False,
                      help="include cluster autoscaler tests (default: False)")
 
+    parser.addoption(SHARD_OPT, action="store", default=None,
+                     help="only run the tests of shard <index>/<count>, "
+                          "or the tests touching cluster-global state with "
+                          "'exclusive' (default: run all tests)")
+
+
+def pytest_configure(config):
+    # trace the API calls next to the junit report
+    if config.option.xmlpath:
+        config.pluginmanager.register(
+            ApiTracePlugin(config.option.xmlpath), "longhorn-api-trace")
+
 
 def pytest_collection_modifyitems(config, items):
     c = Configuration()
@@ -133,6 +147,12 @@ def pytest_collection_modifyitems(config, items):
             if "cluster_autoscaler" in item.keywords:
                 item.add_marker(skip_upgrade)
 
+    if config.getoption(SHARD_OPT):
+        shard = parse_shard(config.getoption(SHARD_OPT))
+        selected, deselected = select_shard_items(items, shard)
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = selected
+
 
 def pytest_exception_interact(call, report):
 
@@ -4,7 +4,7 @@ from __future__ import print_function
 import six
 import re
 import requests
-import collections
+import functools
 import hashlib
 import os
 import json
@@ -62,6 +62,20 @@ def echo(fn):
     return wrapped
 
 
+# callables invoked with the requests.Response of every API call of every
+# client, e.g. to trace the calls
+RESPONSE_HOOKS = []
+
+
+def add_response_hook(hook):
+    RESPONSE_HOOKS.append(hook)
+
+
+def _run_response_hooks(r, *args, **kw):
+    for hook in RESPONSE_HOOKS:
+        hook(r)
+
+
 def timed_url(fn):
     def wrapped(*args, **kw):
         if TIME:
@@ -76,6 +90,10 @@ def timed_url(fn):
 
 
 class RestObject:
+    # set on the per-client subclass that decoded the object, see
+    # GdapiClient._object_class
+    _client = None
+
     def __init__(self):
         pass
 
@@ -131,8 +149,63 @@ class RestObject:
     def __getattr__(self, k):
         if self._is_list() and k in LIST_METHODS:
             return getattr(self.data, k)
+        method = self._client_method(k)
+        if method is not None:
+            return method
         return getattr(self.__dict__, k)
 
+    def _has_field(self, k):
+        return k in self.__dict__ or hasattr(dict, k) or \
+            hasattr(type(self), k) or self._pagination_url(k) is not None
+
+    def _pagination_url(self, k):
+        pagination = self.__dict__.get('pagination')
+        if k not in ('next', 'prev') or not isinstance(pagination, RestObject):
+            return None
+        return pagination.__dict__.get(k)
+
+    def _client_method(self, k):
+        # Links and actions are resolved when they are accessed instead of
+        # binding a closure for each of them to every decoded object. The
+        # names are the same as before: a link or action whose name is
+        # already taken by a field gets the '_link' or '_action' suffix.
+        client = self._client
+        if client is None or k.startswith('__'):
+            return None
+
+        url = self._pagination_url(k)
+        if url is not None:
+            return lambda: client._get(url)
+
+        if not isinstance(self.__dict__.get('type'), six.string_types):
+            return None
+
+        links = self.__dict__.get('links')
+        links = links.__dict__ if isinstance(links, RestObject) else {}
+        if k.endswith('_link') and k[:-5] in links and self._has_field(k[:-5]):
+            name = k[:-5]
+        elif k in links and not self._has_field(k):
+            name = k
+        else:
+            name = None
+        if name is not None:
+            link = links[name]
+            return lambda **kw: client._get(link, data=kw)
+
+        actions = self.__dict__.get('actions')
+        actions = actions.__dict__ if isinstance(actions, RestObject) else {}
+
+        def action_name_taken(name):
+            return self._has_field(name) or name in links or \
+                (name.endswith('_link') and name[:-5] in links)
+
+        if k.endswith('_action') and k[:-7] in actions and \
+                action_name_taken(k[:-7]):
+            return functools.partial(client.action, self, k[:-7])
+        if k in actions and not action_name_taken(k):
+            return functools.partial(client.action, self, k)
+        return None
+
     def __iter__(self):
         if self._is_list():
             return iter(self.data)
@@ -216,7 +289,12 @@ class GdapiClient(object):
         self._cache_time = cache_time
         self._strict = strict
         self.schema = None
+        # decoded objects resolve their links and actions through this
+        # client without holding a reference to it in their fields
+        self._object_class = type('RestObject', (RestObject,),
+                                  {'_client': self})
         self._session = requests.Session()
+        self._session.hooks['response'].append(_run_response_hooks)
 
         if not self._cache_time:
             self._cache_time = 60 * 60 * 24  # 24 Hours
@@ -231,50 +309,25 @@ class GdapiClient(object):
             return [self.object_hook(x) for x in obj]
 
         if isinstance(obj, dict):
-            result = RestObject()
+            result = self._object_class()
 
             for k, v in six.iteritems(obj):
                 setattr(result, k, self.object_hook(v))
 
-            for link in ['next', 'prev']:
-                try:
-                    url = getattr(result.pagination, link)
-                    if url is not None:
-                        setattr(result, link, lambda url=url: self._get(url))
-                except AttributeError:
-                    pass
-
-            if hasattr(result, 'type') and isinstance(getattr(result, 'type'),
-                                                      six.string_types):
-                if hasattr(result, 'links'):
-                    for link_name, link in six.iteritems(result.links):
-                        def cb(_link=link, **kw):
-                            return self._get(_link, data=kw)
-                        if hasattr(result, link_name):
-                            setattr(result, link_name + '_link', cb)
-                        else:
-                            setattr(result, link_name, cb)
-
-                if hasattr(result, 'actions'):
-                    for link_name, link in six.iteritems(result.actions):
-                        def cb(_link_name=link_name,
-                               _result=result, *args, **kw):
-                            return self.action(_result, _link_name,
-                                               *args, **kw)
-                        if hasattr(result, link_name):
-                            setattr(result, link_name + '_action', cb)
-                        else:
-                            setattr(result, link_name, cb)
-
             return result
 
         return obj
 
     def object_pairs_hook(self, pairs):
-        ret = collections.OrderedDict()
+        # json decodes the innermost objects first, so the values here are
+        # already converted and only this level has to be built
+        result = self._object_class()
+        fields = result.__dict__
         for k, v in pairs:
-            ret[k] = v
-        return self.object_hook(ret)
+            if isinstance(v, (list, str)):
+                v = self.object_hook(v)
+            fields[k] = v
+        return result
 
     def _get(self, url, data=None):
         return self._unmarshall(self._get_raw(url, data=data))
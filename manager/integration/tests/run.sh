@@ -1,4 +1,60 @@
 #!/bin/bash
 
 export PYTHONUNBUFFERED=1
-pytest -v "$@"
+
+if [[ -z "${PYTEST_SHARDS}" || "${PYTEST_SHARDS}" -le 1 ]]; then
+  pytest -v "$@"
+  exit $?
+fi
+
+# Sharded run: the tests that do not touch cluster-global state (see
+# shard.py) are spread over PYTEST_SHARDS parallel pytest workers, each with
+# its own volume name prefix. The remaining tests then run in a single
+# exclusive lane that owns the whole cluster. The junit reports of all the
+# lanes are merged into the one requested with --junitxml.
+junit=""
+args=()
+for arg in "$@"; do
+  case "${arg}" in
+    --junitxml=*|--junit-xml=*)
+      junit="${arg#*=}"
+      junit="${junit//\'/}"
+      ;;
+    *)
+      args+=("${arg}")
+      ;;
+  esac
+done
+
+report_dir=$(mktemp -d /tmp/longhorn-test-shards.XXXXXX)
+pids=()
+for ((i = 0; i < PYTEST_SHARDS; i++)); do
+  LONGHORN_TEST_SHARD="shard${i}" pytest -v --shard="${i}/${PYTEST_SHARDS}" \
+    --junitxml="${report_dir}/shard-${i}.xml" "${args[@]}" \
+    > "${report_dir}/shard-${i}.log" 2>&1 &
+  pids+=($!)
+done
+
+rc=0
+for ((i = 0; i < PYTEST_SHARDS; i++)); do
+  wait "${pids[i]}"
+  shard_rc=$?
+  echo "shard ${i} exited with ${shard_rc}, log: ${report_dir}/shard-${i}.log"
+  # 5 means every test of the shard was deselected
+  if [[ ${shard_rc} -ne 0 && ${shard_rc} -ne 5 ]]; then
+    rc=${shard_rc}
+  fi
+done
+
+pytest -v --shard=exclusive --junitxml="${report_dir}/exclusive.xml" \
+  "${args[@]}"
+exclusive_rc=$?
+if [[ ${exclusive_rc} -ne 0 && ${exclusive_rc} -ne 5 ]]; then
+  rc=${exclusive_rc}
+fi
+
+if [[ -n "${junit}" ]]; then
+  python3 shard.py "${junit}" "${report_dir}"/*.xml
+  cp "${report_dir}"/*.api-* "$(dirname "${junit}")"
+fi
+exit ${rc}
@@ -0,0 +1,163 @@
+import inspect
+import re
+import sys
+import zlib
+import xml.etree.ElementTree as ET
+
+SHARD_OPT = "--shard"
+SHARD_EXCLUSIVE = "exclusive"
+
+# markers that force a test into, or keep it out of, the exclusive lane
+CLUSTER_EXCLUSIVE_MARKER = "cluster_exclusive"
+SHARDABLE_MARKER = "shardable"
+
+# markers of tests that always touch cluster-global state
+GLOBAL_STATE_MARKERS = [
+    "infra", "node", "mountdisk", "stress", "upgrade", "cluster_autoscaler",
+    "system_backup_restore", "support_bundle", "orphan", "backing_image",
+    "recurring_job",
+]
+
+# fixtures that change cluster-global state or span every node
+GLOBAL_STATE_FIXTURES = [
+    "clients", "settings_reset", "set_random_backupstore", "backupstore_s3",
+    "backupstore_nfs", "reset_disk_settings", "make_deployment_with_pvc",
+    "node_default_tags", "random_labels", "storage_class", "sts_name",
+    # fixed object names every shard would share
+    "statefulset",
+]
+
+# references in the test code that touch cluster-global state, keyed by the
+# kind of state
+GLOBAL_STATE_PATTERNS = {
+    "settings": r"\bsettings?\b|by_id_setting|update_setting|SETTING_",
+    "node scheduling": r"set_node_scheduling|set_node_cordon|set_node_tags|"
+                       r"taint|allowScheduling|cordon|drain|"
+                       r"evictionRequested",
+    "disks": r"update_node_disks|diskUpdate|reset_disks_for_all_nodes|"
+             r"create_host_disk|cleanup_host_disk|DEFAULT_DISK_PATH",
+    "engine images": r"engine_image|engineImage|upgrade",
+    "backing images": r"backing_image|backingImage",
+    "storage classes": r"storage_class|storageclass|StorageClass",
+    "recurring jobs": r"recurring_job|recurringJob",
+    # objects named by a literal rather than by generate_volume_name(), so
+    # the same name in every shard
+    "fixed object names": r"['\"]name['\"]\s*:\s*['\"]|"
+                          r"\[['\"]name['\"]\]\s*=\s*['\"]|"
+                          r"\b\w*name\s*=\s*['\"]",
+    "backup target": r"backupstore|backup_target|backupTarget",
+    "cluster resources": r"list_volume\(\)|cleanup_all_volumes|"
+                         r"instance_manager|longhorn-manager|reboot|"
+                         r"delete_and_wait_longhorn|restart|kill|"
+                         r"list_node\(\)",
+}
+GLOBAL_STATE_REGEX = {kind: re.compile(pattern)
+                      for kind, pattern in GLOBAL_STATE_PATTERNS.items()}
+
+
+def parse_shard(value):
+    """
+    Parse the --shard option, "<index>/<count>" or "exclusive".
+    Returns (index, count), or None for the exclusive lane.
+    """
+    if value == SHARD_EXCLUSIVE:
+        return None
+    index, count = value.split("/")
+    index, count = int(index), int(count)
+    assert 0 <= index < count, f"invalid shard {value}"
+    return index, count
+
+
+def get_test_source(item):
+    """
+    Return the source of the test function and of the module level
+    functions of its module that it calls directly.
+    """
+    func = getattr(item, "function", None)
+    if func is None:
+        return ""
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        return ""
+
+    module = inspect.getmodule(func)
+    sources = [source]
+    for name in set(re.findall(r"\b(\w+)\(", source)):
+        helper = getattr(module, name, None)
+        if inspect.isfunction(helper) and helper is not func and \
+                inspect.getmodule(helper) is module:
+            try:
+                sources.append(inspect.getsource(helper))
+            except (OSError, TypeError):
+                pass
+    return "\n".join(sources)
+
+
+def classify_global_state(item):
+    """
+    Return the kinds of cluster-global state the test touches. An empty list
+    means it only works on its own volumes and can share the cluster.
+    """
+    if item.get_closest_marker(SHARDABLE_MARKER):
+        return []
+    if item.get_closest_marker(CLUSTER_EXCLUSIVE_MARKER):
+        return ["marked " + CLUSTER_EXCLUSIVE_MARKER]
+
+    kinds = []
+    for marker in GLOBAL_STATE_MARKERS:
+        if item.get_closest_marker(marker):
+            kinds.append("marker " + marker)
+    for fixture in getattr(item, "fixturenames", []):
+        if fixture in GLOBAL_STATE_FIXTURES:
+            kinds.append("fixture " + fixture)
+
+    source = get_test_source(item)
+    for kind, regex in GLOBAL_STATE_REGEX.items():
+        if regex.search(source):
+            kinds.append(kind)
+    return kinds
+
+
+def select_shard_items(items, shard):
+    """
+    Split the collected items into (selected, deselected) for the shard.
+    Tests touching global state only run in the exclusive lane, the others
+    are spread over the shards by a stable hash of their node id.
+    """
+    selected = []
+    deselected = []
+    for item in items:
+        exclusive = len(classify_global_state(item)) > 0
+        if shard is None:
+            keep = exclusive
+        else:
+            index, count = shard
+            keep = not exclusive and \
+                zlib.crc32(item.nodeid.encode()) % count == index
+        if keep:
+            selected.append(item)
+        else:
+            deselected.append(item)
+    return selected, deselected
+
+
+def merge_junit_reports(output, reports):
+    merged = ET.Element("testsuites")
+    for report in reports:
+        try:
+            root = ET.parse(report).getroot()
+        except (OSError, ET.ParseError) as e:
+            print(f"Skip junit report {report}: {e}")
+            continue
+        suites = [root] if root.tag == "testsuite" else list(root)
+        for suite in suites:
+            merged.append(suite)
+    ET.ElementTree(merged).write(output, encoding="utf-8",
+                                 xml_declaration=True)
+
+
+if __name__ == "__main__":
+    # merge the junit reports of a sharded run:
+    #   python3 shard.py <output> <report>...
+    merge_junit_reports(sys.argv[1], sys.argv[2:])
@@ -3,6 +3,7 @@ import pytest
 from common import client, core_api, pvc, pod  # NOQA
 from common import create_and_wait_pod, create_pvc_spec
 from common import get_pvc_manifest, delete_and_wait_pod, get_core_api_client
+from common import POD_NAME
 from common import write_pod_volume_random_data, get_pod_data_md5sum
 from common import DATA_SIZE_IN_MB_2, wait_for_volume_healthy, get_volume_name
 from common import wait_for_volume_clone_status, VOLUME_FIELD_STATE
@@ -32,7 +33,7 @@ def clone_pod(request):
         'apiVersion': 'v1',
         'kind': 'Pod',
         'metadata': {
-            'name': 'test-pod'
+            'name': POD_NAME
         },
         'spec': {
             'containers': [{
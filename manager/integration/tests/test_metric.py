@@ -1,9 +1,12 @@
 import pytest
 import requests
 import time
+import hashlib
 import ipaddress
 
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from kubernetes.stream import stream
 from prometheus_client.parser import text_string_to_metric_families
 
@@ -57,6 +60,10 @@ LABELS = "labels"
 DEFAULT = "default"
 SCHEDULE_1MIN = "* * * * *"
 
+METRICS_PORT = 9500
+METRICS_SCRAPE_TIMEOUT = 30
+METRICS_SCRAPE_MAX_WORKERS = 8
+
 # The dictionaries use float type of value because the value obtained from
 # prometheus_client is in float type.
 # https://github.com/longhorn/longhorn-tests/pull/1531#issuecomment-1833349994
@@ -77,28 +84,114 @@ longhorn_volume_robustness = {
 }
 
 
-def get_metrics(core_api, metric_node_id): # NOQA
+class MetricSamples:
+    """
+    The samples of one /metrics scrape, parsed once and indexed by sample
+    name and by label.
+    """
+    def __init__(self, text, etag=None, digest=None):
+        self.etag = etag
+        self.digest = digest
+        self.families = list(text_string_to_metric_families(text))
+        self.by_name = {}
+        self.by_label = {}
+        for family in self.families:
+            for sample in family.samples:
+                self.by_name.setdefault(sample.name, []).append(sample)
+                for key, value in sample.labels.items():
+                    self.by_label.setdefault(
+                        (sample.name, key, value), []).append(sample)
+
+    def __iter__(self):
+        return iter(self.families)
+
+    def find(self, metric_name, labels=None):
+        """
+        Return the samples named metric_name, in scrape order, whose labels
+        include every string label in labels. Numeric label values are
+        ignored, they are summed up by the callers instead.
+        """
+        samples = self.by_name.get(metric_name, [])
+        for key, value in (labels or {}).items():
+            if type(value) in (float, int):
+                continue
+            matched = self.by_label.get((metric_name, key, value), [])
+            if len(matched) < len(samples):
+                samples, matched = matched, samples
+            matched = set(id(sample) for sample in matched)
+            samples = [sample for sample in samples if id(sample) in matched]
+        return samples
+
+
+# scrapes reuse the connections to the managers and the parsed samples when
+# the metrics did not change since the last scrape
+_metrics_session = requests.Session()
+_metrics_session.mount("http://", HTTPAdapter(
+    pool_connections=METRICS_SCRAPE_MAX_WORKERS,
+    pool_maxsize=METRICS_SCRAPE_MAX_WORKERS))
+_metrics_cache = {}
+
+
+def get_manager_ips(core_api):  # NOQA
     pods = core_api.list_namespaced_pod(namespace=LONGHORN_NAMESPACE,
                                         label_selector="app=longhorn-manager")
+    manager_ips = {}
     for po in pods.items:
-        if po.spec.node_name == metric_node_id:
-            manager_ip = po.status.pod_ip
-            break
+        manager_ip = po.status.pod_ip
+        if not manager_ip:
+            continue
+        # Handle IPv6 addresses
+        ip_obj = ipaddress.ip_address(manager_ip)
+        if ip_obj.version == 6:
+            manager_ip = f"[{manager_ip}]"
+        manager_ips[po.spec.node_name] = manager_ip
+    return manager_ips
+
+
+def fetch_metrics(manager_ip):
+    url = "http://{}:{}/metrics".format(manager_ip, METRICS_PORT)
+    cached = _metrics_cache.get(url)
+    headers = {}
+    if cached is not None and cached.etag:
+        headers["If-None-Match"] = cached.etag
+
+    r = _metrics_session.get(url, headers=headers,
+                             timeout=METRICS_SCRAPE_TIMEOUT)
+    if r.status_code == 304 and cached is not None:
+        return cached
+    r.raise_for_status()
+
+    digest = hashlib.sha1(r.content).hexdigest()
+    if cached is not None and cached.digest == digest:
+        return cached
+
+    samples = MetricSamples(r.content.decode('utf-8'),
+                            etag=r.headers.get("ETag"), digest=digest)
+    _metrics_cache[url] = samples
+    return samples
+
+
+def scrape_metrics(core_api, metric_node_ids):  # NOQA
+    """
+    Scrape the managers on the given nodes concurrently and return the
+    indexed samples of each node.
+    """
+    manager_ips = get_manager_ips(core_api)
+    for node_id in metric_node_ids:
+        if node_id not in manager_ips:
+            raise RuntimeError(
+                f"No Longhorn manager pod found on node {node_id}"
+            )
 
-    if not manager_ip:
-        raise RuntimeError(
-            f"No Longhorn manager pod found on node {metric_node_id}"
-        )
+    with ThreadPoolExecutor(METRICS_SCRAPE_MAX_WORKERS) as executor:
+        futures = {node_id: executor.submit(fetch_metrics,
+                                            manager_ips[node_id])
+                   for node_id in metric_node_ids}
+    return {node_id: future.result() for node_id, future in futures.items()}
 
-    # Handle IPv6 addresses
-    ip_obj = ipaddress.ip_address(manager_ip)
-    if ip_obj.version == 6:
-        manager_ip = f"[{manager_ip}]"
 
-    metrics = requests.get("http://{}:9500/metrics".format(manager_ip)).content
-    string_data = metrics.decode('utf-8')
-    result = text_string_to_metric_families(string_data)
-    return result
+def get_metrics(core_api, metric_node_id): # NOQA
+    return scrape_metrics(core_api, [metric_node_id])[metric_node_id]
 
 
 def find_metric(metric_data, metric_name):
@@ -106,15 +199,8 @@ def find_metric(metric_data, metric_name):
 
 
 def find_metrics(metric_data, metric_name):
-    metrics = []
-
     # Find the metric with the given name in the provided metric data
-    for family in metric_data:
-        for sample in family.samples:
-            if sample.name == metric_name:
-                metrics.append(sample)
-
-    return metrics
+    return metric_data.find(metric_name)
 
 
 def check_metric_with_condition(core_api, metric_name, metric_labels, expected_value=None, metric_node_id=get_self_host_id()): # NOQA)
@@ -133,9 +219,9 @@ def check_metric_with_condition(core_api, metric_name, metric_labels, expected_v
     metric_data = get_metrics(core_api, metric_node_id)
 
     found_metric = next(
-        (sample for family in metric_data for sample in family.samples
-            if sample.name == metric_name and
-            sample.labels.get("condition") == metric_labels.get("condition")),
+        (sample for sample in metric_data.find(metric_name)
+            if sample.labels.get("condition") ==
+            metric_labels.get("condition")),
         None
         )
 
@@ -148,19 +234,13 @@ def check_metric(core_api, metric_name, metric_labels, expected_value=None, metr
     if metric_node_id is None:
         # Populate metric data from all nodes.
         client = get_longhorn_api_client()  # NOQA
-        nodes = client.list_node()
-        metric_data = []
-        for node in nodes:
-            metric_data.extend(get_metrics(core_api, node.id))
+        node_ids = [node.id for node in client.list_node()]
     else:
         # Populate metric data for the specified node.
-        metric_data = get_metrics(core_api, metric_node_id)
+        node_ids = [metric_node_id]
+    metric_data = scrape_metrics(core_api, node_ids)
 
-    found_metric = None
-    for family in metric_data:
-        found_metric = next((sample for sample in family.samples if sample.name == metric_name), None) # NOQA
-        if found_metric:
-            break
+    found_metric = next((sample for node_id in node_ids for sample in metric_data[node_id].find(metric_name)), None) # NOQA
 
     assert found_metric is not None
 
@@ -200,31 +280,19 @@ def check_metric_sum_on_all_nodes(client, core_api, metric_name, expected_labels
     # metric label values.
     total_metric_values = total_metrics["labels"]
 
-    # Find the metric based on the given labels.
-    def filter_metric_by_labels(metrics, labels):
-        for metric in metrics:
-            is_matched = True
-            for key, value in labels.items():
-                if type(value) in (float, int):
-                    continue
-
-                if metric.labels[key] != value:
-                    is_matched = False
-                    break
-
-            if is_matched:
-                return metric
-
-        raise AssertionError("Cannot find the metric matching the labels")
-
-    for node in client.list_node():
-        metric_data = get_metrics(core_api, node.name)
-
-        metrics = find_metrics(metric_data, metric_name)
+    nodes = client.list_node()
+    metric_data = scrape_metrics(core_api, [node.name for node in nodes])
+    for node in nodes:
+        metrics = find_metrics(metric_data[node.name], metric_name)
         if len(metrics) == 0:
             continue
 
-        filtered_metric = filter_metric_by_labels(metrics, expected_labels)
+        # Find the metric based on the given labels.
+        filtered_metrics = metric_data[node.name].find(metric_name,
+                                                       expected_labels)
+        if len(filtered_metrics) == 0:
+            raise AssertionError("Cannot find the metric matching the labels")
+        filtered_metric = filtered_metrics[0]
 
         for key, value in expected_labels.items():
             value_type = type(value)
@@ -301,36 +369,14 @@ def wait_for_metric_count_all_nodes(client, core_api, metric_name, metric_labels
 
 
 def check_metric_count_all_nodes(client, core_api, metric_name, metric_labels, expected_count): # NOQA
-    # Find the metrics based on the given labels.
-    def filter_metrics_by_labels(metrics, labels):
-        filtered_metrics = []
-        for metric in metrics:
-            is_matched = True
-            for key, value in labels.items():
-                if type(value) in (float, int):
-                    continue
-
-                if metric.labels[key] != value:
-                    is_matched = False
-                    break
-
-            if is_matched:
-                filtered_metrics.append(metric)
-
-        print(filtered_metrics)
-        return filtered_metrics
-
     filtered_metrics = []
-    for node in client.list_node():
-        metric_data = get_metrics(core_api, node.name)
-
-        metrics = find_metrics(metric_data, metric_name)
-        if len(metrics) == 0:
-            continue
-
-        filtered_metrics.extend(
-            filter_metrics_by_labels(metrics, metric_labels)
-        )
+    nodes = client.list_node()
+    metric_data = scrape_metrics(core_api, [node.name for node in nodes])
+    for node in nodes:
+        # Find the metrics based on the given labels.
+        metrics = metric_data[node.name].find(metric_name, metric_labels)
+        print(metrics)
+        filtered_metrics.extend(metrics)
 
     assert len(filtered_metrics) == expected_count
 
@@ -6,8 +6,11 @@ import subprocess
 import random
 import string
 import datetime
+import threading
 import time
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from common import create_and_check_volume
 from common import create_and_wait_pod
 from common import create_pvc_for_volume
@@ -45,7 +48,6 @@ from common import write_pod_volume_data
 from common import wait_for_volume_degraded
 from common import VOLUME_ROBUSTNESS_HEALTHY
 from kubernetes.stream import stream
-from random import randrange
 from test_scheduling import wait_new_replica_ready
 
 from backupstore import set_random_backupstore
@@ -66,6 +68,23 @@ else:
 
 count = [str(i) for i in range(NPODS)]
 
+# number of volumes, one per pod, stressed at the same time
+STRESS_TEST_WORKERS = int(os.getenv("STRESS_TEST_WORKERS", NPODS))
+# seed of the action schedule, a random one is printed if not set
+STRESS_TEST_SEED = os.getenv("STRESS_TEST_SEED")
+
+# relative weights of the random actions
+ACTION_WEIGHTS = {
+    "write data": 1,
+    "delete data": 1,
+    "create snapshot": 1,
+    "delete random snapshot": 1,
+    "revert random snapshot": 1,
+    "create backup": 1,
+    "delete replica": 1,
+    "restore random backup": 1,
+}
+
 
 STRESS_POD_NAME_PREFIX = "stress-test-pod-"
 STRESS_PVC_NAME_PREFIX = "stress-test-pvc-"
@@ -80,6 +99,7 @@ STRESS_DEST_DIR = '/data/'
 
 VOLUME_SIZE = str(2 * Gi)
 TEST_DATA_BYTES = 1 * Gi
+TEST_DATA_CHUNK_BYTES = 64 * 1024 * 1024
 
 READ_MD5SUM_TIMEOUT = 120
 
@@ -130,7 +150,7 @@ def get_md5sum(file_path):
     return hash_md5.hexdigest()
 
 
-def get_random_snapshot(snapshots_md5sum):
+def get_random_snapshot(snapshots_md5sum, rng=random):
     snapshots = list(snapshots_md5sum.keys())
 
     snapshots_count = len(snapshots)
@@ -139,7 +159,7 @@ def get_random_snapshot(snapshots_md5sum):
         return None
 
     for i in range(RETRY_COUNTS):
-        snapshot_id = randrange(0, snapshots_count)
+        snapshot_id = rng.randrange(0, snapshots_count)
         snapshot = snapshots[snapshot_id]
 
         if snapshots_md5sum[snapshot].removed is True:
@@ -153,7 +173,7 @@ def get_random_snapshot(snapshots_md5sum):
         return snapshot
 
 
-def get_random_backup_snapshot_data(snapshots_md5sum):
+def get_random_backup_snapshot_data(snapshots_md5sum, rng=random):
     snapshots = list(snapshots_md5sum.keys())
 
     snapshots_count = len(snapshots)
@@ -162,7 +182,7 @@ def get_random_backup_snapshot_data(snapshots_md5sum):
         return None
 
     for i in range(RETRY_COUNTS):
-        snapshot_id = randrange(0, snapshots_count)
+        snapshot_id = rng.randrange(0, snapshots_count)
         snapshot = snapshots[snapshot_id]
 
         if snapshots_md5sum[snapshot].backup_name is None:
@@ -224,7 +244,7 @@ def snapshot_create_and_record_md5sum(client, core_api, volume_name, pod_name, s
     return snap["name"]
 
 
-def revert_random_snapshot(client, core_api, volume_name, pod_manifest, snapshots_md5sum): # NOQA
+def revert_random_snapshot(client, core_api, volume_name, pod_manifest, snapshots_md5sum, rng=random): # NOQA
     volume = client.by_id_volume(volume_name)
     host_id = get_self_host_id()
     pod_name = pod_manifest["metadata"]["name"]
@@ -233,7 +253,7 @@ def revert_random_snapshot(client, core_api, volume_name, pod_manifest, snapshot
     if len(volume.robustness) != VOLUME_ROBUSTNESS_HEALTHY:
         wait_for_volume_healthy(client, volume_name)
 
-    snapshot = get_random_snapshot(snapshots_md5sum)
+    snapshot = get_random_snapshot(snapshots_md5sum, rng)
 
     if snapshot is None:
         print("skipped, no snapshot found", end=" ")
@@ -307,12 +327,12 @@ def backup_create_and_record_md5sum(client, core_api, volume_name, pod_name, sna
     snap.set_data_md5sum(data_md5sum)
 
 
-def restore_and_check_random_backup(client, core_api, volume_name, pod_name, snapshots_md5sum): # NOQA
+def restore_and_check_random_backup(client, core_api, volume_name, pod_name, snapshots_md5sum, rng=random): # NOQA
     res_volume_name = volume_name + '-restore'
 
     host_id = get_self_host_id()
 
-    snap_data = get_random_backup_snapshot_data(snapshots_md5sum)
+    snap_data = get_random_backup_snapshot_data(snapshots_md5sum, rng)
 
     if snap_data is None:
         print("skipped, no recorded backup found", end=" ")
@@ -371,7 +391,7 @@ def restore_and_check_random_backup(client, core_api, volume_name, pod_name, sna
     assert bkp_checksum_ok
 
 
-def delete_replica(client, volume_name):
+def delete_replica(client, volume_name, rng=random):
     volume = client.by_id_volume(volume_name)
 
     replica_count = len(volume.replicas)
@@ -390,7 +410,7 @@ def delete_replica(client, volume_name):
         print("skipped, no healthy replicas found", end=" ")
         return
 
-    replica_id = randrange(0, replica_count)
+    replica_id = rng.randrange(0, replica_count)
 
     replica_name = volume["replicas"][replica_id]["name"]
 
@@ -416,10 +436,14 @@ def write_data(k8s_api_client, pod_name):
     src_file_path = src_dir_path + file_name
     dest_file_path = dest_dir_path + file_name
 
-    src_file = open('%s' % src_file_path, 'wb')
-    src_file.write(os.urandom(TEST_DATA_BYTES))
-    src_file.close()
-    src_file_md5sum = get_md5sum(src_file_path)
+    # written in chunks, several volumes may be writing at once
+    hash_md5 = hashlib.md5()
+    with open(src_file_path, 'wb') as src_file:
+        for _ in range(TEST_DATA_BYTES // TEST_DATA_CHUNK_BYTES):
+            chunk = os.urandom(TEST_DATA_CHUNK_BYTES)
+            hash_md5.update(chunk)
+            src_file.write(chunk)
+    src_file_md5sum = hash_md5.hexdigest()
     command = 'kubectl cp ' + src_file_path + \
               ' ' + pod_name + ':' + dest_file_path
     subprocess.call(command, shell=True)
@@ -468,7 +492,7 @@ def purge_random_snapshot(longhorn_api_client, volume_name, snapshot_name):
     )
 
 
-def delete_random_snapshot(client, volume_name, snapshots_md5sum):
+def delete_random_snapshot(client, volume_name, snapshots_md5sum, rng=random):
     volume = client.by_id_volume(volume_name)
 
     # wait for volume healthy if rebuilding deleted replica
@@ -477,7 +501,7 @@ def delete_random_snapshot(client, volume_name, snapshots_md5sum):
 
     volume = client.by_id_volume(volume_name)
 
-    snapshot = get_random_snapshot(snapshots_md5sum)
+    snapshot = get_random_snapshot(snapshots_md5sum, rng)
 
     if snapshot is None:
         print("skipped, no recorded snapshot found", end=" ")
@@ -533,118 +557,201 @@ def test_stress(generate_load):
     pass
 
 
-@pytest.fixture
-def generate_load(request):
+class StressVolume:
+    """
+    A volume with its PV, PVC and pod, and the state the random actions
+    keep about it. Each volume has its own API clients, since a stream exec
+    swaps the request method of its core API client while it runs, and its
+    own random generator so that the choices the actions make are
+    reproducible from the seed.
+    """
+
+    def __init__(self, index, seed):
+        suffix = get_random_suffix()
+        self.index = index
+        self.volume_name = STRESS_VOLUME_NAME_PREFIX + suffix
+        self.pv_name = STRESS_PV_NAME_PREFIX + suffix
+        self.pvc_name = STRESS_PVC_NAME_PREFIX + suffix
+        self.pod_name = STRESS_POD_NAME_PREFIX + suffix
+        self.pod_manifest = None
+        self.snapshots_md5sum = dict()
+        self.rng = random.Random(f"{seed}-{index}")
+        self.client = None
+        self.core_api = None
+
+    def setup(self):
+        self.client = get_longhorn_api_client()
+        self.core_api = get_core_api_client()
+
+        atexit.register(remove_datafile, self.pod_name)
+        atexit.register(delete_and_wait_longhorn, self.client,
+                        self.volume_name)
+        atexit.register(delete_and_wait_pv, self.core_api, self.pv_name)
+        atexit.register(delete_and_wait_pvc, self.core_api, self.pvc_name)
+        atexit.register(delete_and_wait_pod, self.core_api, self.pod_name)
+
+        longhorn_volume = create_and_check_volume(
+            self.client,
+            self.volume_name,
+            size=VOLUME_SIZE
+        )
+
+        wait_for_volume_detached(self.client, self.volume_name)
+
+        self.pod_manifest = generate_pod_with_pvc_manifest(self.pod_name,
+                                                           self.pvc_name)
+
+        create_pv_for_volume(self.client,
+                             self.core_api,
+                             longhorn_volume,
+                             self.pv_name)
+
+        create_pvc_for_volume(self.client,
+                              self.core_api,
+                              longhorn_volume,
+                              self.pvc_name)
+
+        create_and_wait_pod(self.core_api, self.pod_manifest)
+
+        write_data(self.core_api, self.pod_name)
+        create_recurring_jobs(self.client, self.volume_name)
+
+
+ACTIONS = {
+    "write data": lambda v: write_data(v.core_api, v.pod_name),
+    "delete data": lambda v: delete_data(v.core_api, v.pod_name),
+    "create snapshot": lambda v: snapshot_create_and_record_md5sum(
+        v.client, v.core_api, v.volume_name, v.pod_name, v.snapshots_md5sum),
+    "delete random snapshot": lambda v: delete_random_snapshot(
+        v.client, v.volume_name, v.snapshots_md5sum, rng=v.rng),
+    "revert random snapshot": lambda v: revert_random_snapshot(
+        v.client, v.core_api, v.volume_name, v.pod_manifest,
+        v.snapshots_md5sum, rng=v.rng),
+    "create backup": lambda v: backup_create_and_record_md5sum(
+        v.client, v.core_api, v.volume_name, v.pod_name, v.snapshots_md5sum),
+    "delete replica": lambda v: delete_replica(
+        v.client, v.volume_name, rng=v.rng),
+    "restore random backup": lambda v: restore_and_check_random_backup(
+        v.client, v.core_api, v.volume_name, v.pod_name, v.snapshots_md5sum,
+        rng=v.rng),
+}
+
+
+class ActionStats:
+    """
+    Latency of every action, and the failed ones, across all the volumes.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.failures = {}
+
+    def record(self, action, elapsed, failed=False):
+        with self.lock:
+            if failed:
+                self.failures[action] = self.failures.get(action, 0) + 1
+            else:
+                self.latencies.setdefault(action, []).append(elapsed)
+
+    def report(self, elapsed):
+        def percentile(values, q):
+            return values[min(len(values) - 1, int(q * len(values)))]
+
+        print(f"{'action':24} {'count':>6} {'failed':>6} {'p50':>8} "
+              f"{'p95':>8} {'max':>8} {'per min':>8}")
+        for action in sorted(set(self.latencies) | set(self.failures)):
+            values = sorted(self.latencies.get(action, [])) or [0.0]
+            count = len(self.latencies.get(action, []))
+            print(f"{action:24} {count:6} {self.failures.get(action, 0):6} "
+                  f"{percentile(values, 0.5):8.1f} "
+                  f"{percentile(values, 0.95):8.1f} {values[-1]:8.1f} "
+                  f"{count * 60 / elapsed:8.2f}")
+        total = sum(len(v) for v in self.latencies.values())
+        print(f"{total} actions in {elapsed:.0f}s, "
+              f"{total * 60 / elapsed:.2f} actions per minute")
+
+
+def resolve_random_options(rng):
+    global WAIT_REPLICA_REBUILD, PURGE_DELETED_SNAPSHOT, WAIT_BACKUP_COMPLETE
+    if WAIT_REPLICA_REBUILD is None:
+        WAIT_REPLICA_REBUILD = bool(rng.getrandbits(1))
+    if PURGE_DELETED_SNAPSHOT is None:
+        PURGE_DELETED_SNAPSHOT = bool(rng.getrandbits(1))
+    if WAIT_BACKUP_COMPLETE is None:
+        WAIT_BACKUP_COMPLETE = bool(rng.getrandbits(1))
 
-    index = get_random_suffix()
 
-    longhorn_api_client = get_longhorn_api_client()
-    k8s_api_client = get_core_api_client()
+def generate_schedule(rng, n_volumes, n_actions):
+    """
+    Draw the weighted random actions of every volume up front, so the same
+    seed replays the same schedule.
+    """
+    actions = list(ACTION_WEIGHTS.keys())
+    weights = list(ACTION_WEIGHTS.values())
+    return [rng.choices(actions, weights=weights, k=n_actions)
+            for _ in range(n_volumes)]
 
-    check_and_set_backupstore(longhorn_api_client)
 
-    volume_name = STRESS_VOLUME_NAME_PREFIX + index
-    pv_name = STRESS_PV_NAME_PREFIX + index
-    pvc_name = STRESS_PVC_NAME_PREFIX + index
-    pod_name = STRESS_POD_NAME_PREFIX + index
+def timed_action(stats, volume, action, fn):
+    print(f"{volume.volume_name} {action} started: " + time_now())
+    start = time.time()
+    try:
+        fn(volume)
+    except Exception:
+        stats.record(action, time.time() - start, failed=True)
+        print(f"{volume.volume_name} {action} failed: " + time_now())
+        raise
+    stats.record(action, time.time() - start)
+    print(f"{volume.volume_name} {action} ended: " + time_now())
 
-    atexit.register(remove_datafile, pod_name)
-    atexit.register(delete_and_wait_longhorn, longhorn_api_client, volume_name)
-    atexit.register(delete_and_wait_pv, k8s_api_client, pv_name)
-    atexit.register(delete_and_wait_pvc, k8s_api_client, pvc_name)
-    atexit.register(delete_and_wait_pod, k8s_api_client, pod_name)
 
-    longhorn_volume = create_and_check_volume(
-        longhorn_api_client,
-        volume_name,
-        size=VOLUME_SIZE
-    )
+def run_stress_volume(volume, actions, stats):
+    timed_action(stats, volume, "setup", StressVolume.setup)
+    for action in actions:
+        timed_action(stats, volume, action, ACTIONS[action])
+    clean_volume_backups(volume.client, volume.volume_name)
 
-    wait_for_volume_detached(longhorn_api_client, volume_name)
-
-    pod_manifest = generate_pod_with_pvc_manifest(pod_name, pvc_name)
-
-    create_pv_for_volume(longhorn_api_client,
-                         k8s_api_client,
-                         longhorn_volume,
-                         pv_name)
-
-    create_pvc_for_volume(longhorn_api_client,
-                          k8s_api_client,
-                          longhorn_volume,
-                          pvc_name)
-
-    create_and_wait_pod(k8s_api_client, pod_manifest)
-
-    snapshots_md5sum = dict()
-
-    write_data(k8s_api_client, pod_name)
-    create_recurring_jobs(longhorn_api_client, volume_name)
-
-    global N_RANDOM_ACTIONS
-    for round in range(N_RANDOM_ACTIONS):
-        action = randrange(0, 8)
-
-        if action == 0:
-            print("write data started: " + time_now(), end=', ')
-            write_data(k8s_api_client, pod_name)
-            print("ended: " + time_now())
-
-        elif action == 1:
-            print("delete data started: " + time_now(), end=', ')
-            delete_data(k8s_api_client, pod_name)
-            print("ended: " + time_now())
-
-        elif action == 2:
-            print("create snapshot started: " + time_now(), end=', ')
-            snapshot_create_and_record_md5sum(longhorn_api_client,
-                                              k8s_api_client,
-                                              volume_name,
-                                              pod_name,
-                                              snapshots_md5sum)
-            print("ended: " + time_now())
-
-        elif action == 3:
-            print("delete random snapshot  started: " + time_now(), end=', ')
-            delete_random_snapshot(longhorn_api_client,
-                                   volume_name,
-                                   snapshots_md5sum)
-            print("ended: " + time_now())
-
-        elif action == 4:
-            print("revert random snapshot started: " + time_now(), end=', ')
-            revert_random_snapshot(longhorn_api_client,
-                                   k8s_api_client,
-                                   volume_name,
-                                   pod_manifest,
-                                   snapshots_md5sum)
-            print("ended: " + time_now())
-
-        elif action == 5:
-            print("create backup started: " + time_now(), end=', ')
-            backup_create_and_record_md5sum(longhorn_api_client,
-                                            k8s_api_client,
-                                            volume_name,
-                                            pod_name,
-                                            snapshots_md5sum)
-            print("ended: " + time_now())
-
-        elif action == 6:
-            print("delete replica started: " + time_now(), end=', ')
-            delete_replica(longhorn_api_client, volume_name)
-            print("ended: " + time_now())
-
-        elif action == 7:
-            print("restore random backup started: " + time_now(), end=', ')
-            restore_and_check_random_backup(longhorn_api_client,
-                                            k8s_api_client,
-                                            volume_name,
-                                            pod_name,
-                                            snapshots_md5sum)
-
-            print("ended: " + time_now())
-
-    clean_volume_backups(longhorn_api_client, volume_name)
+
+@pytest.fixture
+def generate_load(request):
+    """
+    Run N_RANDOM_ACTIONS weighted random actions on each of NPODS volumes,
+    with up to STRESS_TEST_WORKERS volumes at the same time. The actions of
+    one volume run in order, the volumes contend with each other for the
+    control plane like the workloads of a busy cluster do.
+    """
+    seed = STRESS_TEST_SEED
+    if seed is None:
+        seed = str(random.randrange(2 ** 32))
+    print(f"stress test seed {seed}, {NPODS} volumes, "
+          f"{STRESS_TEST_WORKERS} workers, {N_RANDOM_ACTIONS} actions each")
+
+    rng = random.Random(seed)
+    resolve_random_options(rng)
+    schedule = generate_schedule(rng, NPODS, N_RANDOM_ACTIONS)
+
+    check_and_set_backupstore(get_longhorn_api_client())
+
+    volumes = [StressVolume(i, seed) for i in range(NPODS)]
+    stats = ActionStats()
+    errors = []
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=STRESS_TEST_WORKERS) as executor:
+        futures = {
+            executor.submit(run_stress_volume, volume, actions, stats): volume
+            for volume, actions in zip(volumes, schedule)
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"{futures[future].volume_name} failed: {e}")
+                errors.append(e)
+    stats.report(time.time() - start)
+
+    if errors:
+        raise errors[0]
 
 
 @pytest.mark.stress
@@ -1,18 +1,41 @@
 from datetime import datetime
+import base64
 import dateutil.parser
+import http.server
+import io
 import json
+import os
+import threading
+import time
 import matplotlib.pyplot as plt
 from kubernetes import client
+from timeseries import ColumnStore, META_FILE_NAME
 
 STS_PREFIX = "sts-"
+# legacy single JSON file format, still readable by dry_draw and preload
 MONITOR_DATA_FILE_NAME = "monitor_data.txt"
+MONITOR_DATA_DIR = "monitor_data"
+
+TIMESTAMPS_SERIES = "timestamps"
+RUNNING_POD_SERIES = "running_pods"
+CPU_SERIES_PREFIX = "cpu-"
+RAM_SERIES_PREFIX = "ram-"
+VALID_STARTING_TIME_SET = "pods_with_valid_starting_time"
+INVALID_STARTING_TIME_SET = "pods_with_invalid_starting_time"
+
+# headless mode keeps the most recent points at full resolution and
+# decimates the older history so redraw cost stays bounded
+DISPLAY_RECENT_POINTS = 720
+DISPLAY_HISTORY_POINTS = 1000
+SNAPSHOT_INTERVAL = 12 # write PNG/HTML snapshots every N updates
+SNAPSHOT_FILE_NAME = "monitor_snapshot"
 
 # annotate the point at which the pod starting time is bigger than the maximum allowed value 
 MAX_POD_STARTING_TIME_POINT = "max_pod_starting_time_point" 
 MAX_POD_CRASHING_POINT = "max_pod_crashing_point" 
 
 class Monitor:
-    def __init__(self, core_api_v1, custom_objects_api, updating_interval, node_capacities, preload, sts_count, max_pod_starting_time, max_pod_crashing_count, file_name = MONITOR_DATA_FILE_NAME):
+    def __init__(self, core_api_v1, custom_objects_api, updating_interval, node_capacities, preload, sts_count, max_pod_starting_time, max_pod_crashing_count, file_name = MONITOR_DATA_DIR, headless = False, http_port = None):
         self.core_api_v1 = core_api_v1
         self.custom_objects_api = custom_objects_api
         self.updating_interval = updating_interval
@@ -21,10 +44,16 @@ class Monitor:
         self.sts_count = sts_count
         
         self.node_capacities = node_capacities
+        self.headless = headless
+        self.http_port = http_port
+        self.snapshot_png = b""
+        self.snapshot_lock = threading.Lock()
         
+        self.store = None
         if preload:
             self.load_data_from_disk(file_name)
         else:
+            self.store = ColumnStore(file_name, truncate=True)
             self.timestamps = []
             self.time_diffs = []
             self.running_pod_metric = []
@@ -33,6 +62,7 @@ class Monitor:
             self.annotating_points = dict()
             self.pods_with_valid_starting_time = dict()
             self.pods_with_invalid_starting_time = dict()
+            self.save_meta_to_disk()
 
         self.fig, self.axes = plt.subplots(3, 1)
         self.fig.set_size_inches(16, 10)
@@ -44,6 +74,16 @@ class Monitor:
         """.format(sts_count=self.sts_count, max_pod_starting_time= self.max_pod_starting_time, max_pod_crashing_count=self.max_pod_crashing_count)
         self.fig.text(0.05, 0, notes, va='bottom', ha='left')
 
+        ax1, ax2, ax3 = self.axes
+        ax1.set_ylabel('Number of running pods')
+        ax2.set_ylabel('CPU usage in percents')
+        ax3.set_ylabel('RAM usage in percents')
+        ax3.set_xlabel('Time in seconds')
+        self.running_pod_line = None
+        self.cpu_lines = dict()
+        self.ram_lines = dict()
+        self.drawn_annotations = set()
+
     def update_data(self):
         # get running pod count
         pod_list = []
@@ -63,6 +103,9 @@ class Monitor:
             print("Exception when calling custom_objects_api->list_cluster_custom_object: %s\n" % e)
             print("Will set node metrics to 0")
 
+        if self.store is None:
+            self.migrate_to_column_store()
+
         now = datetime.now()
         self.timestamps.append(now)
         diff = now-self.timestamps[0]
@@ -73,6 +116,7 @@ class Monitor:
         
         # update the internal metrics
         self.running_pod_metric.append(running_pod_count)
+        annotating_point_count = len(self.annotating_points)
         if pod_with_valid_starting_time_count < running_pod_count and MAX_POD_STARTING_TIME_POINT not in self.annotating_points:
             self.annotating_points[MAX_POD_STARTING_TIME_POINT] = {
                 "xy": (diff.total_seconds(), 
@@ -94,8 +138,9 @@ class Monitor:
             cpu_percent = 100*int(used_cpu_string[:-1])/self.node_capacities[node_name]["cpu"]
             ram_percent = 100*int(used_ram_string[:-2])/self.node_capacities[node_name]["ram"]
 
-            cpu_metric = self.cpu_metrics.get(node_name, [])
-            ram_metric = self.ram_metrics.get(node_name, [])
+            # a node showing up later starts with zeros so that every column stays aligned with the timestamps
+            cpu_metric = self.cpu_metrics.get(node_name, [0]*(len(self.time_diffs)-1))
+            ram_metric = self.ram_metrics.get(node_name, [0]*(len(self.time_diffs)-1))
             cpu_metric.append(cpu_percent)
             ram_metric.append(ram_percent)
             self.cpu_metrics[node_name] = cpu_metric
@@ -104,12 +149,14 @@ class Monitor:
         # update node metrics with value 0 if the information is missing in the above update
         for metric in self.cpu_metrics.values():
             if len(metric) < len(self.time_diffs):
-                cpu_metric.extend([0]*(len(self.time_diffs)-len(metric)))
+                metric.extend([0]*(len(self.time_diffs)-len(metric)))
         for metric in self.ram_metrics.values():
             if len(metric) < len(self.time_diffs):
-                cpu_metric.extend([0]*(len(self.time_diffs)-len(metric)))
+                metric.extend([0]*(len(self.time_diffs)-len(metric)))
 
-        self.save_data_to_disk()
+        self.append_data_to_disk()
+        if len(self.annotating_points) != annotating_point_count:
+            self.save_meta_to_disk()
 
     def count_pod_numbers(self, pod_list):
         running_pod_count = 0
@@ -132,8 +179,10 @@ class Monitor:
                     if staring_time <= self.max_pod_starting_time:
                         pod_with_valid_starting_time_count += 1
                         self.pods_with_valid_starting_time[pod.metadata.name] = True
-                    else:
+                        self.store.add_to_set(VALID_STARTING_TIME_SET, pod.metadata.name)
+                    elif pod.metadata.name not in self.pods_with_invalid_starting_time:
                         self.pods_with_invalid_starting_time[pod.metadata.name] = True
+                        self.store.add_to_set(INVALID_STARTING_TIME_SET, pod.metadata.name)
             # TODO: find a more accurate way to detect crashing
             if (pod and pod.status and pod.status.container_statuses and len(pod.status.container_statuses) > 0 and 
                 pod.status.container_statuses[0] and pod.status.container_statuses[0].restart_count > 0):
@@ -141,29 +190,58 @@ class Monitor:
 
         return running_pod_count, pod_with_valid_starting_time_count, crashing_pod_count
 
-    def save_data_to_disk(self):
-        # persist the data to disk
-        timestamps_isoformat = []
-        for ts in self.timestamps:
-            timestamps_isoformat.append(ts.isoformat())
-
-        out_str = json.dumps({"timestamps_isoformat": timestamps_isoformat,
-        "time_diffs": self.time_diffs,
-        "running_pod_metric": self.running_pod_metric,
-        "cpu_metrics": self.cpu_metrics,
-        "ram_metrics": self.ram_metrics,
-        "annotating_points": self.annotating_points,
-        "sts_count": self.sts_count,
-        "max_pod_starting_time": self.max_pod_starting_time,
-        "max_pod_crashing_count": self.max_pod_crashing_count,
-        "pods_with_valid_starting_time": self.pods_with_valid_starting_time,
-        "pods_with_invalid_starting_time": self.pods_with_invalid_starting_time,
-        })
+    def append_data_to_disk(self):
+        # append the newest sample of every series, constant cost per tick
+        self.store.append(TIMESTAMPS_SERIES, self.timestamps[-1].timestamp())
+        self.store.append(RUNNING_POD_SERIES, self.running_pod_metric[-1])
+        for node_name, metric in self.cpu_metrics.items():
+            self.append_node_metric(CPU_SERIES_PREFIX + node_name, metric)
+        for node_name, metric in self.ram_metrics.items():
+            self.append_node_metric(RAM_SERIES_PREFIX + node_name, metric)
+        self.store.flush()
 
-        with open(MONITOR_DATA_FILE_NAME, 'w') as writer:
-            writer.write(out_str)
+    def append_node_metric(self, series, metric):
+        # a node seen for the first time writes its zero-padded history
+        self.store.append_many(series, metric[self.store.length(series):])
+
+    def save_meta_to_disk(self):
+        self.store.write_meta({
+            "annotating_points": self.annotating_points,
+            "sts_count": self.sts_count,
+            "max_pod_starting_time": self.max_pod_starting_time,
+            "max_pod_crashing_count": self.max_pod_crashing_count,
+        })
 
     def load_data_from_disk(self, file_name):
+        if os.path.isfile(file_name):
+            self.load_legacy_data_from_disk(file_name)
+            return
+        legacy_file_name = os.path.join(os.path.dirname(file_name), MONITOR_DATA_FILE_NAME)
+        if not os.path.isfile(os.path.join(file_name, META_FILE_NAME)) and os.path.isfile(legacy_file_name):
+            # only the legacy JSON file was written, it is moved into the
+            # column store on the first update
+            self.load_legacy_data_from_disk(legacy_file_name)
+            return
+
+        self.store = ColumnStore(file_name)
+        meta = self.store.read_meta()
+        self.annotating_points = meta["annotating_points"]
+        self.sts_count = meta["sts_count"]
+        self.max_pod_starting_time = meta["max_pod_starting_time"]
+        self.max_pod_crashing_count = meta["max_pod_crashing_count"]
+        self.pods_with_valid_starting_time = self.store.read_set(VALID_STARTING_TIME_SET)
+        self.pods_with_invalid_starting_time = self.store.read_set(INVALID_STARTING_TIME_SET)
+
+        timestamps = self.store.read(TIMESTAMPS_SERIES)
+        self.timestamps = [datetime.fromtimestamp(ts) for ts in timestamps]
+        self.time_diffs = (timestamps - timestamps[0]).tolist() if len(timestamps) else []
+        self.running_pod_metric = self.store.read(RUNNING_POD_SERIES).tolist()
+        self.cpu_metrics = {node_name: self.store.read(CPU_SERIES_PREFIX + node_name).tolist()
+                            for node_name in self.store.series_names(CPU_SERIES_PREFIX)}
+        self.ram_metrics = {node_name: self.store.read(RAM_SERIES_PREFIX + node_name).tolist()
+                            for node_name in self.store.series_names(RAM_SERIES_PREFIX)}
+
+    def load_legacy_data_from_disk(self, file_name):
         with open(file_name, 'r') as reader:
             in_str = reader.read()
             decoded_input = json.loads(in_str)
@@ -181,8 +259,22 @@ class Monitor:
             self.timestamps = []
             for ts_isoformat in timestamps_isoformat:
                 self.timestamps.append(dateutil.parser.parse(ts_isoformat))
-            
 
+    def migrate_to_column_store(self):
+        # move a history preloaded from the legacy JSON file into the column store
+        self.store = ColumnStore(MONITOR_DATA_DIR, truncate=True)
+        self.store.append_many(TIMESTAMPS_SERIES, [ts.timestamp() for ts in self.timestamps])
+        self.store.append_many(RUNNING_POD_SERIES, self.running_pod_metric)
+        for node_name, metric in self.cpu_metrics.items():
+            self.store.append_many(CPU_SERIES_PREFIX + node_name, metric)
+        for node_name, metric in self.ram_metrics.items():
+            self.store.append_many(RAM_SERIES_PREFIX + node_name, metric)
+        for pod_name in self.pods_with_valid_starting_time:
+            self.store.add_to_set(VALID_STARTING_TIME_SET, pod_name)
+        for pod_name in self.pods_with_invalid_starting_time:
+            self.store.add_to_set(INVALID_STARTING_TIME_SET, pod_name)
+        self.store.flush()
+        self.save_meta_to_disk()
 
     def clear_axes(self):
         for ax in self.axes:
@@ -192,7 +284,7 @@ class Monitor:
         ax1, ax2, ax3 = self.axes
 
         ax1.plot(self.time_diffs, self.running_pod_metric) 
-        informationsinformationsax1.set_ylabel('Number of running pods')
+        ax1.set_ylabel('Number of running pods')
 
         for point in self.annotating_points.values():
             ax1.annotate(point["description"],
@@ -211,16 +303,120 @@ class Monitor:
         ax3.set_ylabel('RAM usage in percents')
         ax3.set_xlabel('Time in seconds')
 
+    def draw_incrementally(self):
+        # update the data of the existing lines in place instead of clearing and replotting every series
+        ax1, ax2, ax3 = self.axes
+        indexes = display_indexes(len(self.time_diffs))
+        xs = [self.time_diffs[i] for i in indexes]
+
+        if self.running_pod_line is None:
+            self.running_pod_line, = ax1.plot([], [])
+        self.running_pod_line.set_data(xs, [self.running_pod_metric[i] for i in indexes])
+
+        for key, point in self.annotating_points.items():
+            if key in self.drawn_annotations:
+                continue
+            ax1.annotate(point["description"],
+                xy= point["xy"], xycoords='data',
+                xytext=(0, 20), textcoords='offset points',
+                arrowprops=dict(facecolor=point["color"], shrink=0.05),
+                horizontalalignment='center', verticalalignment='center')
+            self.drawn_annotations.add(key)
+
+        for ax, lines, metrics in [(ax2, self.cpu_lines, self.cpu_metrics), (ax3, self.ram_lines, self.ram_metrics)]:
+            for node_name in sorted(metrics.keys()):
+                if node_name not in lines:
+                    lines[node_name], = ax.plot([], [], label = node_name)
+                lines[node_name].set_data(xs, [metrics[node_name][i] for i in indexes])
+
+        for ax in self.axes:
+            ax.relim()
+            ax.autoscale_view()
+
+    def summary(self):
+        return {
+            "timestamp": self.timestamps[-1].isoformat() if self.timestamps else None,
+            "elapsed_seconds": self.time_diffs[-1] if self.time_diffs else 0,
+            "samples": len(self.time_diffs),
+            "running_pods": self.running_pod_metric[-1] if self.running_pod_metric else 0,
+            "pods_with_valid_starting_time": len(self.pods_with_valid_starting_time),
+            "pods_with_invalid_starting_time": len(self.pods_with_invalid_starting_time),
+            "annotating_points": self.annotating_points,
+            "cpu_percent": {node_name: metric[-1] for node_name, metric in list(self.cpu_metrics.items()) if metric},
+            "ram_percent": {node_name: metric[-1] for node_name, metric in list(self.ram_metrics.items()) if metric},
+        }
+
+    def save_snapshot(self):
+        buffer = io.BytesIO()
+        self.fig.savefig(buffer, format="png")
+        png = buffer.getvalue()
+        with self.snapshot_lock:
+            self.snapshot_png = png
+
+        with open(SNAPSHOT_FILE_NAME + ".png", 'wb') as writer:
+            writer.write(png)
+        html = """<html><head><title>Scale Test</title><meta http-equiv="refresh" content="{refresh}"></head>
+<body><pre>{summary}</pre><img src="data:image/png;base64,{image}"/></body></html>
+""".format(refresh=self.updating_interval * SNAPSHOT_INTERVAL,
+           summary=json.dumps(self.summary(), indent=2),
+           image=base64.b64encode(png).decode())
+        with open(SNAPSHOT_FILE_NAME + ".html", 'w') as writer:
+            writer.write(html)
+
+    def serve_http(self):
+        monitor = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/snapshot.png":
+                    with monitor.snapshot_lock:
+                        body, content_type = monitor.snapshot_png, "image/png"
+                else:
+                    body, content_type = json.dumps(monitor.summary()).encode(), "application/json"
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(("", self.http_port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print("serving monitoring summary at http://0.0.0.0:%d/ and /snapshot.png" % self.http_port)
+
     def run(self):
         print("running monitoring loop ...")
+        if self.headless:
+            self.run_headless()
+            return
         while True:
-            self.clear_axes()
             self.update_data()
-            self.draw()
+            self.draw_incrementally()
             # check the stopping condition and tell the user to check the file for the graph.
             plt.pause(self.updating_interval)
 
-def draw_from_data_file(file_name = MONITOR_DATA_FILE_NAME):
+    def run_headless(self):
+        if self.http_port:
+            self.serve_http()
+        update_count = 0
+        while True:
+            started_at = time.time()
+            self.update_data()
+            update_count += 1
+            if update_count % SNAPSHOT_INTERVAL == 1:
+                self.draw_incrementally()
+                self.save_snapshot()
+            time.sleep(max(0, self.updating_interval - (time.time() - started_at)))
+
+def display_indexes(length, recent = DISPLAY_RECENT_POINTS, history = DISPLAY_HISTORY_POINTS):
+    # all of the most recent points plus an evenly strided subset of the older ones
+    split = max(0, length - recent)
+    stride = max(1, -(-split // history))
+    return list(range(0, split, stride)) + list(range(split, length))
+
+def draw_from_data_file(file_name = MONITOR_DATA_DIR):
     m = Monitor(None, None, None, None, True, 0, 0, 0, file_name)
     m.draw()
     plt.show()
@@ -1,13 +1,12 @@
-from os import times
-from typing import Dict
-from matplotlib.pyplot import get
+import json
+import math
+import os
+import threading
 import time
-from re import S
 import sys
 import asyncio
 import logging
 from pathlib import Path
-from asyncio.tasks import sleep
 from kubernetes import client, config, watch
 import monitor
 
@@ -19,6 +18,12 @@ KUBE_CONFIG = None
 KUBE_CONTEXT = None
 MAX_POD_STARTING_TIME = 300 # in seconds
 MAX_POD_CRASHING_COUNT = 0
+MAX_CONCURRENT_API_CALLS = 16
+WATCH_TIMEOUT = 300 # in seconds
+TIMELINE_FILE = "out/timeline.json"
+# run the monitor without a display, writing PNG/HTML snapshots and serving a summary over HTTP
+MONITOR_HEADLESS = os.environ.get("MONITOR_HEADLESS", "false") == "true"
+MONITOR_HTTP_PORT = int(os.environ.get("MONITOR_HTTP_PORT", "8080"))
 
 def get_node_capacities():
     v1 = client.CoreV1Api()
@@ -141,77 +146,270 @@ def create_sts_spec(node_name, workload_type) :
 
     return statefulset
 
-def create_statefulsets(api, sts_objects):
-    for sts in sts_objects:
-        api.create_namespaced_stateful_set(namespace="default", body=sts)
-
-def scale_statefulsets(api, sts_objects, n):
-    for sts in sts_objects:
-        sts = api.read_namespaced_stateful_set(name=sts.metadata.name, namespace="default")
-        sts.spec.replicas = n
-        api.patch_namespaced_stateful_set(name=sts.metadata.name, namespace="default", body=sts)
-        
-        
-
-async def watch_pods_async():
-    log = logging.getLogger('pod_events')
-    log.setLevel(logging.INFO)
-    v1 = client.CoreV1Api()
-    w = watch.Watch()
-    for event in w.stream(v1.list_namespaced_pod, namespace=NAMESPACE):
-        process_pod_event(log, event)
-        await asyncio.sleep(0)
-
-
-def process_pod_event(log, event):
-    log.info("Event: %s %s %s" % (event['type'], event['object'].kind, event['object'].metadata.name))
-    if 'ADDED' in event['type']:
-        pass
-    elif 'DELETED' in event['type']:
-        pass
-    else:
-        pass
-
-
-async def watch_pvc_async():
-    log = logging.getLogger('pvc_events')
-    log.setLevel(logging.INFO)
-    v1 = client.CoreV1Api()
-    v1.list_namespaced_pod()
-    w = watch.Watch()
-    for event in w.stream(v1.list_namespaced_persistent_volume_claim, namespace=NAMESPACE):
-        process_pvc_event(log, event)
-        await asyncio.sleep(0)
-
-
-def process_pvc_event(log, event):
-    log.info("Event: %s %s %s" % (event['type'], event['object'].kind, event['object'].metadata.name))
-    if 'ADDED' in event['type']:
-        pass
-    elif 'DELETED' in event['type']:
-        pass
-    else:
-        pass
-
-
-async def watch_va_async():
-    log = logging.getLogger('va_events')
-    log.setLevel(logging.INFO)
-    storage = client.StorageV1Api()
-    w = watch.Watch()
-    for event in w.stream(storage.list_volume_attachment):
-        process_va_event(log, event)
-        await asyncio.sleep(0)
-
-
-def process_va_event(log, event):
-    log.info("Event: %s %s %s" % (event['type'], event['object'].kind, event['object'].metadata.name))
-    if 'ADDED' in event['type']:
-        pass
-    elif 'DELETED' in event['type']:
-        pass
-    else:
-        pass
+async def create_statefulsets(api, sts_objects):
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_API_CALLS)
+
+    async def create(sts):
+        async with semaphore:
+            await asyncio.to_thread(api.create_namespaced_stateful_set, namespace=NAMESPACE, body=sts)
+
+    await asyncio.gather(*[create(sts) for sts in sts_objects])
+
+async def scale_statefulsets(api, sts_objects, n):
+    # a merge patch of the replica count only, no read-modify-write round trip
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_API_CALLS)
+    body = {"spec": {"replicas": n}}
+
+    async def scale(sts):
+        async with semaphore:
+            await asyncio.to_thread(api.patch_namespaced_stateful_set, name=sts.metadata.name, namespace=NAMESPACE, body=body)
+
+    await asyncio.gather(*[scale(sts) for sts in sts_objects])
+
+
+def percentile(values, p):
+    # nearest-rank percentile
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class PodTimeline:
+    """
+    Collects phase timestamps for each workload pod from pod, PVC and
+    VolumeAttachment events:
+      pod_created, pvc_created, pvc_bound, va_created, va_attached,
+      container_started, pod_deleted, va_detached
+    All timestamps are taken when the event is received by the driver.
+    Objects created before the driver started are listed by the initial
+    ADDED events with all their phases reached at once, so only their
+    deletion phases are recorded.
+    """
+    def __init__(self):
+        self.pods = dict() # pod name to phase timestamps
+        self.pvc_to_pod = dict()
+        self.pv_to_pvc = dict()
+        self.pod_count = 0 # number of workload pods the pod belongs to when scaled
+        self.started_at = time.time()
+        self.running_before_start = set() # pods already running when the driver started
+
+    def created_before_start(self, obj):
+        # creation timestamps have a resolution of one second
+        created = obj.metadata.creation_timestamp
+        return created is not None and created.timestamp() < int(self.started_at)
+
+    def started_pod_count(self):
+        started = sum(1 for phases in self.pods.values()
+                      if "container_started" in phases and "pod_deleted" not in phases)
+        return started + len(self.running_before_start)
+
+    def record(self, pod_name, phase, ts):
+        phases = self.pods.setdefault(pod_name, {"pod_count": self.pod_count})
+        # keep the first time a phase is seen
+        phases.setdefault(phase, ts)
+
+    def pod_of_pvc(self, pvc_name):
+        # volume claim template PVCs are named <claim>-<pod>, and the claim
+        # name equals the StatefulSet name
+        if pvc_name in self.pvc_to_pod:
+            return self.pvc_to_pod[pvc_name]
+        for prefix_len in range(len(STS_PREFIX), len(pvc_name)):
+            if pvc_name[prefix_len] != "-":
+                continue
+            claim, pod_name = pvc_name[:prefix_len], pvc_name[prefix_len+1:]
+            if pod_name.startswith(claim + "-"):
+                self.pvc_to_pod[pvc_name] = pod_name
+                return pod_name
+        return None
+
+    def process_pod_event(self, event, ts):
+        pod = event['object']
+        pod_name = pod.metadata.name
+        if STS_PREFIX not in pod_name:
+            return
+        if self.created_before_start(pod):
+            if event['type'] == 'DELETED' or pod.metadata.deletion_timestamp is not None:
+                self.running_before_start.discard(pod_name)
+                self.record(pod_name, "pod_deleted", ts)
+            else:
+                self.running_before_start.add(pod_name)
+            return
+        if event['type'] == 'ADDED':
+            self.record(pod_name, "pod_created", ts)
+        elif event['type'] == 'DELETED':
+            self.record(pod_name, "pod_deleted", ts)
+            return
+        if pod.metadata.deletion_timestamp is not None:
+            self.record(pod_name, "pod_deleted", ts)
+        for status in (pod.status.container_statuses or []):
+            if status.state and status.state.running:
+                self.record(pod_name, "container_started", ts)
+
+    def process_pvc_event(self, event, ts):
+        pvc = event['object']
+        pod_name = self.pod_of_pvc(pvc.metadata.name)
+        if pod_name is None:
+            return
+        if pvc.spec.volume_name:
+            self.pv_to_pvc[pvc.spec.volume_name] = pvc.metadata.name
+        if self.created_before_start(pvc):
+            return
+        if event['type'] == 'ADDED':
+            self.record(pod_name, "pvc_created", ts)
+        if pvc.status and pvc.status.phase == "Bound":
+            self.record(pod_name, "pvc_bound", ts)
+
+    def process_va_event(self, event, ts):
+        va = event['object']
+        pvc_name = self.pv_to_pvc.get(va.spec.source.persistent_volume_name)
+        if pvc_name is None:
+            return
+        pod_name = self.pod_of_pvc(pvc_name)
+        if pod_name is None:
+            return
+        phases = self.pods.get(pod_name, {})
+        attached = va.status is not None and va.status.attached
+        if self.created_before_start(va):
+            if "pod_deleted" in phases and (event['type'] == 'DELETED' or not attached):
+                self.record(pod_name, "va_detached", ts)
+            return
+        if event['type'] == 'ADDED':
+            self.record(pod_name, "va_created", ts)
+        if attached and event['type'] != 'DELETED':
+            # a pod that is scaled up again gets a fresh attach cycle
+            if "va_detached" in phases:
+                for phase in ("va_created", "va_attached", "va_detached", "pod_deleted"):
+                    phases.pop(phase, None)
+                self.record(pod_name, "va_created", ts)
+            self.record(pod_name, "va_attached", ts)
+        elif "va_attached" in phases and (event['type'] == 'DELETED' or not attached):
+            self.record(pod_name, "va_detached", ts)
+
+    def latencies(self):
+        # latency name to (start phase, end phase)
+        definitions = {
+            "volume_creation": ("pvc_created", "pvc_bound"),
+            "volume_attach": ("va_created", "va_attached"),
+            "pod_start": ("pod_created", "container_started"),
+            "volume_detach": ("pod_deleted", "va_detached"),
+        }
+        result = dict() # pod count to latency name to values
+        for phases in self.pods.values():
+            by_name = result.setdefault(phases["pod_count"], dict())
+            for name, (start, end) in definitions.items():
+                if start in phases and end in phases:
+                    by_name.setdefault(name, []).append(phases[end] - phases[start])
+        return result
+
+    def report(self):
+        lines = ["%10s %-16s %6s %8s %8s %8s" % ("pods", "latency", "count", "p50", "p95", "p99")]
+        for pod_count, by_name in sorted(self.latencies().items()):
+            for name, values in sorted(by_name.items()):
+                lines.append("%10d %-16s %6d %8.2f %8.2f %8.2f" % (
+                    pod_count, name, len(values),
+                    percentile(values, 50), percentile(values, 95), percentile(values, 99)))
+        return "\n".join(lines)
+
+    def save(self, file_name=TIMELINE_FILE):
+        file = Path(file_name)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_text(json.dumps({"pods": self.pods}, indent=2))
+
+
+class LoadDriver:
+    """
+    Drives StatefulSet creation and scaling concurrently while consuming
+    pod, PVC and VolumeAttachment events. The kubernetes client watch is
+    blocking, so each stream runs in its own thread and hands events to
+    the event loop through a queue.
+    """
+    def __init__(self, apps_api, core_api, storage_api):
+        self.apps_api = apps_api
+        self.core_api = core_api
+        self.storage_api = storage_api
+        self.timeline = PodTimeline()
+        self.watches = []
+        self.stopped = threading.Event()
+
+    def stream_events(self, loop, queue, source, list_func, **kwargs):
+        log = logging.getLogger(source + '_events')
+        while not self.stopped.is_set():
+            w = watch.Watch()
+            self.watches.append(w)
+            try:
+                for event in w.stream(list_func, timeout_seconds=WATCH_TIMEOUT, **kwargs):
+                    loop.call_soon_threadsafe(queue.put_nowait, (source, event, time.time()))
+            except Exception as e:
+                log.warning("watch %s failed: %s, restarting" % (source, e))
+                time.sleep(1)
+
+    async def consume_events(self, queue):
+        handlers = {
+            "pod": self.timeline.process_pod_event,
+            "pvc": self.timeline.process_pvc_event,
+            "va": self.timeline.process_va_event,
+        }
+        while True:
+            source, event, ts = await queue.get()
+            try:
+                handlers[source](event, ts)
+            except Exception as e:
+                logging.warning("failed to process %s event: %s" % (source, e))
+
+    async def wait_for_pods_started(self, pod_count, timeout):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.timeline.started_pod_count() >= pod_count:
+                return True
+            await asyncio.sleep(1)
+        return False
+
+    async def run(self, sts_objects, replicas, step, create):
+        if step <= 0:
+            raise ValueError("scale step must be positive, got %d" % step)
+        self.timeline.started_at = time.time()
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        for source, list_func, kwargs in [
+            ("pod", self.core_api.list_namespaced_pod, {"namespace": NAMESPACE}),
+            ("pvc", self.core_api.list_namespaced_persistent_volume_claim, {"namespace": NAMESPACE}),
+            ("va", self.storage_api.list_volume_attachment, {}),
+        ]:
+            threading.Thread(target=self.stream_events, args=(loop, queue, source, list_func),
+                             kwargs=kwargs, daemon=True).start()
+        consumer = asyncio.create_task(self.consume_events(queue))
+
+        if create:
+            await create_statefulsets(self.apps_api, sts_objects)
+            print("Created %d statefulsets" % (len(sts_objects)))
+
+        # scale up (or down) in steps so latencies can be reported against
+        # the number of workload pods in the cluster
+        current = min(sts.spec.replicas or 0 for sts in sts_objects) if not create else 0
+        targets = list(range(current + step, replicas, step)) if replicas > current else []
+        targets.append(replicas)
+        for target in targets:
+            self.timeline.pod_count = target * len(sts_objects)
+            await scale_statefulsets(self.apps_api, sts_objects, target)
+            print("Scaled %d statefulsets so that each has %d replicas" % (len(sts_objects), target))
+            if target > current:
+                started = await self.wait_for_pods_started(self.timeline.pod_count, MAX_POD_STARTING_TIME)
+                if not started:
+                    print("Not all %d pods started within %d seconds" % (self.timeline.pod_count, MAX_POD_STARTING_TIME))
+            elif target < current:
+                # give the detach events time to arrive
+                await asyncio.sleep(MAX_POD_STARTING_TIME)
+            current = target
+
+        self.stopped.set()
+        for w in self.watches:
+            w.stop()
+        consumer.cancel()
+
+        self.timeline.save()
+        print(self.timeline.report())
 
 
 if __name__ == '__main__':
@@ -234,18 +432,24 @@ if __name__ == '__main__':
                             context=KUBE_CONTEXT)
     apps_v1 = client.AppsV1Api()
     core_api_v1 = client.CoreV1Api()
+    storage_v1 = client.StorageV1Api()
     custom_objects_ppi = client.CustomObjectsApi()
 
     if operation == "scale":
         count =  input("How many replicas per StatefulSet? ")
         count = int(count)
+        step = input("Scale step (replicas per StatefulSet, default all at once)? ")
+        step = int(step) if step else count
+        if step <= 0:
+            print("invalid scale step")
+            sys.exit(1)
         sts_objects = get_sts_objects(apps_v1)
-        scale_statefulsets(apps_v1, sts_objects, count)
-        print("Scaled %d statefulsets so that each has %d replicas" % (len(sts_objects), count))
+        driver = LoadDriver(apps_v1, core_api_v1, storage_v1)
+        asyncio.run(driver.run(sts_objects, count, step, create=False))
     elif operation == "monitor":
         preload = input("preload (yes)? ")   
         sts_objects = get_sts_objects(apps_v1)         
-        m = monitor.Monitor(core_api_v1, custom_objects_ppi, 5, get_node_capacities(), preload == "yes", len(sts_objects), MAX_POD_STARTING_TIME, MAX_POD_CRASHING_COUNT)
+        m = monitor.Monitor(core_api_v1, custom_objects_ppi, 5, get_node_capacities(), preload == "yes", len(sts_objects), MAX_POD_STARTING_TIME, MAX_POD_CRASHING_COUNT, headless=MONITOR_HEADLESS, http_port=MONITOR_HTTP_PORT)
         m.run()
     elif operation == "all":
         workload_type = input("workload type (non_io, io_1, io_2, io_3) ")
@@ -255,50 +459,22 @@ if __name__ == '__main__':
         
         count =  input("How many replicas per StatefulSet? ")
         count = int(count)
+        step = input("Scale step (replicas per StatefulSet, default all at once)? ")
+        step = int(step) if step else count
+        if step <= 0:
+            print("invalid scale step")
+            sys.exit(1)
 
         node_names = get_node_name_list()
         sts_objects = create_sts_objects(node_names, workload_type)
 
-        create_statefulsets(apps_v1, sts_objects)
-        print("Created %d statefulsets" % (len(sts_objects)))
-
-        print("sleeping for 15s")
-        time.sleep(15)
-        
-        scale_statefulsets(apps_v1, sts_objects, count)
-        print("Scaled %d statefulsets so that each has %d replicas" % (len(sts_objects), count))
+        # the monitor has to record the scale-up, and its plot window needs
+        # the main thread, so the driver runs in the background
+        driver = LoadDriver(apps_v1, core_api_v1, storage_v1)
+        threading.Thread(target=asyncio.run, args=(driver.run(sts_objects, count, step, create=True),),
+                         daemon=True).start()
 
-        m = monitor.Monitor(core_api_v1, custom_objects_ppi, 5, get_node_capacities(), False, len(sts_objects), MAX_POD_STARTING_TIME, MAX_POD_CRASHING_COUNT)
+        m = monitor.Monitor(core_api_v1, custom_objects_ppi, 5, get_node_capacities(), False, len(sts_objects), MAX_POD_STARTING_TIME, MAX_POD_CRASHING_COUNT, headless=MONITOR_HEADLESS, http_port=MONITOR_HTTP_PORT)
         m.run()
     else:
         print(operation + "is an invalid operation")
-
-
-    
-    # Make a different command for: cleanup
-    # Make the top value up 
-    
-
-
-
-
-    # logging.info("scale-test started")
-    # datastructures to keep track of the timings
-    # TODO: process events and keep track of the results
-    #       results should be per pod/volume
-    #       information to keep track: pod index per sts
-    #       volume-creation time per pod
-    #       volume-attach time per pod
-    #       volume-detach time per pod
-    # pvc_to_va_map = dict()
-    # pvc_to_pod_map = dict()
-    # results = dict()
-
-    # start async event_loop
-    # event_loop = asyncio.get_event_loop()
-    # event_loop.create_task(watch_pods_async())
-    # event_loop.create_task(watch_pvc_async())
-    # event_loop.create_task(watch_va_async())
-    # event_loop.run_forever()
-    # logging.info("scale-test-finished")
-
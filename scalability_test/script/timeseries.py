@@ -0,0 +1,106 @@
+import json
+import os
+import shutil
+import struct
+
+import numpy as np
+
+COLUMN_SUFFIX = ".f64"
+SET_SUFFIX = ".log"
+META_FILE_NAME = "meta.json"
+
+class ColumnStore:
+    """
+    Append-only, array-backed store for the monitor time series.
+
+    Every series is a column file of little-endian float64 values, so an
+    append writes 8 bytes regardless of how long the run has been going
+    and reads are memory-mapped instead of parsed. Sets of names (such as
+    pods with a valid starting time) are append-only text files with one
+    entry per line, and the rarely changing metadata lives in meta.json.
+
+    Layout of the store directory:
+        meta.json
+        <series>.f64
+        <set>.log
+    """
+    def __init__(self, path, truncate=False):
+        self.path = path
+        if truncate and os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path, exist_ok=True)
+        self.writers = dict()
+        self.lengths = dict()
+
+    def column_path(self, series):
+        return os.path.join(self.path, series + COLUMN_SUFFIX)
+
+    def set_path(self, name):
+        return os.path.join(self.path, name + SET_SUFFIX)
+
+    def append(self, series, value):
+        writer = self.writers.get(series)
+        if writer is None:
+            self.lengths[series] = self.length(series)
+            writer = open(self.column_path(series), 'ab')
+            self.writers[series] = writer
+        writer.write(struct.pack('<d', value))
+        self.lengths[series] += 1
+
+    def append_many(self, series, values):
+        for value in values:
+            self.append(series, value)
+
+    def flush(self):
+        for writer in self.writers.values():
+            writer.flush()
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = dict()
+
+    def length(self, series):
+        if series in self.lengths:
+            return self.lengths[series]
+        path = self.column_path(series)
+        if not os.path.exists(path):
+            return 0
+        return os.path.getsize(path) // 8
+
+    def read(self, series):
+        # memory-mapped, nothing is loaded until the values are accessed
+        if series in self.writers:
+            self.writers[series].flush()
+        if self.length(series) == 0:
+            return np.empty(0, dtype='<f8')
+        return np.memmap(self.column_path(series), dtype='<f8', mode='r')
+
+    def series_names(self, prefix=""):
+        names = []
+        for file_name in os.listdir(self.path):
+            if file_name.startswith(prefix) and file_name.endswith(COLUMN_SUFFIX):
+                names.append(file_name[len(prefix):-len(COLUMN_SUFFIX)])
+        return sorted(names)
+
+    def add_to_set(self, name, item):
+        with open(self.set_path(name), 'a') as writer:
+            writer.write(item + "\n")
+
+    def read_set(self, name):
+        path = self.set_path(name)
+        if not os.path.exists(path):
+            return dict()
+        with open(path, 'r') as reader:
+            return {line.rstrip("\n"): True for line in reader if line.strip()}
+
+    def write_meta(self, meta):
+        # write then rename so a crash never leaves a truncated meta.json
+        path = os.path.join(self.path, META_FILE_NAME)
+        with open(path + ".tmp", 'w') as writer:
+            writer.write(json.dumps(meta))
+        os.replace(path + ".tmp", path)
+
+    def read_meta(self):
+        with open(os.path.join(self.path, META_FILE_NAME), 'r') as reader:
+            return json.loads(reader.read())